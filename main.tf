@@ -51,9 +51,22 @@ module "lambda" {
       RULES_SEPARATOR                 = var.rules_separator
       RULES                           = var.rules
       IGNORE_RULES                    = var.ignore_rules
+      RULES_SSM_PARAMETER_NAME        = var.rules_ssm_parameter_name == null ? "" : var.rules_ssm_parameter_name
+      RULE_ENGINE                     = var.rule_engine
       EVENTS_TO_TRACK                 = var.events_to_track
       LOG_LEVEL                       = var.log_level
       RULE_EVALUATION_ERRORS_TO_SLACK = var.rule_evaluation_errors_to_slack
+      RULE_METRICS                    = var.rule_metrics
+      STAGE_TIMINGS                   = var.stage_timings
+      COALESCE_ALERTS                 = var.coalesce_alerts
+      DIGEST_RULES                    = var.digest_rules
+      DIGEST_WINDOW_SECONDS           = var.digest_window_seconds
+      PRINCIPAL_ALERT_LIMIT           = var.principal_alert_limit
+      PRINCIPAL_ALERT_WINDOW_SECONDS  = var.principal_alert_window_seconds
+      PRINCIPAL_THROTTLE_SHARED       = var.principal_throttle_shared
+      PRE_PARSE_FILTER                = var.pre_parse_filter
+      DELIVERY_CONCURRENCY            = var.delivery_concurrency
+      CONFIG_CACHE_TTL_SECONDS        = var.config_cache_ttl_seconds
 
       DYNAMODB_TIME_TO_LIVE = var.dynamodb_time_to_live
       DYNAMODB_TABLE_NAME   = module.cloudtrail_to_slack_dynamodb_table.dynamodb_table_id
@@ -106,7 +119,10 @@ resource "aws_iam_policy" "ssm" {
 data "aws_iam_policy_document" "ssm" {
   statement {
     actions   = ["ssm:GetParameter"]
-    resources = [aws_ssm_parameter.slack_config.arn, aws_ssm_parameter.bot_token.arn]
+    resources = concat(
+      [aws_ssm_parameter.slack_config.arn, aws_ssm_parameter.bot_token.arn],
+      var.rules_ssm_parameter_name == null ? [] : ["arn:${data.aws_partition.current.partition}:ssm:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:parameter/${trimprefix(var.rules_ssm_parameter_name, "/")}"],
+    )
   }
 }
 
@@ -127,6 +143,10 @@ data "aws_iam_policy_document" "s3" {
     actions = [
       "dynamodb:PutItem",
       "dynamodb:GetItem",
+      "dynamodb:BatchGetItem",
+      "dynamodb:BatchWriteItem",
+      "dynamodb:UpdateItem",
+      "dynamodb:DeleteItem",
     ]
     resources = [
       module.cloudtrail_to_slack_dynamodb_table.dynamodb_table_arn
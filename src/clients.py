@@ -0,0 +1,16 @@
+from functools import lru_cache
+
+# boto3 clients are created the first time they are used, boto3 itself is imported then as well.
+# Webhook only setups without SNS never load it.
+
+
+@lru_cache(maxsize=None)
+def dynamodb_client(): # noqa: ANN201
+    import boto3
+    return boto3.client("dynamodb")
+
+
+@lru_cache(maxsize=None)
+def sns_client(): # noqa: ANN201
+    import boto3
+    return boto3.client("sns")
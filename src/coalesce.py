@@ -0,0 +1,47 @@
+"""
+Matching events of one invocation grouped by account, actor and event name, so an actor retrying
+a denied call in a loop becomes one alert with the number of occurrences instead of one per event.
+"""
+from typing import Any, Callable, Dict, Hashable, Iterable, List, NamedTuple, TypeVar
+
+T = TypeVar("T")
+
+# event ids shown in the Slack message of a group
+SAMPLE_EVENT_IDS = 5
+
+
+class AlertGroup(NamedTuple):
+    events: List[Dict[str, Any]]
+
+    @property
+    def count(self) -> int: # noqa: ANN101
+        return len(self.events)
+
+    @property
+    def first_time(self) -> str: # noqa: ANN101
+        # CloudTrail times are ISO 8601 in UTC, they sort as strings
+        return min(event.get("eventTime", "") for event in self.events)
+
+    @property
+    def last_time(self) -> str: # noqa: ANN101
+        return max(event.get("eventTime", "") for event in self.events)
+
+    def sample_event_ids(self, size: int = SAMPLE_EVENT_IDS) -> List[str]: # noqa: ANN101
+        return [event.get("eventID", "N/A") for event in self.events[:size]]
+
+
+def group_by_key(items: Iterable[T], key: Callable[[T], Hashable | None]) -> List[List[T]]:
+    """Groups in the order of their first item, items whose key is None are not grouped."""
+    groups: Dict[Hashable, List[T]] = {}
+    ordered: List[List[T]] = []
+    for item in items:
+        item_key = key(item)
+        if item_key is None:
+            ordered.append([item])
+            continue
+        group = groups.get(item_key)
+        if group is None:
+            group = groups[item_key] = []
+            ordered.append(group)
+        group.append(item)
+    return ordered
@@ -1,18 +1,39 @@
-from typing import List, Dict, Union
+from typing import Any, Callable, List, Dict, Mapping, Tuple, Union
 import os
 import json
 import http.client
+import threading
+import time
 import urllib3
+from concurrent.futures import ThreadPoolExecutor
 from rules import default_rules
+from rule_engine import RULE_ENGINE, RULE_ENGINES, RuleSet
 import logging
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+
+def build_routes(configuration: List[Dict]) -> Dict[str, Dict]:
+    """Maps every account to the first configuration entry that lists it, like a search from the top would."""
+    routes: Dict[str, Dict] = {}
+    for entry in configuration:
+        for account_id in entry["accounts"]:
+            routes.setdefault(account_id, entry)
+    return routes
 
 
 @dataclass
 class SlackWebhookConfig:
     default_hook_url: str | None
     configuration: List[Dict]
+    routes: Dict[str, Dict] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None: # noqa: ANN101
+        self.routes = build_routes(self.configuration or [])
+
+    def hook_url_for_account(self, account_id: str | None) -> str | None: # noqa: ANN101
+        entry = self.routes.get(account_id) if account_id else None
+        return entry["slack_hook_url"] if entry is not None else self.default_hook_url
 
 
 @dataclass
@@ -20,23 +41,43 @@ class SlackAppConfig:
     bot_token: str
     default_channel_id: str
     configuration: List[Dict]
+    routes: Dict[str, Dict] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None: # noqa: ANN101
+        self.routes = build_routes(self.configuration or [])
+
+    def channel_id_for_account(self, account_id: str | None) -> str: # noqa: ANN101
+        entry = self.routes.get(account_id) if account_id else None
+        return entry["slack_channel_id"] if entry is not None else self.default_channel_id
 
 http_client = urllib3.PoolManager()
+# a hanging extension fails the read instead of blocking the cold start or the background refresh
+EXTENSION_TIMEOUT = urllib3.Timeout(connect=1.0, read=5.0)
 
 ### Define function to retrieve values from extension local HTTP server cachce
 def retrieve_extension_value(url):
     port = os.environ['PARAMETERS_SECRETS_EXTENSION_HTTP_PORT']
     url = ('http://localhost:' + port + url)
     headers = { "X-Aws-Parameters-Secrets-Token": os.environ.get('AWS_SESSION_TOKEN') }
-    response = http_client.request("GET", url, headers=headers)
+    response = http_client.request("GET", url, headers=headers, timeout=EXTENSION_TIMEOUT, retries=False)
     response = json.loads(response.data)
     return response
 
 
-def get_slack_config() -> Union[SlackWebhookConfig, SlackAppConfig]:
-    raw_configuration = retrieve_extension_value(('/systemsmanager/parameters/get/?name=' + os.environ.get('CONFIG_SSM_PARAMETER_NAME', 'None')))['Parameter']['Value']
-    bot_token = retrieve_extension_value(('/systemsmanager/parameters/get/?withDecryption=true&name=' + os.environ.get('SLACK_BOT_TOKEN_SSM_PARAMETER_NAME', 'None')))['Parameter']['Value']
+CONFIG_PARAMETER_PATH = "/systemsmanager/parameters/get/?name="
+BOT_TOKEN_PARAMETER_PATH = "/systemsmanager/parameters/get/?withDecryption=true&name="
 
+
+def fetch_slack_parameters() -> Tuple[Dict, Dict]:
+    """Reads the configuration and the bot token parameter at the same time."""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        bot_token_path = BOT_TOKEN_PARAMETER_PATH + os.environ.get("SLACK_BOT_TOKEN_SSM_PARAMETER_NAME", "None")
+        bot_token = executor.submit(retrieve_extension_value, bot_token_path)
+        configuration = retrieve_extension_value(CONFIG_PARAMETER_PATH + os.environ.get("CONFIG_SSM_PARAMETER_NAME", "None"))
+        return configuration["Parameter"], bot_token.result()["Parameter"]
+
+
+def slack_config_from_parameters(raw_configuration: str, bot_token: str) -> Union[SlackWebhookConfig, SlackAppConfig]:
     logging.info(f"Retrieved Slack configuration: {raw_configuration}")
     print(f"Retrieved Slack configuration: {raw_configuration}")
     if bot_token:
@@ -53,6 +94,78 @@ def get_slack_config() -> Union[SlackWebhookConfig, SlackAppConfig]:
         raise Exception("Environment variable HOOK_URL or SLACK_BOT_TOKEN must be set.")
 
 
+def get_slack_config() -> Union[SlackWebhookConfig, SlackAppConfig]:
+    configuration, bot_token = fetch_slack_parameters()
+    return slack_config_from_parameters(configuration["Value"], bot_token["Value"])
+
+
+class SlackConfigCache:
+    """
+    Slack configuration read from the SSM parameters. Once it is older than ttl seconds it is read
+    again in the background while the current one is still used, and rebuilt only if the version
+    of one of the parameters changed. A ttl of 0 keeps the first configuration for the life of the container.
+    """
+
+    def __init__(
+        self, # noqa: ANN101
+        ttl: float,
+        fetch: Callable[[], Tuple[Dict, Dict]] = fetch_slack_parameters,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self._fetch = fetch
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._config: SlackWebhookConfig | SlackAppConfig | None = None
+        self._versions: Tuple[Any, Any] | None = None
+        self._fetched_at = 0.0
+        self._refreshing: threading.Thread | None = None
+
+    def get(self) -> Union[SlackWebhookConfig, SlackAppConfig]: # noqa: ANN101
+        with self._lock:
+            config = self._config
+            if config is not None and self.ttl > 0 and self._refreshing is None and self._clock() - self._fetched_at >= self.ttl:
+                self._refreshing = threading.Thread(target=self._refresh_in_background, name="slack-config-refresh", daemon=True)
+                self._refreshing.start()
+        if config is None:
+            return self.refresh()
+        return config
+
+    def refresh(self) -> Union[SlackWebhookConfig, SlackAppConfig]: # noqa: ANN101
+        configuration, bot_token = self._fetch()
+        versions = (configuration.get("Version"), bot_token.get("Version"))
+        with self._lock:
+            if self._config is None or versions != self._versions or None in versions:
+                self._config = slack_config_from_parameters(configuration["Value"], bot_token["Value"])
+                self._versions = versions
+            self._fetched_at = self._clock()
+            return self._config
+
+    def _refresh_in_background(self) -> None: # noqa: ANN101
+        try:
+            self.refresh()
+        except Exception as e:
+            # the current configuration stays in use, the next attempt is made after ttl
+            get_logger().exception({"Failed to refresh Slack configuration": {"error": str(e)}})
+            with self._lock:
+                self._fetched_at = self._clock()
+        finally:
+            with self._lock:
+                self._refreshing = None
+
+    def wait_for_refresh(self, timeout: float | None = None) -> None: # noqa: ANN101
+        refreshing = self._refreshing
+        if refreshing is not None:
+            refreshing.join(timeout)
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes")
+
+
 class Config:
     def __init__(self): # noqa: ANN101 ANN204
 
@@ -65,6 +178,29 @@ class Config:
         self.ignore_rules: List[str] = self.parse_rules_from_string(os.environ.get("IGNORE_RULES"), self.rules_separator) # noqa: E501
         self.use_default_rules: bool = os.environ.get("USE_DEFAULT_RULES", True) # type: ignore # noqa: PGH003
         self.events_to_track: str | None = os.environ.get("EVENTS_TO_TRACK")
+        # Events only these rules match are counted and summarized once per window, see digest.py
+        self.digest_rules: List[str] = self.parse_rules_from_string(os.environ.get("DIGEST_RULES"), self.rules_separator) # noqa: E501
+        self.digest_window_seconds: int = int(os.environ.get("DIGEST_WINDOW_SECONDS") or 3600)
+        # More rules, read from an SSM parameter or a file while the Lambda is running, see rule_source.py
+        self.rules_ssm_parameter_name: str | None = os.environ.get("RULES_SSM_PARAMETER_NAME") or None
+        self.rules_file: str | None = os.environ.get("RULES_FILE") or None
+        # Per rule evaluation metrics in CloudWatch Embedded Metric Format, see rule_metrics.py
+        self.rule_metrics: bool = env_flag("RULE_METRICS")
+        # Log time spent per stage with p50 and p99 at the end of every invocation, see tracing.py
+        self.stage_timings: bool = env_flag("STAGE_TIMINGS")
+        # Skip parsing of records that can not match any rule, ignore rules are not evaluated for them
+        self.pre_parse_filter: bool = env_flag("PRE_PARSE_FILTER")
+        # One Slack message per account, actor and event name for the matching events of an invocation, see coalesce.py
+        self.coalesce_alerts: bool = env_flag("COALESCE_ALERTS")
+        # Slack alerts per principal and window, the ones above are summarized once per window, see principal_throttle.py
+        self.principal_alert_limit: int = int(os.environ.get("PRINCIPAL_ALERT_LIMIT") or 0)
+        self.principal_alert_window_seconds: int = int(os.environ.get("PRINCIPAL_ALERT_WINDOW_SECONDS") or 300)
+        self.principal_throttle_shared: bool = env_flag("PRINCIPAL_THROTTLE_SHARED")
+        # Number of records whose SNS, DynamoDB and Slack calls run at the same time, 1 delivers them one by one
+        self.delivery_concurrency: int = max(1, int(os.environ.get("DELIVERY_CONCURRENCY") or 1))
+
+        # Seconds after which the Slack configuration and rules parameters are read again, 0 reads them once per container
+        self.config_cache_ttl_seconds: int = int(os.environ.get("CONFIG_CACHE_TTL_SECONDS") or 300)
 
         self.dynamodb_table_name: str | None = os.environ.get("DYNAMODB_TABLE_NAME")
         self.dynamodb_time_to_live: int = int(os.environ.get("DYNAMODB_TIME_TO_LIVE", 900))
@@ -77,9 +213,20 @@ class Config:
         if self.events_to_track:
             events_list = self.events_to_track.replace(" ", "").split(",")
             self.rules.append(f'"eventName" in event and event["eventName"] in {json.dumps(events_list)}')
-        if not self.rules:
+        if not self.rules and not (self.rules_ssm_parameter_name or self.rules_file):
             raise Exception("Have no rules to apply! Check configuration - add some, or enable default.")
 
+        if RULE_ENGINE not in RULE_ENGINES:
+            raise Exception(f"Unknown RULE_ENGINE {RULE_ENGINE}, use one of {', '.join(RULE_ENGINES)}")
+
+        # Rules are compiled once per container, so broken rules are reported here and not for every event
+        self.rule_set = RuleSet(self.rules)
+        self.ignore_rule_set = RuleSet(self.ignore_rules)
+        self.digest_rule_set = RuleSet(self.digest_rules)
+        self.rule_compilation_errors: List[Dict] = self.rule_set.errors + self.ignore_rule_set.errors + self.digest_rule_set.errors
+        for error in self.rule_compilation_errors:
+            get_logger().error({"Rule compilation failed": {"error": str(error["error"]), "rule": error["rule"]}})
+
     @staticmethod
     def parse_rules_from_string(rules_as_string: str | None, rules_separator: str) -> List[str]:
         if not rules_as_string:
@@ -90,6 +237,13 @@ class Config:
 
 
 
+def json_default(o: Any) -> Any: # noqa: ANN401
+    # Lazy views of the event are logged as the dict they stand for, anything else as its string form
+    if isinstance(o, Mapping):
+        return dict(o)
+    return str(o)
+
+
 class JsonFormatter(logging.Formatter):
     def format(self, record): # noqa: ANN001, ANN201, ANN101
         log_entry = {
@@ -100,7 +254,7 @@ class JsonFormatter(logging.Formatter):
         if isinstance(record.msg, dict):
             log_entry.update(record.msg)
 
-        return json.dumps(log_entry)
+        return json.dumps(log_entry, default=json_default)
 
 def get_logger(name: str ="main") -> logging.Logger:
     log_level = os.environ.get("LOG_LEVEL", "INFO")
@@ -0,0 +1,79 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Deque, Dict, Hashable, List
+
+from config import get_logger
+
+logger = get_logger()
+
+
+class OrderedExecutor:
+    """
+    Runs tasks on a bounded thread pool. Tasks submitted with the same key run one after another
+    in submission order, tasks without a key run independently.
+    At most max_pending tasks are queued or running, submit blocks until there is room.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int | None = None) -> None: # noqa: ANN101
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="delivery")
+        self._pending = threading.BoundedSemaphore(max_pending or max_workers * 4)
+        self._lock = threading.Lock()
+        self._lanes: Dict[Hashable, Deque[Callable[[], Any]]] = {}
+        self._futures: List[Future] = []
+
+    def submit(self, key: Hashable | None, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> None: # noqa: ANN101, ANN401
+        task = partial(fn, *args, **kwargs)
+        self._pending.acquire()
+        if key is None:
+            self._futures.append(self._executor.submit(self._run, task))
+            return
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is not None:
+                # the lane is drained by the worker that runs its first task
+                lane.append(task)
+                return
+            self._lanes[key] = deque([task])
+        self._futures.append(self._executor.submit(self._drain, key))
+
+    def _run(self, task: Callable[[], Any]) -> None: # noqa: ANN101
+        try:
+            task()
+        except Exception as e:
+            logger.exception({"Delivery failed": {"error": e}})
+            raise
+        finally:
+            self._pending.release()
+
+    def _drain(self, key: Hashable) -> None: # noqa: ANN101
+        error = None
+        while True:
+            with self._lock:
+                lane = self._lanes[key]
+                if not lane:
+                    del self._lanes[key]
+                    break
+                task = lane.popleft()
+            try:
+                self._run(task)
+            except Exception as e:
+                # later tasks of the lane still run, the first error is raised once the lane is empty
+                error = error or e
+        if error is not None:
+            raise error
+
+    def wait(self) -> None: # noqa: ANN101
+        """Waits for all submitted tasks and raises the first error."""
+        errors = [future.exception() for future in self._futures]
+        self._futures = []
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def __enter__(self) -> "OrderedExecutor": # noqa: ANN101
+        return self
+
+    def __exit__(self, *exc_info: object) -> None: # noqa: ANN101
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,124 @@
+"""
+Digest of noisy rules: events that only match a digest rule are not posted one by one, they are counted
+per window, account and rule in the DynamoDB table and summarized in one Slack message per channel
+once the window is over.
+
+Every window is one item, "digest#<start of the window>", updated with ADD once per invocation.
+The first invocation after the window ends claims the item by deleting it and sends the summary,
+DeleteItem returns the old item to only one caller, so the summary goes out at most once.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+import clients
+from config import Config, get_logger
+
+logger = get_logger()
+
+KEY_PREFIX = "digest#"
+# prefix of the counter attributes, "count#<account id>#<rule key>"
+COUNT_PREFIX = "count#"
+# counters added with one UpdateItem, to stay below the size limit of update expressions
+UPDATE_COUNTERS = 50
+# windows before the current one checked for a summary after a gap in invocations
+MAX_PENDING_WINDOWS = 24
+
+# (account id, rule key) -> number of events
+DigestCounts = Dict[Tuple[str, str], int]
+
+
+def rule_key(rule: str) -> str:
+    """Short stable name of a rule in attribute names, the rule itself can be longer than an attribute name may be."""
+    return hashlib.sha256(rule.encode()).hexdigest()[:12]
+
+
+def window_start(now: float, window_seconds: int) -> int:
+    return int(now // window_seconds * window_seconds)
+
+
+class DigestStore:
+    """Counts of one container, written at the end of every invocation."""
+
+    def __init__(self, cfg: Config, dynamodb_client=None, clock: Callable[[], float] = time.time) -> None: # noqa: ANN001, ANN101
+        self.cfg = cfg
+        self._dynamodb_client = dynamodb_client
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+        # start of the last window this container looked for a summary of
+        self._checked_window: int | None = None
+
+    @property
+    def window_seconds(self) -> int: # noqa: ANN101
+        return self.cfg.digest_window_seconds
+
+    def add(self, account_id: str, rule: str) -> None: # noqa: ANN101
+        with self._lock:
+            self._counts[(account_id, rule_key(rule))] += 1
+
+    def flush(self) -> None: # noqa: ANN101
+        """Adds the counts of this invocation to the item of the current window."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return
+        window = window_start(self._clock(), self.window_seconds)
+        # the item stays until it is claimed, or expires if nobody does
+        expire_at = window + 2 * self.window_seconds + self.cfg.dynamodb_time_to_live
+        items = sorted(counts.items())
+        for start in range(0, len(items), UPDATE_COUNTERS):
+            names = {"#ttl": "ttl"}
+            values: Dict[str, Any] = {":ttl": {"N": str(expire_at)}}
+            additions = []
+            for position, ((account_id, key), count) in enumerate(items[start:start + UPDATE_COUNTERS]):
+                names[f"#c{position}"] = f"{COUNT_PREFIX}{account_id}#{key}"
+                values[f":c{position}"] = {"N": str(count)}
+                additions.append(f"#c{position} :c{position}")
+            (self._dynamodb_client or clients.dynamodb_client()).update_item(
+                TableName = self.cfg.dynamodb_table_name,
+                Key = {"principal_structure_and_action_hash": {"S": f"{KEY_PREFIX}{window}"}},
+                UpdateExpression = f"ADD {', '.join(additions)} SET #ttl = if_not_exists(#ttl, :ttl)",
+                ExpressionAttributeNames = names,
+                ExpressionAttributeValues = values,
+            )
+        logger.info({"Added digest counts to DynamoDB": {"window": window, "counters": len(items)}})
+
+    def claim_summaries(self) -> List[Tuple[int, DigestCounts]]: # noqa: ANN101
+        """Counts of the windows that ended since the last check and that no other container claimed."""
+        current = window_start(self._clock(), self.window_seconds)
+        if self._checked_window is None:
+            first = current - self.window_seconds
+        else:
+            first = max(self._checked_window + self.window_seconds, current - MAX_PENDING_WINDOWS * self.window_seconds)
+        summaries = []
+        for window in range(first, current, self.window_seconds):
+            attributes = (self._dynamodb_client or clients.dynamodb_client()).delete_item(
+                TableName = self.cfg.dynamodb_table_name,
+                Key = {"principal_structure_and_action_hash": {"S": f"{KEY_PREFIX}{window}"}},
+                ReturnValues = "ALL_OLD",
+            ).get("Attributes")
+            if attributes:
+                summaries.append((window, parse_counts(attributes)))
+        self._checked_window = current - self.window_seconds
+        return summaries
+
+
+def parse_counts(attributes: Dict[str, Any]) -> DigestCounts:
+    counts = {}
+    for name, value in attributes.items():
+        if name.startswith(COUNT_PREFIX):
+            account_id, key = name[len(COUNT_PREFIX):].rsplit("#", 1)
+            counts[(account_id, key)] = int(value["N"])
+    return counts
+
+
+def group_by_destination(counts: DigestCounts, destination: Callable[[str], Hashable]) -> List[Tuple[str, DigestCounts]]:
+    """Counts per Slack channel or webhook, with an account that is routed to it."""
+    groups: Dict[Hashable, Tuple[str, DigestCounts]] = {}
+    for (account_id, key), count in sorted(counts.items()):
+        _, group = groups.setdefault(destination(account_id), (account_id, {}))
+        group[(account_id, key)] = count
+    return list(groups.values())
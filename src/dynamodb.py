@@ -1,10 +1,29 @@
 import hashlib
+import threading
 import time
+from typing import Dict, Iterable, List
 
+import clients
 from config import Config, get_logger
+from ttl_cache import TTLCache
 
 logger = get_logger()
 
+THREAD_CACHE_SIZE = 4096
+# a thread started by another container is picked up after this time
+MISS_CACHE_SECONDS = 10
+
+# thread_ts by hash for warm containers, None for hashes without a thread
+thread_ts_cache = TTLCache(THREAD_CACHE_SIZE)
+_NOT_CACHED = object()
+
+
+def cache_thread_ts(hash_value: str, item: dict | None) -> None:
+    if item is None:
+        thread_ts_cache.set(hash_value, None, MISS_CACHE_SECONDS)
+    else:
+        thread_ts_cache.set(hash_value, item["thread_ts"]["S"], int(item["ttl"]["N"]) - time.time())
+
 
 def hash_user_identity_and_event_name(event: dict,) -> str | None:
 
@@ -50,6 +69,7 @@ def put_event_to_dynamodb(
 
     logger.debug({"Putting event to DynamoDB": {"event": event}})
     expire_at = int(time.time()) + cfg.dynamodb_time_to_live
+    thread_ts_cache.set(hash_value, thread_ts, cfg.dynamodb_time_to_live)
 
     return dynamodb_client.put_item(
         TableName = cfg.dynamodb_table_name,
@@ -91,12 +111,121 @@ def get_thread_ts_from_dynamodb(
     hash_vaule = hash_user_identity_and_event_name(event)
     if not hash_vaule:
         return None
+    cached = thread_ts_cache.get(hash_vaule, _NOT_CACHED)
+    if cached is not _NOT_CACHED:
+        logger.info({"Found thread_ts in cache": {"thread_ts": cached}})
+        return cached
     item = check_dynamodb_for_similar_events(
         hash_value = hash_vaule,
         dynamodb_client = dynamodb_client,
         cfg = cfg
         )
+    cache_thread_ts(hash_vaule, item)
     if item:
         return item["thread_ts"]["S"]
     else:
         return None
+
+
+# DynamoDB limits for one BatchGetItem and BatchWriteItem request
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+BATCH_RETRIES = 5
+
+
+class ThreadStore:
+    """
+    thread_ts of the Slack threads used in one invocation. Hashes are read with BatchGetItem
+    before the messages are posted, new threads are visible right away and written with
+    BatchWriteItem by flush().
+    """
+
+    def __init__(self, cfg: Config, dynamodb_client=None) -> None: # noqa: ANN001, ANN101
+        self.cfg = cfg
+        self._dynamodb_client = dynamodb_client
+        self._lock = threading.Lock()
+        self._thread_ts: Dict[str, str | None] = {}
+        self._pending: Dict[str, str] = {}
+
+    def prefetch(self, hash_values: Iterable[str | None]) -> None: # noqa: ANN101
+        missing = []
+        with self._lock:
+            for hash_value in dict.fromkeys(h for h in hash_values if h and h not in self._thread_ts):
+                cached = thread_ts_cache.get(hash_value, _NOT_CACHED)
+                if cached is _NOT_CACHED:
+                    missing.append(hash_value)
+                else:
+                    self._thread_ts[hash_value] = cached
+        for start in range(0, len(missing), BATCH_GET_SIZE):
+            found = self._batch_get(missing[start:start + BATCH_GET_SIZE])
+            with self._lock:
+                for hash_value in missing[start:start + BATCH_GET_SIZE]:
+                    item = found.get(hash_value)
+                    cache_thread_ts(hash_value, item)
+                    self._thread_ts.setdefault(hash_value, item["thread_ts"]["S"] if item else None)
+
+    def _batch_get(self, hash_values: List[str]) -> Dict[str, dict]: # noqa: ANN101
+        found = {}
+        now = int(time.time())
+        request = {
+            self.cfg.dynamodb_table_name: {
+                "Keys": [{"principal_structure_and_action_hash": {"S": h}} for h in hash_values],
+                "ProjectionExpression": "#hash, thread_ts, #ttl",
+                "ExpressionAttributeNames": {"#hash": "principal_structure_and_action_hash", "#ttl": "ttl"},
+            }
+        }
+        dynamodb_client = self._dynamodb_client or clients.dynamodb_client()
+        for attempt in range(BATCH_RETRIES):
+            response = dynamodb_client.batch_get_item(RequestItems=request)
+            for item in response.get("Responses", {}).get(self.cfg.dynamodb_table_name, []):
+                # expired items are treated as if they don't exist, like in check_dynamodb_for_similar_events
+                if int(item["ttl"]["N"]) >= now:
+                    found[item["principal_structure_and_action_hash"]["S"]] = item
+            request = response.get("UnprocessedKeys")
+            if not request:
+                break
+            time.sleep(0.05 * 2 ** attempt)
+        else:
+            logger.warning({"DynamoDB did not return all thread_ts, new threads are started for them": {"unprocessed": request}})
+        logger.info({"Read thread_ts from DynamoDB": {"requested": len(hash_values), "found": len(found)}})
+        return found
+
+    def get(self, hash_value: str) -> str | None: # noqa: ANN101
+        with self._lock:
+            known = hash_value in self._thread_ts
+        if not known:
+            self.prefetch([hash_value])
+        with self._lock:
+            return self._thread_ts.get(hash_value)
+
+    def put(self, hash_value: str, thread_ts: str) -> None: # noqa: ANN101
+        with self._lock:
+            self._thread_ts[hash_value] = thread_ts
+            self._pending[hash_value] = thread_ts
+        thread_ts_cache.set(hash_value, thread_ts, self.cfg.dynamodb_time_to_live)
+
+    def flush(self) -> None: # noqa: ANN101
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        expire_at = str(int(time.time()) + self.cfg.dynamodb_time_to_live)
+        requests = [
+            {"PutRequest": {"Item": {
+                "principal_structure_and_action_hash": {"S": hash_value},
+                "thread_ts": {"S": thread_ts},
+                "ttl": {"N": expire_at},
+            }}}
+            for hash_value, thread_ts in pending.items()
+        ]
+        dynamodb_client = self._dynamodb_client or clients.dynamodb_client()
+        for start in range(0, len(requests), BATCH_WRITE_SIZE):
+            request = {self.cfg.dynamodb_table_name: requests[start:start + BATCH_WRITE_SIZE]}
+            for attempt in range(BATCH_RETRIES):
+                request = dynamodb_client.batch_write_item(RequestItems=request).get("UnprocessedItems")
+                if not request:
+                    break
+                time.sleep(0.05 * 2 ** attempt)
+            else:
+                logger.error({"Failed to save thread_ts to DynamoDB": {"unprocessed": request}})
+        logger.info({"Saved thread_ts to DynamoDB": {"count": len(requests)}})
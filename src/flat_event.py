@@ -0,0 +1,108 @@
+from typing import Any, Dict, Iterator, List, Mapping
+
+_MISSING = object()
+
+
+# Flatten json
+def flatten_json(y: dict) -> dict:
+    out = {}
+
+    def flatten(x, name=""): # noqa: ANN001, ANN202
+        if type(x) is dict:
+            for a in x:
+                flatten(x[a], name + a + ".")
+        elif type(x) is list:
+            i = 0
+            for a in x:
+                flatten(a, name + str(i) + ".")
+                i += 1
+        else:
+            out[name[:-1]] = x
+
+    flatten(y)
+    return out
+
+
+def _child(node: Any, segment: str) -> Any: # noqa: ANN401
+    if type(node) is dict:
+        return node.get(segment, _MISSING)
+    if segment.isascii() and segment.isdigit() and str(int(segment)) == segment and int(segment) < len(node):
+        return node[int(segment)]
+    return _MISSING
+
+
+def _find(node: Any, key: str, found: List[Any]) -> None: # noqa: ANN401
+    """Collects every leaf whose flattened key is `key`, keys of the event can contain dots themselves."""
+    child = _child(node, key)
+    if child is not _MISSING and type(child) is not dict and type(child) is not list:
+        found.append(child)
+
+    separator = key.find(".")
+    while separator != -1:
+        child = _child(node, key[:separator])
+        if type(child) is dict or type(child) is list:
+            _find(child, key[separator + 1:], found)
+        separator = key.find(".", separator + 1)
+
+
+class LazyFlatEvent(Mapping[str, Any]):
+    """
+    Read only view of flatten_json(event) without None values.
+
+    Dotted keys like "userIdentity.arn" are resolved on demand, the flat dict is built
+    only when the view is iterated, compared or logged.
+    """
+
+    __slots__ = ("_event", "_resolved", "_flat")
+
+    def __init__(self, event: dict) -> None: # noqa: ANN101
+        self._event = event
+        self._resolved: Dict[str, Any] = {}
+        self._flat: Dict[str, Any] | None = None
+
+    def _resolve(self, key: str) -> Any: # noqa: ANN101, ANN401
+        if self._flat is not None:
+            return self._flat.get(key, _MISSING)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        found: List[Any] = []
+        if isinstance(key, str):
+            _find(self._event, key, found)
+        if len(found) > 1:
+            # several paths flatten to the same key, let flatten_json decide which one wins
+            value = self.materialize().get(key, _MISSING)
+        elif found and found[0] is not None:
+            value = found[0]
+        else:
+            value = _MISSING
+        self._resolved[key] = value
+        return value
+
+    def __getitem__(self, key: str) -> Any: # noqa: ANN101, ANN401
+        value = self._resolve(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any: # noqa: ANN101, ANN401
+        value = self._resolve(key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key: object) -> bool: # noqa: ANN101
+        return self._resolve(key) is not _MISSING # type: ignore # noqa: PGH003
+
+    def __iter__(self) -> Iterator[str]: # noqa: ANN101
+        return iter(self.materialize())
+
+    def __len__(self) -> int: # noqa: ANN101
+        return len(self.materialize())
+
+    def __repr__(self) -> str: # noqa: ANN101
+        return f"LazyFlatEvent({self.materialize()!r})"
+
+    def materialize(self) -> Dict[str, Any]: # noqa: ANN101
+        if self._flat is None:
+            self._flat = {k: v for k, v in flatten_json(self._event).items() if v is not None}
+        return self._flat
@@ -0,0 +1,157 @@
+import binascii
+import codecs
+import json
+import re
+import zlib
+from typing import Any, Dict, Iterator, List, NamedTuple
+
+from config import get_logger
+from prefilter import could_match
+from rule_engine import RuleSet
+
+# base64 input is decoded this many characters at a time, has to be a multiple of 4
+BASE64_CHUNK_SIZE = 64 * 1024
+# upper bound for the text decompressed in one step
+DECOMPRESS_CHUNK_SIZE = 256 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+class LogBatch(NamedTuple):
+    """Values of a subscription payload shared by all of its records."""
+    log_group: str
+    owner: str
+
+
+class CloudTrailRecord(NamedTuple):
+    event: Dict[str, Any]
+    batch: LogBatch
+
+
+def _text_chunks(data: str) -> Iterator[str]:
+    """Decodes base64, gzip and UTF-8 of the payload incrementally."""
+    decompressor = zlib.decompressobj(wbits=31) # gzip header and trailer
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    for start in range(0, len(data), BASE64_CHUNK_SIZE):
+        compressed = binascii.a2b_base64(data[start:start + BASE64_CHUNK_SIZE])
+        while compressed:
+            text = text_decoder.decode(decompressor.decompress(compressed, DECOMPRESS_CHUNK_SIZE))
+            if text:
+                yield text
+            compressed = decompressor.unconsumed_tail
+    text = text_decoder.decode(decompressor.flush(), final=True)
+    if not decompressor.eof:
+        raise EOFError("Compressed payload ended before the end-of-stream marker was reached")
+    if text:
+        yield text
+
+
+class _JsonStream:
+    """Reads JSON values one at a time from a stream of text chunks, consumed text is dropped."""
+
+    def __init__(self, chunks: Iterator[str]) -> None: # noqa: ANN101
+        self._chunks = chunks
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+
+    def _fill(self, min_size: int) -> None: # noqa: ANN101
+        parts = [self._buffer[self._position:]]
+        size = 0
+        for chunk in self._chunks:
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= min_size:
+                break
+        else:
+            self._eof = True
+        self._buffer = "".join(parts)
+        self._position = 0
+
+    def peek(self) -> str: # noqa: ANN101
+        """Skips whitespace and returns the next character, an empty string at the end of the input."""
+        while True:
+            self._position = _WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if self._eof:
+                return ""
+            self._fill(1)
+
+    def expect(self, characters: str) -> str: # noqa: ANN101
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError(f"Expected one of {characters!r} in CloudWatch Logs payload, found {character!r}")
+        self._position += 1
+        return character
+
+    def value(self) -> Any: # noqa: ANN101, ANN401
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._position)
+                # a number at the end of the buffer can continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._position = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # read at least as much again as is pending, large values are decoded in a few attempts
+            self._fill(len(self._buffer) - self._position)
+
+
+def _elements(stream: _JsonStream, opening: str, closing: str) -> Iterator[None]:
+    """Steps through the object or array at the stream position, the caller reads one element per step."""
+    stream.expect(opening)
+    if stream.peek() == closing:
+        stream.expect(closing)
+        return
+    while True:
+        yield
+        if stream.expect("," + closing) == closing:
+            return
+
+
+def iter_cloudtrail_log_records(event: Dict[str, Any], rule_set: RuleSet | None = None) -> Iterator[CloudTrailRecord]:
+    """
+    Yields the CloudTrail records of a CloudWatch Logs subscription payload while it is decoded,
+    the payload is never held in full. If a rule set is given, records that can not match
+    any of its rules are dropped before they are parsed.
+    """
+    stream = _JsonStream(_text_chunks(event["awslogs"]["data"]))
+    header: Dict[str, Any] = {}
+    batch = None
+    # messages that come before logGroup and owner in the payload, CloudWatch Logs writes them first
+    pending: List[str] = []
+    total = rejected = 0
+
+    for _ in _elements(stream, "{", "}"):
+        key = stream.value()
+        if type(key) is not str:
+            raise ValueError(f"Expected a key in CloudWatch Logs payload, found {key!r}")
+        stream.expect(":")
+        if key != "logEvents":
+            header[key] = stream.value()
+            if batch is None and "logGroup" in header and "owner" in header:
+                batch = LogBatch(header["logGroup"], header["owner"])
+            continue
+        for _ in _elements(stream, "[", "]"):
+            message = stream.value()["message"]
+            total += 1
+            if rule_set is not None and not could_match(message, rule_set):
+                rejected += 1
+            elif batch is None:
+                pending.append(message)
+            else:
+                yield CloudTrailRecord(json.loads(message), batch)
+    if stream.peek():
+        raise ValueError("Extra data after CloudWatch Logs payload")
+
+    if pending:
+        batch = LogBatch(header["logGroup"], header["owner"])
+        for message in pending:
+            yield CloudTrailRecord(json.loads(message), batch)
+    if rejected:
+        get_logger().info({"Records rejected before parsing": {"rejected": rejected, "total": total}})
@@ -14,51 +14,106 @@
 # KIND, either express or implied.  See the License for the
 # specific language governing permissions and limitations
 # under the License.
-import gzip
+import contextlib
 import json
-import base64
+import logging
 import os
 import sys
 import urllib
-from typing import Any, Dict, List, NamedTuple
-
-import boto3
-from config import Config, SlackAppConfig, SlackWebhookConfig, get_logger, get_slack_config
-from dynamodb import get_thread_ts_from_dynamodb, put_event_to_dynamodb
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Sequence, Set
+
+import clients
+import coalesce
+import digest
+import tracing
+from config import Config, SlackAppConfig, SlackConfigCache, SlackWebhookConfig, get_logger, get_slack_config
+from delivery import OrderedExecutor
+from digest import DigestStore
+from dynamodb import ThreadStore, hash_user_identity_and_event_name
+from flat_event import LazyFlatEvent, flatten_json # noqa: F401
+from log_stream import iter_cloudtrail_log_records
+from principal_throttle import PrincipalThrottle, principal_of
+from rule_engine import CompiledRule, RuleSet, as_rule_set, evaluate_rule
+from rule_metrics import RuleMetrics
+from rule_source import RuleSnapshot, RuleStore
 from slack_helpers import (
+    add_occurrences_to_slack_message,
     event_to_slack_message,
+    message_for_digest,
     message_for_rule_evaluation_error_notification,
     message_for_slack_error_notification,
+    message_for_suppressed_alerts,
     post_message,
 )
-from slack_sdk.web.slack_response import SlackResponse
-from sns import send_message_to_sns
+from slack_transport import scheduler as slack_scheduler
+from sns import SnsBatch, send_message_to_sns
+from tracing import CollectingTracer
+
+if TYPE_CHECKING:
+    # slack_sdk is only loaded when the Slack app is used
+    from slack_sdk.web.slack_response import SlackResponse
 
 cfg = Config()
 logger = get_logger()
 slack_config = {}
+slack_config_cache = SlackConfigCache(ttl = cfg.config_cache_ttl_seconds)
+rule_store = RuleStore.from_config(cfg)
+rule_compilation_errors_reported: Set[str | None] = set()
+digest_store = DigestStore(cfg)
+principal_throttle = PrincipalThrottle(cfg)
 
-s3_client = boto3.client("s3")
-dynamodb_client = boto3.client("dynamodb")
-sns_client = boto3.client("sns")
 
 def slack_config_cached():
-    global slack_config
-    if not slack_config:
-        slack_config = get_slack_config()
-    return slack_config
+    # a configuration set on the module is used as it is, e.g. for local testing
+    if slack_config:
+        return slack_config
+    return slack_config_cache.get()
+
+def report_rule_compilation_errors(rules: RuleSnapshot) -> None:
+    # Compilation errors are known once the rules are loaded, report them only once per rules version
+    if rules.digest in rule_compilation_errors_reported or not cfg.rule_evaluation_errors_to_slack:
+        return
+    rule_compilation_errors_reported.add(rules.digest)
+    for error in rules.errors:
+        post_message(
+            message = message_for_rule_evaluation_error_notification(
+            error = error["error"],
+            object_key = "N/A (rule failed to compile)",
+            rule = error["rule"],
+            ),
+            account_id = None,
+            slack_config = slack_config_cached(),
+        )
 
 def lambda_handler(event, context) -> int:
     # noqa: ANN001
-    records = get_cloudtrail_log_records(event)
+    # Slack messages that would be sent after the Lambda timed out are dropped instead
+    if hasattr(context, "get_remaining_time_in_millis"):
+        slack_scheduler.set_deadline(context.get_remaining_time_in_millis() / 1000)
+    metrics = None
+    # spans of this invocation, the no-op tracer unless stage timings are enabled
+    tracer = CollectingTracer() if cfg.stage_timings else tracing.NOOP_TRACER
+    previous_tracer = tracing.set_tracer(tracer)
     try:
-        for record in records:
+        # new rules are only picked up here, all records of an invocation see the same ones
+        rules = rule_store.current()
+        if cfg.rule_metrics:
+            metrics = RuleMetrics(rules.rule_set, rules.ignore_rule_set)
+        report_rule_compilation_errors(rules)
+        # records are decoded while they are processed, see get_cloudtrail_log_records for a list
+        records = iter_cloudtrail_log_records(event, pre_parse_rule_set(rules) if cfg.pre_parse_filter else None)
+        invocation = Invocation([], metrics, rules.digest_rule_set, SnsBatch(cfg))
+        for record in tracing.timed("decode", records):
             handle_event(
-                event = record["event"],
-                source_file_object_key = record['key'],
-                rules = cfg.rules,
-                ignore_rules = cfg.ignore_rules
+                event = record.event,
+                source_file_object_key = record.batch.log_group,
+                rules = rules.rule_set,
+                ignore_rules = rules.ignore_rule_set,
+                invocation = invocation,
             )
+        deliver_invocation(invocation.deliveries, invocation.sns_batch)
 
     except Exception as e:
         logger.exception({"Failed to process event": e})
@@ -67,74 +122,158 @@ def lambda_handler(event, context) -> int:
             account_id = None,
             slack_config = slack_config_cached(),
         )
+    finally:
+        tracing.set_tracer(previous_tracer)
+        if isinstance(tracer, CollectingTracer):
+            logger.info({"Stage timings": tracer.summary()})
+        if metrics is not None:
+            metrics.emit()
     return 200
 
 
+def deliver_invocation(deliveries: List["Delivery"], sns_batch: SnsBatch) -> None:
+    """Delivers the matching events of an invocation once all records are read, then sends the summaries that are due."""
+    if cfg.coalesce_alerts:
+        deliveries = coalesce_deliveries(deliveries)
+    if cfg.principal_alert_limit:
+        deliveries = throttle_deliveries(deliveries, sns_batch)
 
-def get_cloudtrail_log_records(event) -> Dict | None:
-    records = []
-    cw_data = event['awslogs']['data']
-    compressed_payload = base64.b64decode(cw_data)
-    uncompressed_payload = gzip.decompress(compressed_payload)
-    payload = json.loads(uncompressed_payload)
-
-    log_events = payload['logEvents']
-    for log_event in log_events:
-        records.append(
-            {
-                'key': payload['logGroup'],
-                'accountId': payload['owner'],
-                'event': json.loads(log_event['message']),
-            }
-        )
-    return records
+    # threads of all matching events are looked up at once, new ones are saved at the end
+    thread_store = ThreadStore(cfg)
+    with tracing.span("dynamodb"):
+        thread_store.prefetch(delivery.thread_key for delivery in deliveries)
+    try:
+        deliver_events(deliveries, thread_store, sns_batch)
+    finally:
+        with tracing.span("dynamodb"):
+            thread_store.flush()
+        with tracing.span("sns"):
+            failed = sns_batch.flush().count(500)
+        if failed:
+            logger.error({"Failed to send messages to SNS": {"failed": failed}})
+
+    if cfg.principal_alert_limit:
+        send_suppressed_summaries()
+    if cfg.digest_rules:
+        with tracing.span("dynamodb"):
+            digest_store.flush()
+        send_digest_summaries()
+
+
+def get_cloudtrail_log_records(event, rule_set: RuleSet | None = None) -> List[Dict[str, Any]]: # noqa: ANN001
+    """
+    Decodes the CloudWatch Logs subscription payload. If a rule set is given, records that
+    can not match any of its rules are dropped before they are parsed.
+    """
+    return [
+        {
+            'key': record.batch.log_group,
+            'accountId': record.batch.owner,
+            'event': record.event,
+        }
+        for record in iter_cloudtrail_log_records(event, rule_set)
+    ]
 
 class ProcessingResult(NamedTuple):
     should_be_processed: bool
     errors: List[Dict[str, Any]]
+    # the digest rule the event matched, if it matched no other rule
+    digest_rule: str | None = None
+
+
+class Delivery(NamedTuple):
+    event: Dict[str, Any]
+    source_file_object_key: str
+    account_id: str
+    # hash of the Slack thread the message belongs to, None in webhook mode
+    thread_key: str | None
+    # all events of a coalesced alert, event is the first of them
+    events: List[Dict[str, Any]] | None = None
+
+
+class Invocation(NamedTuple):
+    # matching events, delivered once all records of the invocation are read
+    deliveries: List[Delivery]
+    metrics: RuleMetrics | None = None
+    digest_rules: RuleSet | None = None
+    # events counted by digest rules are published with the ones that are delivered
+    sns_batch: SnsBatch | None = None
 
 
 def should_message_be_processed(
     event: Dict[str, Any],
-    rules: List[str],
-    ignore_rules: List[str],
+    rules: RuleSet | Sequence[str | CompiledRule],
+    ignore_rules: RuleSet | Sequence[str | CompiledRule],
+    metrics: RuleMetrics | None = None,
+    digest_rules: RuleSet | None = None,
 ) -> ProcessingResult:
-    flat_event = flatten_json(event)
-    flat_event = {k: v for k, v in flat_event.items() if v is not None}
-    logger.debug({"Rules:": rules, "ignore_rules": ignore_rules})
-    logger.debug({"Flattened event": flat_event})
+    flat_event = LazyFlatEvent(event)
+    rule_set = as_rule_set(rules)
+    ignore_rule_set = as_rule_set(ignore_rules)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug({"Rules:": [rule.source for rule in rule_set.rules], "ignore_rules": [rule.source for rule in ignore_rule_set.rules]}) # noqa: E501
+        logger.debug({"Flattened event": flat_event})
 
     errors = []
-    for ignore_rule in ignore_rules:
-        try:
-            if eval(ignore_rule, {}, {"event": flat_event}) is True: # noqa: PGH001
-                logger.info({"Event matched ignore rule and will not be processed": {"ignore_rule": ignore_rule, "flat_event": flat_event}}) # noqa: E501
-                return ProcessingResult(False, errors)
-        except Exception as e:
-            logger.exception({"Event parsing failed": {"error": e, "ignore_rule": ignore_rule, "flat_event": flat_event}}) # noqa: E501
-            errors.append({"error": e, "rule": ignore_rule})
+    # Config reports compilation errors once, rules passed as plain lists get them reported with the result
+    if not isinstance(ignore_rules, RuleSet):
+        errors += ignore_rule_set.errors
+    ignore_rule = first_matching_rule(ignore_rule_set, flat_event, errors, metrics, "ignore_rule")
+    if ignore_rule is not None:
+        logger.info({"Event matched ignore rule and will not be processed": {"ignore_rule": ignore_rule.source, "flat_event": flat_event}}) # noqa: E501
+        return ProcessingResult(False, errors)
+
+    if not isinstance(rules, RuleSet):
+        errors += rule_set.errors
+    rule = first_matching_rule(rule_set, flat_event, errors, metrics)
+    if rule is not None:
+        logger.info({"Event matched rule and will be processed": {"rule": rule.source, "flat_event": flat_event}}) # noqa: E501
+        return ProcessingResult(True, errors)
+
+    # digest rules are only evaluated for events no other rule matched, those are posted right away
+    rule = first_matching_rule(digest_rules, flat_event, errors) if digest_rules is not None else None
+    if rule is not None:
+        logger.info({"Event matched digest rule and will be counted": {"rule": rule.source}})
+        return ProcessingResult(False, errors, rule.source)
+
+    # log the original event, flattening every event that does not match would defeat the lazy view
+    logger.info({"Event did not match any rules and will not be processed": {"event": event}}) # noqa: E501
+    return ProcessingResult(False, errors)
 
-    for rule in rules:
+
+def first_matching_rule(
+    rule_set: RuleSet,
+    flat_event: LazyFlatEvent,
+    errors: List[Dict[str, Any]],
+    metrics: RuleMetrics | None = None,
+    kind: str = "rule",
+) -> CompiledRule | None:
+    # rules that fail are added to errors and count as not matching
+    counters = metrics.counters_for(rule_set) if metrics else None
+    for position in rule_set.candidate_positions(flat_event):
+        rule = rule_set.rules[position]
         try:
-            if eval(rule, {}, {"event": flat_event}) is True: # noqa: PGH001
-                logger.info({"Event matched rule and will be processed": {"rule": rule, "flat_event": flat_event}}) # noqa: E501
-                return ProcessingResult(True, errors)
+            if counters.evaluate(position, rule, flat_event) if counters else evaluate_rule(rule, flat_event):
+                return rule
         except Exception as e:
-            logger.exception({"Event parsing failed": {"error": e, "rule": rule, "flat_event": flat_event}})
-            errors.append({"error": e, "rule": rule})
-
-    logger.info({"Event did not match any rules and will not be processed": {"event": flat_event}}) # noqa: E501
-    return ProcessingResult(False, errors)
+            logger.exception({"Event parsing failed": {"error": e, kind: rule.source, "flat_event": flat_event}})
+            errors.append({"error": e, "rule": rule.source})
+    return None
 
 
 def handle_event(
     event: Dict[str, Any],
     source_file_object_key: str,
-    rules: List[str],
-    ignore_rules: List[str],
-) -> SlackResponse | None:
-
-    result = should_message_be_processed(event, rules, ignore_rules)
+    rules: RuleSet | Sequence[str | CompiledRule],
+    ignore_rules: RuleSet | Sequence[str | CompiledRule],
+    invocation: Invocation | None = None,
+) -> "SlackResponse | None":
+
+    with tracing.span("rules"):
+        if invocation is None:
+            result = should_message_be_processed(event, rules, ignore_rules)
+        else:
+            result = should_message_be_processed(event, rules, ignore_rules, invocation.metrics, invocation.digest_rules)
     account_id = event["recipientAccountId"] if "recipientAccountId" in event else ""
     if cfg.rule_evaluation_errors_to_slack:
         for error in result.errors:
@@ -148,85 +287,207 @@ def handle_event(
                 slack_config = slack_config_cached(),
             )
 
+    if result.digest_rule is not None:
+        digest_store.add(account_id, result.digest_rule)
+        # only the Slack messages are summed up, SNS subscribers still get every event
+        if invocation is not None and invocation.sns_batch is not None:
+            invocation.sns_batch.add(event, source_file_object_key, account_id)
+        return None
+
     if not result.should_be_processed:
         return
 
+    if invocation is not None:
+        invocation.deliveries.append(Delivery(event, source_file_object_key, account_id, delivery_key(event)))
+        return None
+    return deliver_event(Delivery(event, source_file_object_key, account_id, delivery_key(event)))
+
+
+@lru_cache(maxsize=4)
+def pre_parse_rule_set(rules: RuleSnapshot) -> RuleSet:
+    # records only a digest rule matches are counted, the pre-parse filter must not drop them
+    if rules.digest_rule_set is None:
+        return rules.rule_set
+    return RuleSet(rules.rule_set.rules + rules.digest_rule_set.rules)
+
+
+def send_digest_summaries() -> None:
+    # Windows that ended are summarized once, in one message per channel with matches in the window
+    slack_config = slack_config_cached()
+    if isinstance(slack_config, SlackAppConfig):
+        destination = slack_config.channel_id_for_account
+    else:
+        destination = slack_config.hook_url_for_account
+    sources = {digest.rule_key(rule.source): rule.source for rule in cfg.digest_rule_set.rules}
+    for window, counts in digest_store.claim_summaries():
+        start, end = (
+            datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d %H:%M")
+            for seconds in (window, window + cfg.digest_window_seconds)
+        )
+        for account_id, channel_counts in digest.group_by_destination(counts, destination):
+            by_rule: Dict[str, Dict[str, int]] = {}
+            for (count_account_id, key), count in channel_counts.items():
+                # rules removed from the configuration since are shown by their key
+                by_rule.setdefault(sources.get(key, f"rule {key}"), {})[count_account_id] = count
+            post_message(
+                message = message_for_digest(start, end, list(by_rule.items())),
+                account_id = account_id,
+                slack_config = slack_config,
+            )
+
+
+def delivery_key(event: Dict[str, Any]) -> str | None:
+    # Messages of one Slack thread are delivered in order, the first one creates the thread
+    if isinstance(slack_config_cached(), SlackAppConfig):
+        return hash_user_identity_and_event_name(event)
+    return None
+
+
+def coalesce_deliveries(deliveries: List[Delivery]) -> List[Delivery]:
+    # One delivery per account and hash of actor and event name, events without a hash are delivered alone
+    def key(delivery: Delivery) -> tuple | None:
+        hash_value = delivery.thread_key or hash_user_identity_and_event_name(delivery.event)
+        return (delivery.account_id, hash_value) if hash_value else None
+
+    coalesced = []
+    for group in coalesce.group_by_key(deliveries, key):
+        events = [delivery.event for delivery in group]
+        coalesced.append(group[0]._replace(events = events) if len(events) > 1 else group[0])
+    if len(coalesced) < len(deliveries):
+        logger.info({"Coalesced alerts": {"events": len(deliveries), "messages": len(coalesced)}})
+    return coalesced
+
+
+def throttle_deliveries(deliveries: List[Delivery], sns_batch: SnsBatch) -> List[Delivery]:
+    # Alerts of a principal over its limit are not posted to Slack, SNS subscribers still get their events
+    alerts = [
+        (principal_of(delivery.event), delivery.account_id, len(delivery.events or [delivery.event]))
+        for delivery in deliveries
+    ]
+    with tracing.span("dynamodb") if cfg.principal_throttle_shared else contextlib.nullcontext():
+        admitted = principal_throttle.admit(alerts)
+    for delivery, admit in zip(deliveries, admitted, strict=True):
+        if not admit:
+            for event in delivery.events or [delivery.event]:
+                sns_batch.add(event, delivery.source_file_object_key, delivery.account_id)
+    return [delivery for delivery, admit in zip(deliveries, admitted, strict=True) if admit]
+
+
+def send_suppressed_summaries() -> None:
+    for (principal_account_id, principal), suppression in principal_throttle.due_summaries():
+        post_message(
+            message = message_for_suppressed_alerts(
+                principal = principal,
+                principal_account_id = principal_account_id,
+                count = suppression.count,
+                since = datetime.fromtimestamp(suppression.since, timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            ),
+            account_id = suppression.account_id,
+            slack_config = slack_config_cached(),
+        )
+
+
+def deliver_events(deliveries: List[Delivery], thread_store: ThreadStore, sns_batch: SnsBatch | None = None) -> None:
+    if cfg.delivery_concurrency > 1 and len(deliveries) > 1:
+        # SNS, DynamoDB and Slack calls run on the pool, messages of one Slack thread in order
+        with OrderedExecutor(cfg.delivery_concurrency) as executor:
+            for delivery in deliveries:
+                executor.submit(delivery.thread_key, deliver_event, delivery, thread_store, sns_batch)
+            executor.wait()
+    else:
+        for delivery in deliveries:
+            deliver_event(delivery, thread_store, sns_batch)
+
+
+def deliver_event(
+    delivery: Delivery,
+    thread_store: ThreadStore | None = None,
+    sns_batch: SnsBatch | None = None,
+) -> "SlackResponse | None":
+    event, source_file_object_key, account_id, _, events = delivery
     # log full event if it is AccessDenied
     if ("errorCode" in event and "AccessDenied" in event["errorCode"]):
         event_as_string = json.dumps(event, indent=4)
         logger.info({"errorCode": "AccessDenied", "log full event": event_as_string})
 
-    message = event_to_slack_message(event, source_file_object_key, account_id)
-
-    send_message_to_sns(
-        event = event,
-        source_file = source_file_object_key,
-        account_id = account_id,
-        cfg = cfg,
-        sns_client = sns_client,
-    )
+    with tracing.span("slack_message"):
+        message = event_to_slack_message(event, source_file_object_key, account_id)
+        if events and len(events) > 1:
+            group = coalesce.AlertGroup(events)
+            message = add_occurrences_to_slack_message(message, group.count, group.first_time, group.last_time, group.sample_event_ids())
+
+    # SNS subscribers get every event, also the ones of a coalesced alert
+    for sns_event in events or [event]:
+        if sns_batch is not None:
+            # published with PublishBatch once all events of the invocation are delivered
+            sns_batch.add(sns_event, source_file_object_key, account_id)
+        else:
+            with tracing.span("sns"):
+                send_message_to_sns(
+                    event = sns_event,
+                    source_file = source_file_object_key,
+                    account_id = account_id,
+                    cfg = cfg,
+                    sns_client = clients.sns_client(),
+                )
 
     if isinstance(slack_config_cached(), SlackWebhookConfig):
-        return post_message(
-            message = message,
-            account_id = account_id,
-            slack_config = slack_config_cached(),
-        )
+        with tracing.span("slack_post"):
+            return post_message(
+                message = message,
+                account_id = account_id,
+                slack_config = slack_config_cached(),
+            )
 
     if isinstance(slack_config_cached(), SlackAppConfig):
-        thread_ts = get_thread_ts_from_dynamodb(
-            cfg = cfg,
-            event = event,
-            dynamodb_client=dynamodb_client,
-        )
-        if thread_ts is not None:
-            # If we have a thread_ts, we can post the message to the thread
-            logger.info({"Posting message to thread": {"thread_ts": thread_ts}})
+        if thread_store is not None:
+            return post_message_to_thread(event, message, account_id, thread_store)
+        # a single event, its thread is saved right away
+        thread_store = ThreadStore(cfg)
+        try:
+            return post_message_to_thread(event, message, account_id, thread_store)
+        finally:
+            with tracing.span("dynamodb"):
+                thread_store.flush()
+
+
+def post_message_to_thread(
+    event: Dict[str, Any],
+    message: Dict[str, Any],
+    account_id: str,
+    thread_store: ThreadStore,
+) -> "SlackResponse | None":
+    thread_key = hash_user_identity_and_event_name(event)
+    with tracing.span("dynamodb"):
+        thread_ts = thread_store.get(thread_key) if thread_key else None
+    if thread_ts is not None:
+        # If we have a thread_ts, we can post the message to the thread
+        logger.info({"Posting message to thread": {"thread_ts": thread_ts}})
+        with tracing.span("slack_post"):
             return post_message(
                 message = message,
                 account_id = account_id,
                 thread_ts = thread_ts,
                 slack_config = slack_config_cached(),
             )
-        else:
-            # If we don't have a thread_ts, we need to post the message to the channel
-            logger.info({"Posting message to channel"})
+    else:
+        # If we don't have a thread_ts, we need to post the message to the channel
+        logger.info({"Posting message to channel"})
+        with tracing.span("slack_post"):
             slack_response = post_message(
                 message = message,
                 account_id = account_id,
                 slack_config = slack_config_cached()
             )
-            if slack_response is not None:
+        if slack_response is not None:
+            thread_ts = slack_response.get("ts")
+            if thread_ts is not None and thread_key:
+                # later events with the same hash thread onto this message
                 logger.info({"Saving thread_ts to DynamoDB"})
-                thread_ts = slack_response.get("ts")
-                if thread_ts is not None:
-                    put_event_to_dynamodb(
-                        cfg = cfg,
-                        event = event,
-                        thread_ts = thread_ts,
-                        dynamodb_client=dynamodb_client,
-                    )
-
-
-
-# Flatten json
-def flatten_json(y: dict) -> dict:
-    out = {}
-
-    def flatten(x, name=""): # noqa: ANN001, ANN202
-        if type(x) is dict:
-            for a in x:
-                flatten(x[a], name + a + ".")
-        elif type(x) is list:
-            i = 0
-            for a in x:
-                flatten(a, name + str(i) + ".")
-                i += 1
-        else:
-            out[name[:-1]] = x
+                thread_store.put(thread_key, thread_ts)
+        return slack_response
+
 
-    flatten(y)
-    return out
 
 # For local testing
 if __name__ == "__main__":
@@ -257,8 +518,9 @@ if __name__ == "__main__":
 
     cfg = Config()
     slack_config = get_slack_config()
+    rules = RuleStore.from_config(cfg).current()
 
     with open("./tests/test_events.json") as f:
         data = json.load(f)
     for event in data["test_events"]:
-        handle_event(event["event"], "file_name", cfg.rules, cfg.ignore_rules)
+        handle_event(event["event"], "file_name", rules.rule_set, rules.ignore_rule_set)
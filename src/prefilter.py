@@ -0,0 +1,87 @@
+import json
+import re
+from typing import Dict
+
+from rule_engine import RuleSet
+from rule_planner import INDEXED_FIELDS
+
+# CloudTrail puts the indexed fields before requestParameters and responseElements,
+# records that need a longer scan than this are parsed in full
+MAX_SCAN_LENGTH = 16384
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_KEY_SEPARATOR = re.compile(r"[ \t\n\r]*:[ \t\n\r]*")
+_VALUE_SEPARATOR = re.compile(r"[ \t\n\r]*([,}])[ \t\n\r]*")
+# values are read with the C implementation of the json module, one top level key at a time
+_scan_value = json.JSONDecoder().scan_once
+_scan_string = json.decoder.scanstring
+
+_TOP_LEVEL_FIELDS = {field for field in INDEXED_FIELDS if "." not in field}
+_USER_IDENTITY_TYPE = "userIdentity.type"
+_QUOTED_KEYS = tuple(f'"{key}"' for key in (*_TOP_LEVEL_FIELDS, "userIdentity"))
+
+
+def extract_index_fields(message: str, max_scan_length: int = MAX_SCAN_LENGTH) -> Dict[str, str | None] | None: # noqa: PLR0911, PLR0912
+    """
+    Reads eventName, eventSource, errorCode and userIdentity.type from a raw CloudTrail record
+    by walking its top level keys up to the last place where one of them can be.
+    Missing and null fields are returned as None.
+    Returns None if the fields can not be read with certainty, the record then has to be parsed in full.
+    """
+    if f'"{_USER_IDENTITY_TYPE}"' in message:
+        # a key with a dot flattens to the same name as the nested field
+        return None
+
+    # nothing after the last occurrence of the keys we are looking for can change the result,
+    # keys written with escape sequences are not found this way, the scan is not bounded for them
+    scan_end = len(message) if "\\u" in message else 0
+    for key in _QUOTED_KEYS:
+        scan_end = max(scan_end, message.rfind(key))
+
+    fields: Dict[str, str | None] = dict.fromkeys(INDEXED_FIELDS)
+    position = _WHITESPACE.match(message).end()
+    if not message.startswith("{", position):
+        return None
+    position = _WHITESPACE.match(message, position + 1).end()
+    if message.startswith("}", position):
+        return fields
+    try:
+        while True:
+            if position > scan_end:
+                return fields
+            if position > max_scan_length or not message.startswith('"', position):
+                return None
+            key, position = _scan_string(message, position + 1)
+            separator = _KEY_SEPARATOR.match(message, position)
+            if separator is None:
+                return None
+            value, position = _scan_value(message, separator.end())
+
+            if key in _TOP_LEVEL_FIELDS:
+                field = key
+            elif key == "userIdentity":
+                field, value = _USER_IDENTITY_TYPE, value.get("type") if type(value) is dict else None
+            else:
+                field = None
+            if field is not None:
+                if value is not None and not isinstance(value, str):
+                    # the index works with strings only
+                    return None
+                fields[field] = value
+
+            separator = _VALUE_SEPARATOR.match(message, position)
+            if separator is None:
+                return None
+            if separator.group(1) == "}":
+                return fields
+            position = separator.end()
+    except (StopIteration, ValueError):
+        return None
+
+
+def could_match(message: str, rule_set: RuleSet) -> bool:
+    """False only if it is certain that no rule of the rule set matches the raw record."""
+    if not rule_set.index.fully_indexed:
+        return True
+    fields = extract_index_fields(message)
+    return fields is None or bool(rule_set.index.candidates(fields))
@@ -0,0 +1,144 @@
+"""
+Limit of Slack alerts per principal, the account and ARN of the userIdentity of an event, so an
+alert storm of one principal does not use up the Slack rate of everybody else. Every principal has
+a token bucket of `limit` alerts that refills over `window_seconds`. Alerts above it are not posted,
+they are counted and reported as one "N more suppressed" message per principal and window.
+
+With shared counters the limit holds across containers: alerts are counted per principal and fixed
+window in the DynamoDB table, with one UpdateItem per principal and invocation. A window allows
+`limit` alerts, like a bucket that is refilled once per window.
+"""
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+import clients
+from config import Config, get_logger
+from digest import window_start
+
+logger = get_logger()
+
+KEY_PREFIX = "throttle#"
+
+# (account id of the userIdentity, ARN or principal id)
+Principal = Tuple[str, str]
+
+
+def principal_of(event: Dict[str, Any]) -> Principal | None:
+    user_identity = event.get("userIdentity") or {}
+    principal = user_identity.get("arn") or user_identity.get("principalId")
+    if not principal:
+        return None
+    return (user_identity.get("accountId") or event.get("recipientAccountId", ""), principal)
+
+
+class Bucket:
+    """Token bucket of one principal, full when it is created."""
+
+    def __init__(self, capacity: int, now: float) -> None: # noqa: ANN101
+        self.tokens = float(capacity)
+        self.updated_at = now
+
+    def take(self, count: int, capacity: int, rate: float, now: float) -> int: # noqa: ANN101
+        """Takes up to count tokens and returns how many were taken."""
+        self.tokens = min(capacity, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+        taken = min(count, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+
+@dataclass
+class Suppression:
+    # account the summary is sent to, the first one an alert of the principal was suppressed for
+    account_id: str
+    since: float
+    count: int = 0
+
+
+class PrincipalThrottle:
+    def __init__(self, cfg: Config, dynamodb_client=None, clock: Callable[[], float] = time.time) -> None: # noqa: ANN001, ANN101
+        self.cfg = cfg
+        self._dynamodb_client = dynamodb_client
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: Dict[Principal, Bucket] = {}
+        self._suppressed: Dict[Principal, Suppression] = {}
+
+    @property
+    def limit(self) -> int: # noqa: ANN101
+        return self.cfg.principal_alert_limit
+
+    @property
+    def window_seconds(self) -> int: # noqa: ANN101
+        return self.cfg.principal_alert_window_seconds
+
+    def admit(self, alerts: List[Tuple[Principal | None, str, int]]) -> List[bool]: # noqa: ANN101
+        """
+        Takes (principal, account id, number of events) per alert and returns which ones may be
+        posted, the first ones of every principal. Alerts without a principal are never suppressed.
+        """
+        requested: Dict[Principal, int] = {}
+        for principal, _, _ in alerts:
+            if principal is not None:
+                requested[principal] = requested.get(principal, 0) + 1
+        allowed = self._allowed(requested)
+
+        admitted = []
+        now = self._clock()
+        with self._lock:
+            for principal, account_id, events in alerts:
+                if principal is None or allowed[principal] > 0:
+                    if principal is not None:
+                        allowed[principal] -= 1
+                    admitted.append(True)
+                    continue
+                suppression = self._suppressed.setdefault(principal, Suppression(account_id, now))
+                suppression.count += events
+                admitted.append(False)
+        if not all(admitted):
+            logger.info({"Suppressed alerts of principals over the limit": {"alerts": admitted.count(False)}})
+        return admitted
+
+    def _allowed(self, requested: Dict[Principal, int]) -> Dict[Principal, int]: # noqa: ANN101
+        if self.cfg.principal_throttle_shared:
+            try:
+                return {principal: self._allowed_shared(principal, count) for principal, count in requested.items()}
+            except Exception as e:
+                # the bucket of this container still limits the principal
+                logger.exception({"Failed to count alerts in DynamoDB, using the counters of this container": {"error": str(e)}})
+        now = self._clock()
+        rate = self.limit / self.window_seconds
+        with self._lock:
+            return {
+                principal: self._buckets.setdefault(principal, Bucket(self.limit, now)).take(count, self.limit, rate, now)
+                for principal, count in requested.items()
+            }
+
+    def _allowed_shared(self, principal: Principal, count: int) -> int: # noqa: ANN101
+        window = window_start(self._clock(), self.window_seconds)
+        key = hashlib.sha256("#".join(principal).encode()).hexdigest()[:32]
+        total = int((self._dynamodb_client or clients.dynamodb_client()).update_item(
+            TableName = self.cfg.dynamodb_table_name,
+            Key = {"principal_structure_and_action_hash": {"S": f"{KEY_PREFIX}{key}#{window}"}},
+            UpdateExpression = "ADD #alerts :count SET #ttl = if_not_exists(#ttl, :ttl)",
+            ExpressionAttributeNames = {"#alerts": "alerts", "#ttl": "ttl"},
+            ExpressionAttributeValues = {":count": {"N": str(count)}, ":ttl": {"N": str(window + 2 * self.window_seconds)}},
+            ReturnValues = "UPDATED_NEW",
+        )["Attributes"]["alerts"]["N"])
+        return max(0, min(count, self.limit - (total - count)))
+
+    def due_summaries(self) -> List[Tuple[Principal, Suppression]]: # noqa: ANN101
+        """Suppressions that started at least a window ago, they are counted again from zero."""
+        now = self._clock()
+        with self._lock:
+            due = [(principal, s) for principal, s in self._suppressed.items() if now - s.since >= self.window_seconds]
+            for principal, _ in due:
+                del self._suppressed[principal]
+            # buckets that filled up again are the same as new ones
+            for principal, bucket in list(self._buckets.items()):
+                if now - bucket.updated_at >= self.window_seconds and principal not in self._suppressed:
+                    del self._buckets[principal]
+        return due
@@ -0,0 +1,327 @@
+"""
+Evaluates rules on many events at once, for replays and backfills of CloudTrail logs.
+
+The fields the rules read are loaded into dictionary encoded columns, one integer code per event
+and the list of distinct values. Fields like eventName, eventSource or errorCode have few distinct
+values, so every part of a rule that reads a single field is evaluated once per distinct value and
+spread to all events with one array lookup. `and`, `or` and `not` combine these parts as boolean
+masks, parts that read several fields are evaluated event by event.
+
+Events for which a rule might raise are evaluated again the same way should_message_be_processed
+does it, so matches and errors are identical to the per event path. Needs NumPy, without it every
+event takes the per event path.
+"""
+import ast
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence
+
+from flat_event import LazyFlatEvent
+from rule_compiler import Evaluator, compile_expression, parse_rule
+from rule_engine import CompiledRule, RuleSet, as_rule_set, evaluate_rule
+
+try:
+    import numpy as np
+except ImportError: # only needed for replays, the Lambda package does not include it
+    np = None
+
+_MISSING = object()
+
+
+class BatchResult(NamedTuple):
+    # positions of the events that should be processed, in order
+    rows: List[int]
+    # errors of the events for which a rule raised, by position
+    errors: Dict[int, List[Dict[str, Any]]]
+    # with count_hits, the number of events every rule is True for, rules only count events that are not ignored
+    rule_hits: List[int] | None = None
+    ignore_rule_hits: List[int] | None = None
+
+
+class _Masks(NamedTuple):
+    # the value of the expression is truthy, is True, or the expression raised
+    truthy: Any
+    true: Any
+    error: Any
+
+
+class _Batch:
+    def __init__(self, events: Sequence[dict]) -> None: # noqa: ANN101
+        self.events = events
+        self._flat: List[LazyFlatEvent | None] = [None] * len(events)
+        self._columns: Dict[str, tuple] = {}
+
+    def __len__(self) -> int: # noqa: ANN101
+        return len(self.events)
+
+    def flat(self, row: int) -> LazyFlatEvent: # noqa: ANN101
+        flat = self._flat[row]
+        if flat is None:
+            flat = self._flat[row] = LazyFlatEvent(self.events[row])
+        return flat
+
+    def _value(self, row: int, field: str) -> Any: # noqa: ANN101, ANN401
+        if "." not in field:
+            # a top level field is the flat value as long as it is not a container
+            value = self.events[row].get(field)
+            return _MISSING if value is None or type(value) is dict or type(value) is list else value
+        return self.flat(row).get(field, _MISSING)
+
+    def column(self, field: str, rows: Any) -> tuple: # noqa: ANN101, ANN401
+        """
+        Codes of the values of the field in these rows and the distinct values by code, code 0 is missing.
+        Values are read only for the rows that are asked for.
+        """
+        if field not in self._columns:
+            # keyed by type as well, 1, 1.0 and True are equal but behave differently in rules
+            self._columns[field] = (np.full(len(self), -1, dtype=np.int32), [_MISSING], {})
+        codes, values, codes_by_value = self._columns[field]
+        todo = rows[codes[rows] < 0]
+        if len(todo):
+            new_codes = []
+            for row in todo.tolist():
+                value = self._value(row, field)
+                if value is _MISSING:
+                    new_codes.append(0)
+                    continue
+                key = (type(value), value)
+                code = codes_by_value.get(key)
+                if code is None:
+                    code = codes_by_value[key] = len(values)
+                    values.append(value)
+                new_codes.append(code)
+            codes[todo] = new_codes
+        return codes[rows], values
+
+
+def _event_field(node: ast.AST) -> str | None:
+    """Field read by `event.get("field", <literal>)`, `event["field"]` or `"field" in event`."""
+    def is_event(node: ast.AST) -> bool:
+        return isinstance(node, ast.Name) and node.id == "event"
+
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr == "get"
+        and is_event(node.func.value)
+        and not node.keywords
+        and 1 <= len(node.args) <= 2 # noqa: PLR2004
+        and all(isinstance(arg, ast.Constant) for arg in node.args)
+        and isinstance(node.args[0].value, str)
+    ):
+        return node.args[0].value
+    if (
+        isinstance(node, ast.Subscript)
+        and is_event(node.value)
+        and isinstance(node.slice, ast.Constant)
+        and isinstance(node.slice.value, str)
+    ):
+        return node.slice.value
+    if (
+        isinstance(node, ast.Compare)
+        and len(node.ops) == 1
+        and isinstance(node.ops[0], (ast.In, ast.NotIn))
+        and is_event(node.comparators[0])
+        and isinstance(node.left, ast.Constant)
+        and isinstance(node.left.value, str)
+    ):
+        return node.left.value
+    return None
+
+
+def _fields(node: ast.AST) -> set | None:
+    """Fields an expression reads, None if it uses the event in any other way."""
+    field = _event_field(node)
+    if field is not None:
+        return {field}
+    if isinstance(node, ast.Name):
+        return None if node.id == "event" else set()
+    fields: set = set()
+    for child in ast.iter_child_nodes(node):
+        child_fields = _fields(child)
+        if child_fields is None:
+            return None
+        fields |= child_fields
+    return fields
+
+
+def _outcome(evaluate: Evaluator, event: Any) -> tuple: # noqa: ANN401
+    try:
+        value = evaluate(event)
+        return bool(value), value is True, False
+    except Exception:
+        return False, False, True
+
+
+# Every plan evaluates its expression for the given rows of the batch and returns masks aligned with them.
+
+class _FieldPlan(NamedTuple):
+    """Expression that reads one field or none, evaluated once per distinct value."""
+
+    field: str | None
+    evaluate: Evaluator
+
+    def masks(self, batch: _Batch, rows: Any) -> _Masks: # noqa: ANN101, ANN401
+        if self.field is None:
+            codes, values = np.zeros(len(rows), dtype=np.int32), [_MISSING]
+        else:
+            codes, values = batch.column(self.field, rows)
+        truthy, true, error = (np.zeros(len(values), dtype=bool) for _ in range(3))
+        for code in np.unique(codes).tolist():
+            value = values[code]
+            truthy[code], true[code], error[code] = _outcome(self.evaluate, {} if value is _MISSING else {self.field: value})
+        return _Masks(truthy[codes], true[codes], error[codes])
+
+
+class _RowPlan(NamedTuple):
+    """Expression evaluated event by event."""
+
+    evaluate: Evaluator
+
+    def masks(self, batch: _Batch, rows: Any) -> _Masks: # noqa: ANN101, ANN401
+        masks = _Masks(*(np.zeros(len(rows), dtype=bool) for _ in range(3)))
+        for position, row in enumerate(rows.tolist()):
+            masks.truthy[position], masks.true[position], masks.error[position] = _outcome(self.evaluate, batch.flat(row))
+        return masks
+
+
+class _NotPlan(NamedTuple):
+    operand: Any
+
+    def masks(self, batch: _Batch, rows: Any) -> _Masks: # noqa: ANN101, ANN401
+        operand = self.operand.masks(batch, rows)
+        value = ~operand.truthy & ~operand.error
+        return _Masks(value, value, operand.error)
+
+
+class _BoolPlan(NamedTuple):
+    """`and`/`or` with the short circuit of Python, a value is only evaluated for the rows that reach it."""
+
+    is_and: bool
+    values: List[Any]
+
+    def masks(self, batch: _Batch, rows: Any) -> _Masks: # noqa: ANN101, ANN401
+        result = _Masks(*(np.zeros(len(rows), dtype=bool) for _ in range(3)))
+        # positions in rows whose value is not known yet
+        pending = np.arange(len(rows))
+        for i, value in enumerate(self.values):
+            masks = value.masks(batch, rows[pending])
+            result.error[pending] = masks.error
+            if i == len(self.values) - 1:
+                result.truthy[pending] = masks.truthy
+                result.true[pending] = masks.true
+                break
+            decided = (masks.truthy if not self.is_and else ~masks.truthy) & ~masks.error
+            # a falsy value ends `and` with a value that is not True, a truthy one ends `or` with itself
+            result.truthy[pending[decided]] = masks.truthy[decided]
+            result.true[pending[decided]] = masks.true[decided]
+            pending = pending[~decided & ~masks.error]
+            if not len(pending):
+                break
+        return result
+
+
+def _plan(node: ast.AST) -> Any: # noqa: ANN401
+    fields = _fields(node)
+    if fields is not None and len(fields) <= 1:
+        return _FieldPlan(next(iter(fields), None), compile_expression(node))
+    if isinstance(node, ast.BoolOp):
+        return _BoolPlan(isinstance(node.op, ast.And), [_plan(value) for value in node.values])
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return _NotPlan(_plan(node.operand))
+    return _RowPlan(compile_expression(node))
+
+
+def plan_rule(rule: CompiledRule) -> Any: # noqa: ANN401
+    try:
+        return _plan(parse_rule(rule.source))
+    except (SyntaxError, ValueError, NameError):
+        # compiled with RULE_ENGINE=eval and outside of what rule_compiler supports
+        return _RowPlan(rule.evaluate)
+
+
+def evaluate_event(flat_event: LazyFlatEvent, rule_set: RuleSet, ignore_rule_set: RuleSet) -> tuple:
+    """should_message_be_processed without the logging, returns should_be_processed and errors."""
+    errors = []
+    for ignore_rule in ignore_rule_set.candidates(flat_event):
+        try:
+            if evaluate_rule(ignore_rule, flat_event):
+                return False, errors
+        except Exception as e:
+            errors.append({"error": e, "rule": ignore_rule.source})
+    for rule in rule_set.candidates(flat_event):
+        try:
+            if evaluate_rule(rule, flat_event):
+                return True, errors
+        except Exception as e:
+            errors.append({"error": e, "rule": rule.source})
+    return False, errors
+
+
+class BatchEvaluator:
+    """Rules and ignore rules planned once, for any number of batches."""
+
+    def __init__(self, rules: RuleSet | Sequence[str | CompiledRule], ignore_rules: RuleSet | Sequence[str | CompiledRule]) -> None: # noqa: ANN101, E501
+        self.rule_set = as_rule_set(rules)
+        self.ignore_rule_set = as_rule_set(ignore_rules)
+        self.plans = [plan_rule(rule) for rule in self.rule_set.rules]
+        self.ignore_plans = [plan_rule(rule) for rule in self.ignore_rule_set.rules]
+
+    def evaluate(self, events: Sequence[dict], count_hits: bool = False) -> BatchResult: # noqa: ANN101
+        """
+        Without count_hits rules are evaluated in order until one of them decides an event, like the per event path.
+        With count_hits every rule is evaluated for every event it applies to.
+        """
+        if np is None:
+            result = self._evaluate_events(lambda row: LazyFlatEvent(events[row]), range(len(events)), [])
+            return result._replace(**self._count_hits_per_event(events)) if count_hits else result
+
+        batch = _Batch(events)
+        ignored, matched, unsure = (np.zeros(len(batch), dtype=bool) for _ in range(3))
+        hits: Dict[str, List[int]] = {"ignore_rule_hits": [], "rule_hits": []}
+        active = np.arange(len(batch))
+        for plans, decides, name in ((self.ignore_plans, ignored, "ignore_rule_hits"), (self.plans, matched, "rule_hits")):
+            if count_hits and decides is matched:
+                active = np.flatnonzero(~ignored)
+            for plan in plans:
+                masks = plan.masks(batch, active)
+                decides[active[masks.true]] = True
+                unsure[active[masks.error]] = True
+                hits[name].append(int(masks.true.sum()))
+                if not count_hits:
+                    active = active[~masks.true & ~masks.error]
+
+        # events for which a rule raised are evaluated again to collect the errors in the right order
+        result = self._evaluate_events(batch.flat, np.flatnonzero(unsure).tolist(), np.flatnonzero(matched & ~unsure).tolist())
+        return result._replace(**hits) if count_hits else result
+
+    def _evaluate_events(self, flat: Callable[[int], LazyFlatEvent], positions: Sequence[int], rows: List[int]) -> BatchResult: # noqa: ANN101, E501
+        errors = {}
+        for position in positions:
+            processed, event_errors = evaluate_event(flat(position), self.rule_set, self.ignore_rule_set)
+            if processed:
+                rows.append(position)
+            if event_errors:
+                errors[position] = event_errors
+        return BatchResult(sorted(rows), errors)
+
+    def _count_hits_per_event(self, events: Sequence[dict]) -> Dict[str, List[int]]: # noqa: ANN101
+        ignore_rule_hits = [0] * len(self.ignore_rule_set.rules)
+        rule_hits = [0] * len(self.rule_set.rules)
+        for event in events:
+            flat_event = LazyFlatEvent(event)
+            ignored = False
+            for position, rule in enumerate(self.ignore_rule_set.rules):
+                if _outcome(rule.evaluate, flat_event)[1]:
+                    ignore_rule_hits[position] += 1
+                    ignored = True
+            if not ignored:
+                for position, rule in enumerate(self.rule_set.rules):
+                    rule_hits[position] += _outcome(rule.evaluate, flat_event)[1]
+        return {"rule_hits": rule_hits, "ignore_rule_hits": ignore_rule_hits}
+
+
+def evaluate_batch(
+    events: Sequence[dict],
+    rules: RuleSet | Sequence[str | CompiledRule],
+    ignore_rules: RuleSet | Sequence[str | CompiledRule],
+) -> BatchResult:
+    return BatchEvaluator(rules, ignore_rules).evaluate(events)
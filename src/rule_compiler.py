@@ -0,0 +1,210 @@
+"""
+Compiles rules to Python closures without eval().
+
+Only the expressions the rules are written with are accepted:
+
+    event.get("field", "default"), event["field"], "field" in event
+    ==, !=, in, not in, and, or, not
+    str.startswith(...), str.endswith(...)
+    str, number, bool and None literals, tuples, lists and sets of them
+
+Anything else is rejected when the rule is compiled. The closures keep the semantics of
+eval(rule, {}, {"event": flat_event}), including the value of `and`/`or` and the errors raised.
+"""
+import ast
+import operator
+from typing import Any, Callable, List
+
+Evaluator = Callable[[Any], Any]
+
+METHODS = ("get", "startswith", "endswith")
+
+_COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.In: lambda left, right: left in right,
+    ast.NotIn: lambda left, right: left not in right,
+}
+
+
+class UnsupportedRuleError(ValueError):
+    pass
+
+
+def compile_rule_to_closure(rule: str) -> Evaluator:
+    """Returns a function of the flat event that gives the value of the rule."""
+    return compile_expression(parse_rule(rule))
+
+
+def parse_rule(rule: str) -> ast.AST:
+    # eval() strips leading and trailing spaces and tabs from string input, ast.parse() does not
+    return ast.parse(rule.strip(" \t"), mode="eval").body
+
+
+def compile_expression(node: ast.AST) -> Evaluator:
+    """Same as compile_rule_to_closure for a part of a parsed rule."""
+    return _compile(node)
+
+
+def _unsupported(node: ast.AST, what: str) -> UnsupportedRuleError:
+    return UnsupportedRuleError(f"{what} is not supported in rules: {ast.unparse(node)}")
+
+
+def _literal(node: ast.AST) -> Any: # noqa: ANN401
+    """Value of a literal, rules do not build containers from event values."""
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        values = [_literal(element) for element in node.elts]
+        if isinstance(node, ast.Tuple):
+            return tuple(values)
+        if isinstance(node, ast.List):
+            return values
+        try:
+            return set(values)
+        except TypeError:
+            raise _unsupported(node, "Set of unhashable values") from None
+    raise _unsupported(node, type(node).__name__)
+
+
+def _is_literal(node: ast.AST) -> bool:
+    if isinstance(node, ast.Constant):
+        return True
+    return isinstance(node, (ast.Tuple, ast.List, ast.Set)) and all(_is_literal(element) for element in node.elts)
+
+
+def _compile(node: ast.AST) -> Evaluator: # noqa: PLR0911
+    if _is_literal(node):
+        # none of the supported expressions can change a container, so one instance is shared
+        value = _literal(node)
+        return lambda _: value
+    if isinstance(node, ast.Name):
+        if node.id != "event":
+            # the same error eval() raises when the rule runs
+            raise NameError(f"name '{node.id}' is not defined")
+        return lambda event: event
+    if isinstance(node, ast.BoolOp):
+        return _compile_bool_op(node)
+    if isinstance(node, ast.UnaryOp):
+        if not isinstance(node.op, ast.Not):
+            raise _unsupported(node, type(node.op).__name__)
+        operand = _compile(node.operand)
+        return lambda event: not operand(event)
+    if isinstance(node, ast.Compare):
+        return _compile_compare(node)
+    if isinstance(node, ast.Call):
+        return _compile_call(node)
+    if isinstance(node, ast.Subscript):
+        return _compile_subscript(node)
+    raise _unsupported(node, type(node).__name__)
+
+
+def _compile_bool_op(node: ast.BoolOp) -> Evaluator:
+    # folded into nested closures that use `and`/`or` themselves, which gives the same value and short circuit
+    values = [_compile(value) for value in node.values]
+    result = values[-1]
+    for value in reversed(values[:-1]):
+        result = _and(value, result) if isinstance(node.op, ast.And) else _or(value, result)
+    return result
+
+
+def _and(left: Evaluator, right: Evaluator) -> Evaluator:
+    return lambda event: left(event) and right(event)
+
+
+def _or(left: Evaluator, right: Evaluator) -> Evaluator:
+    return lambda event: left(event) or right(event)
+
+
+def _comparison(op: ast.cmpop, node: ast.AST) -> Callable[[Any, Any], Any]:
+    try:
+        return _COMPARISONS[type(op)]
+    except KeyError:
+        raise _unsupported(node, type(op).__name__) from None
+
+
+def _compile_compare(node: ast.Compare) -> Evaluator: # noqa: PLR0911
+    left = _compile(node.left)
+    if len(node.ops) == 1:
+        op, comparator = type(node.ops[0]), node.comparators[0]
+        compare = _comparison(node.ops[0], node)
+        # the shapes of the default rules, written out to avoid a call per operand
+        if _is_literal(comparator):
+            value = _literal(comparator)
+            if op is ast.Eq:
+                return lambda event: left(event) == value
+            if op is ast.NotEq:
+                return lambda event: left(event) != value
+            return lambda event: compare(left(event), value)
+        right = _compile(comparator)
+        if op is ast.In:
+            return lambda event: left(event) in right(event)
+        if op is ast.NotIn:
+            return lambda event: left(event) not in right(event)
+        return lambda event: compare(left(event), right(event))
+
+    # chained comparison, every operand is evaluated at most once
+    steps = [(_comparison(op, node), _compile(comparator)) for op, comparator in zip(node.ops, node.comparators, strict=True)]
+
+    def evaluate_chain(event: Any) -> Any: # noqa: ANN401
+        current = left(event)
+        for compare, comparator in steps:
+            value = comparator(event)
+            result = compare(current, value)
+            if not result:
+                return result
+            current = value
+        return result
+    return evaluate_chain
+
+
+def _compile_call(node: ast.Call) -> Evaluator: # noqa: PLR0911
+    func = node.func
+    if not isinstance(func, ast.Attribute) or func.attr not in METHODS:
+        raise _unsupported(node, "Calling " + ast.unparse(func))
+    if node.keywords or any(isinstance(arg, ast.Starred) for arg in node.args):
+        raise _unsupported(node, "Keyword or starred argument")
+    target = _compile(func.value)
+    name = func.attr
+    args: List[Evaluator] = [_compile(arg) for arg in node.args]
+
+    if all(_is_literal(arg) for arg in node.args):
+        values = tuple(_literal(arg) for arg in node.args)
+        if name == "get" and _is_event(func.value) and 1 <= len(values) <= 2: # noqa: PLR2004
+            # the lookup every rule starts with, one call less than going through target
+            return _get_field(*values)
+        if name == "get" and len(values) == 2: # noqa: PLR2004
+            key, default = values
+            return lambda event: target(event).get(key, default)
+        if name == "get" and len(values) == 1:
+            key = values[0]
+            return lambda event: target(event).get(key)
+        if name == "startswith" and len(values) == 1:
+            prefix = values[0]
+            return lambda event: target(event).startswith(prefix)
+        if name == "endswith" and len(values) == 1:
+            suffix = values[0]
+            return lambda event: target(event).endswith(suffix)
+        return lambda event: getattr(target(event), name)(*values)
+    return lambda event: getattr(target(event), name)(*[arg(event) for arg in args])
+
+
+def _is_event(node: ast.AST) -> bool:
+    return isinstance(node, ast.Name) and node.id == "event"
+
+
+def _get_field(key: Any, default: Any = None) -> Evaluator: # noqa: ANN401
+    return lambda event: event.get(key, default)
+
+
+def _compile_subscript(node: ast.Subscript) -> Evaluator:
+    if isinstance(node.slice, ast.Slice):
+        raise _unsupported(node, "Slice")
+    target = _compile(node.value)
+    if isinstance(node.slice, ast.Constant):
+        key = node.slice.value
+        if _is_event(node.value):
+            return lambda event: event[key]
+        return lambda event: target(event)[key]
+    index = _compile(node.slice)
+    return lambda event: target(event)[index(event)]
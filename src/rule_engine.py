@@ -0,0 +1,91 @@
+import os
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Mapping, NamedTuple, Sequence, Tuple
+
+from rule_compiler import compile_rule_to_closure
+from rule_planner import RuleIndex
+
+# "ast" evaluates the supported subset of Python without eval(), see rule_compiler.py.
+# "eval" runs any Python expression the way earlier versions did.
+RULE_ENGINES = ("ast", "eval")
+RULE_ENGINE = os.environ.get("RULE_ENGINE") or "ast"
+
+# Rules are evaluated with empty globals, the same way a bare eval(rule, {}, ...) would do it.
+# Sharing one dict avoids building a new one for every evaluation.
+_RULE_GLOBALS: Dict[str, Any] = {}
+
+
+class CompiledRule(NamedTuple):
+    source: str
+    # value of the rule for a flat event
+    evaluate: Callable[[Any], Any]
+
+
+def compile_rule_for_eval(rule: str) -> Callable[[Any], Any]:
+    # eval() strips leading and trailing spaces and tabs from string input, compile() does not
+    code = compile(rule.strip(" \t"), "<rule>", "eval")
+    return lambda flat_event: eval(code, _RULE_GLOBALS, {"event": flat_event}) # noqa: PGH001
+
+
+@lru_cache(maxsize=1024)
+def compile_rule(rule: str, engine: str | None = None) -> CompiledRule:
+    engine = engine or RULE_ENGINE
+    if engine == "eval":
+        return CompiledRule(rule, compile_rule_for_eval(rule))
+    if engine == "ast":
+        return CompiledRule(rule, compile_rule_to_closure(rule))
+    raise ValueError(f"Unknown rule engine {engine}, use one of {', '.join(RULE_ENGINES)}")
+
+
+def as_compiled_rule(rule: str | CompiledRule) -> CompiledRule:
+    if isinstance(rule, CompiledRule):
+        return rule
+    return compile_rule(rule)
+
+
+def evaluate_rule(rule: CompiledRule, flat_event: Any) -> bool: # noqa: ANN401
+    return rule.evaluate(flat_event) is True
+
+
+class RuleSet:
+    """
+    Rules compiled once, together with the index used to pick the rules that could match an event.
+    Rules that could not be compiled are kept in errors.
+    """
+
+    def __init__(self, rules: Iterable[str | CompiledRule]) -> None: # noqa: ANN101
+        self.rules: List[CompiledRule] = []
+        self.errors: List[Dict[str, Any]] = []
+        for rule in rules:
+            try:
+                self.rules.append(as_compiled_rule(rule))
+            # rules outside the subset of the ast engine fail here, with NameError for unknown names
+            except (SyntaxError, ValueError, NameError) as e:
+                self.errors.append({"error": e, "rule": rule})
+        self.index = RuleIndex(rule.source for rule in self.rules)
+
+    def __len__(self) -> int: # noqa: ANN101
+        return len(self.rules)
+
+    def candidates(self, flat_event: Mapping[str, Any]) -> List[CompiledRule]: # noqa: ANN101
+        """Rules that could match the event, in the original order."""
+        if not self.index.fields:
+            return self.rules
+        return [self.rules[position] for position in self.index.candidates(flat_event)]
+
+    def candidate_positions(self, flat_event: Mapping[str, Any]) -> Sequence[int]: # noqa: ANN101
+        """Positions of the rules that could match the event, in the original order."""
+        if not self.index.fields:
+            return range(len(self.rules))
+        return self.index.candidates(flat_event)
+
+
+@lru_cache(maxsize=32)
+def _rule_set_from_tuple(rules: Tuple[str | CompiledRule, ...]) -> RuleSet:
+    return RuleSet(rules)
+
+
+def as_rule_set(rules: RuleSet | Sequence[str | CompiledRule]) -> RuleSet:
+    if isinstance(rules, RuleSet):
+        return rules
+    return _rule_set_from_tuple(tuple(rules))
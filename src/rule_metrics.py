@@ -0,0 +1,98 @@
+"""
+Evaluations, matches, errors and evaluation time of every rule and ignore rule during one invocation,
+written at the end of the invocation in CloudWatch Embedded Metric Format.
+
+EMF allows one value per dimension in a log line, so there is one line per rule that was evaluated.
+The dimensions are the function name, "rule" or "ignore_rule" and the position of the rule in its rule set.
+"""
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, TextIO
+
+from rule_engine import CompiledRule, RuleSet, evaluate_rule
+
+NAMESPACE = "CloudTrailToSlack"
+DIMENSIONS = ["FunctionName", "RuleType", "RuleIndex"]
+METRICS = [
+    {"Name": "Evaluations", "Unit": "Count"},
+    {"Name": "Matches", "Unit": "Count"},
+    {"Name": "Errors", "Unit": "Count"},
+    {"Name": "EvaluationTime", "Unit": "Microseconds"},
+]
+# rules are logged with their metrics to find them by index, long ones are cut
+RULE_SOURCE_LENGTH = 200
+
+
+class RuleCounters:
+    """Counters of the rules of one rule set, by position."""
+
+    def __init__(self, rule_set: RuleSet) -> None: # noqa: ANN101
+        size = len(rule_set.rules)
+        self.rule_set = rule_set
+        self.evaluations = [0] * size
+        self.matches = [0] * size
+        self.errors = [0] * size
+        self.nanoseconds = [0] * size
+
+    def evaluate(self, position: int, rule: CompiledRule, flat_event: Any) -> bool: # noqa: ANN101, ANN401
+        """evaluate_rule that counts the evaluation, errors are counted and raised again."""
+        start = time.perf_counter_ns()
+        try:
+            matched = evaluate_rule(rule, flat_event)
+        except Exception:
+            self.errors[position] += 1
+            raise
+        finally:
+            self.nanoseconds[position] += time.perf_counter_ns() - start
+            self.evaluations[position] += 1
+        if matched:
+            self.matches[position] += 1
+        return matched
+
+
+class RuleMetrics:
+    def __init__(self, rule_set: RuleSet, ignore_rule_set: RuleSet) -> None: # noqa: ANN101
+        self.rules = RuleCounters(rule_set)
+        self.ignore_rules = RuleCounters(ignore_rule_set)
+
+    def counters_for(self, rule_set: RuleSet) -> RuleCounters | None: # noqa: ANN101
+        """Counters of this rule set, None for rule sets the metrics were not created for."""
+        if rule_set is self.rules.rule_set:
+            return self.rules
+        if rule_set is self.ignore_rules.rule_set:
+            return self.ignore_rules
+        return None
+
+    def documents(self, function_name: str, timestamp_ms: int | None = None) -> List[Dict[str, Any]]: # noqa: ANN101
+        timestamp_ms = int(time.time() * 1000) if timestamp_ms is None else timestamp_ms
+        documents = []
+        for rule_type, counters in (("rule", self.rules), ("ignore_rule", self.ignore_rules)):
+            for position, evaluations in enumerate(counters.evaluations):
+                if not evaluations:
+                    continue
+                documents.append({
+                    "_aws": {
+                        "Timestamp": timestamp_ms,
+                        "CloudWatchMetrics": [{"Namespace": NAMESPACE, "Dimensions": [DIMENSIONS], "Metrics": METRICS}],
+                    },
+                    "FunctionName": function_name,
+                    "RuleType": rule_type,
+                    "RuleIndex": str(position),
+                    "Evaluations": evaluations,
+                    "Matches": counters.matches[position],
+                    "Errors": counters.errors[position],
+                    "EvaluationTime": round(counters.nanoseconds[position] / 1000, 3),
+                    "Rule": counters.rule_set.rules[position].source[:RULE_SOURCE_LENGTH],
+                })
+        return documents
+
+    def emit(self, stream: TextIO | None = None) -> None: # noqa: ANN101
+        """Writes the EMF lines to stdout, where the Lambda runtime sends them to CloudWatch Logs."""
+        stream = stream or sys.stdout
+        function_name = os.environ.get("AWS_LAMBDA_FUNCTION_NAME") or os.environ.get("FUNCTION_NAME", "")
+        lines = [json.dumps(document) for document in self.documents(function_name)]
+        if lines:
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
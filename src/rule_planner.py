@@ -0,0 +1,238 @@
+import ast
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Set, Tuple
+
+# Rules are planned against these fields only, every default rule starts with a test on one of them
+INDEXED_FIELDS = ("eventName", "errorCode", "eventSource", "userIdentity.type")
+
+GUARD_KINDS = ("exact", "prefix", "suffix")
+
+# Default value of an event["field"] access, the field is known to be present when it is evaluated
+_NEVER = object()
+
+
+class RuleGuard(NamedTuple):
+    """Condition that must hold for a rule to match, extracted from the leading `and` chain of the rule."""
+
+    field: str
+    kind: str
+    values: Tuple[str, ...]
+    # True if the rule has to be evaluated when the field is missing from the event
+    matches_missing: bool
+
+
+def _literal(node: ast.AST) -> Tuple[bool, Any]:
+    if isinstance(node, ast.Constant):
+        return True, node.value
+    if isinstance(node, (ast.Tuple, ast.List, ast.Set)) and all(isinstance(x, ast.Constant) for x in node.elts):
+        return True, tuple(x.value for x in node.elts) # type: ignore # noqa: PGH003
+    return False, None
+
+
+def _is_event(node: ast.AST) -> bool:
+    return isinstance(node, ast.Name) and node.id == "event"
+
+
+def _field_access(node: ast.AST, present_fields: Set[str]) -> Tuple[str, Any] | None:
+    """Returns field name and the value used when the field is missing for `event.get(...)` or `event[...]`."""
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr == "get"
+        and _is_event(node.func.value)
+        and not node.keywords
+        and 1 <= len(node.args) <= 2 # noqa: PLR2004
+        and isinstance(node.args[0], ast.Constant)
+        and isinstance(node.args[0].value, str)
+    ):
+        if len(node.args) == 1:
+            return node.args[0].value, None
+        if isinstance(node.args[1], ast.Constant):
+            return node.args[0].value, node.args[1].value
+        return None
+    if (
+        isinstance(node, ast.Subscript)
+        and _is_event(node.value)
+        and isinstance(node.slice, ast.Constant)
+        and node.slice.value in present_fields
+    ):
+        return node.slice.value, _NEVER
+    return None
+
+
+def _guard(field: str, kind: str, values: Tuple[str, ...], default: Any) -> Tuple[RuleGuard, bool]: # noqa: ANN401
+    """Returns the guard and whether it raises when the field is missing."""
+    if default is _NEVER:
+        return RuleGuard(field, kind, values, False), False
+    try:
+        if kind == "exact":
+            matches_missing = default in values
+        elif kind == "prefix":
+            matches_missing = default.startswith(values)
+        else:
+            matches_missing = default.endswith(values)
+    except Exception:
+        # the rule would fail on a missing field, evaluate it so the error is reported
+        return RuleGuard(field, kind, values, True), True
+    return RuleGuard(field, kind, values, matches_missing), False
+
+
+def _plan_comparison(node: ast.Compare, present_fields: Set[str]) -> Tuple[RuleGuard, bool] | bool: # noqa: PLR0911
+    if len(node.ops) != 1:
+        return False
+    op, left, right = node.ops[0], node.left, node.comparators[0]
+
+    # "field" in event
+    if isinstance(op, (ast.In, ast.NotIn)) and _is_event(right):
+        if isinstance(left, ast.Constant) and isinstance(left.value, str):
+            if isinstance(op, ast.In):
+                present_fields.add(left.value)
+            return True
+        return False
+
+    if isinstance(op, (ast.Eq, ast.NotEq)) and isinstance(left, ast.Constant):
+        left, right = right, left
+    access = _field_access(left, present_fields)
+    is_literal, value = _literal(right)
+    if access is None or not is_literal:
+        return False
+    field, default = access
+
+    if isinstance(op, ast.Eq) and isinstance(value, str) and field in INDEXED_FIELDS:
+        return _guard(field, "exact", (value,), default)
+    if isinstance(op, ast.In) and isinstance(value, tuple) and all(isinstance(x, str) for x in value) and field in INDEXED_FIELDS:
+        return _guard(field, "exact", value, default)
+    # comparisons against literals can not raise, so they do not stop the planner
+    if isinstance(op, (ast.Eq, ast.NotEq)) or (isinstance(op, (ast.In, ast.NotIn)) and isinstance(value, tuple)):
+        return True
+    return False
+
+
+def _plan_method_call(node: ast.Call, present_fields: Set[str]) -> Tuple[RuleGuard, bool] | bool:
+    if not (
+        isinstance(node.func, ast.Attribute)
+        and node.func.attr in ("startswith", "endswith")
+        and len(node.args) == 1
+        and not node.keywords
+    ):
+        return False
+    access = _field_access(node.func.value, present_fields)
+    is_literal, value = _literal(node.args[0])
+    if access is None or not is_literal:
+        return False
+    field, default = access
+    values = value if isinstance(value, tuple) else (value,)
+    # str methods raise on non string fields, only indexed fields are checked for that at lookup time
+    if field not in INDEXED_FIELDS or not all(isinstance(x, str) for x in values):
+        return False
+    return _guard(field, "prefix" if node.func.attr == "startswith" else "suffix", values, default)
+
+
+def _conjuncts(node: ast.AST) -> List[ast.AST]:
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        return [conjunct for value in node.values for conjunct in _conjuncts(value)]
+    return [node]
+
+
+def plan_rule(rule: str) -> RuleGuard | None:
+    """
+    Finds the most selective guard in the leading `and` chain of a rule.
+
+    Only conjuncts that can not raise are skipped over, so a rule whose guard does not hold
+    is guaranteed to be neither a match nor an evaluation error. The chain ends at a guard that
+    raises on a missing field, the conjuncts after it are not reached for such events.
+    """
+    try:
+        tree = ast.parse(rule.strip(" \t"), mode="eval")
+    except (SyntaxError, ValueError):
+        return None
+
+    present_fields: Set[str] = set()
+    guards = []
+    for conjunct in _conjuncts(tree.body):
+        if isinstance(conjunct, ast.Compare):
+            planned = _plan_comparison(conjunct, present_fields)
+        elif isinstance(conjunct, ast.Call):
+            planned = _plan_method_call(conjunct, present_fields)
+        else:
+            planned = False
+        if planned is False:
+            break
+        if planned is not True:
+            guard, raises_when_missing = planned
+            guards.append(guard)
+            if raises_when_missing:
+                break
+
+    if not guards:
+        return None
+    return min(guards, key=lambda guard: (INDEXED_FIELDS.index(guard.field), GUARD_KINDS.index(guard.kind)))
+
+
+class _FieldIndex:
+    def __init__(self) -> None: # noqa: ANN101
+        self.exact: Dict[str, List[int]] = {}
+        # affixes are grouped by length, so a lookup is one dict access per distinct length
+        self.prefixes: Dict[int, Dict[str, List[int]]] = {}
+        self.suffixes: Dict[int, Dict[str, List[int]]] = {}
+        self.missing: List[int] = []
+
+    def add(self, guard: RuleGuard, position: int) -> None: # noqa: ANN101
+        if guard.kind == "exact":
+            tables = [self.exact] * len(guard.values)
+        else:
+            affixes = self.prefixes if guard.kind == "prefix" else self.suffixes
+            tables = [affixes.setdefault(len(value), {}) for value in guard.values]
+        for table, value in zip(tables, guard.values, strict=True):
+            positions = table.setdefault(value, [])
+            if position not in positions:
+                positions.append(position)
+        if guard.matches_missing:
+            self.missing.append(position)
+
+    def lookup(self, value: str, positions: Set[int]) -> None: # noqa: ANN101
+        positions.update(self.exact.get(value, ()))
+        for length, table in self.prefixes.items():
+            positions.update(table.get(value[:length], ()))
+        for length, table in self.suffixes.items():
+            if length <= len(value):
+                positions.update(table.get(value[len(value) - length:], ()))
+
+
+class RuleIndex:
+    """Hash and prefix/suffix index from guard fields to the positions of the rules that could match."""
+
+    def __init__(self, rules: Iterable[str]) -> None: # noqa: ANN101
+        self.size = 0
+        self.fields: Dict[str, _FieldIndex] = {}
+        self.unindexed: List[int] = []
+        for position, rule in enumerate(rules):
+            self.size += 1
+            guard = plan_rule(rule)
+            if guard is None:
+                self.unindexed.append(position)
+            else:
+                self.fields.setdefault(guard.field, _FieldIndex()).add(guard, position)
+
+    @property
+    def fully_indexed(self) -> bool: # noqa: ANN101
+        return not self.unindexed
+
+    def candidates(self, fields: Mapping[str, Any]) -> List[int]: # noqa: ANN101
+        """Positions of the rules that could match an event with these field values, in rule order."""
+        if not self.fields:
+            return list(range(self.size))
+        positions = set(self.unindexed)
+        # all indexed fields are checked, a rule may test one of them before the guard it is indexed on
+        for field in INDEXED_FIELDS:
+            value = fields.get(field)
+            field_index = self.fields.get(field)
+            if value is not None and not isinstance(value, str):
+                # str methods in guards would raise, fall back to the linear scan
+                return list(range(self.size))
+            if field_index is None:
+                continue
+            if value is None:
+                positions.update(field_index.missing)
+            else:
+                field_index.lookup(value, positions)
+        return sorted(positions)
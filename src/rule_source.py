@@ -0,0 +1,164 @@
+"""
+Rules loaded from an SSM parameter or a local file in addition to the rules from the environment.
+
+The parameter or file holds a JSON object, both keys are optional:
+
+    {"rules": ["event[\"eventName\"] == \"StopLogging\""], "ignore_rules": []}
+
+It is read again once the last read is older than the ttl. Rule sets are compiled once per content
+hash and swapped in between invocations, an invocation uses the same rules from start to end.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import config
+from config import get_logger
+from rule_engine import RuleSet
+
+logger = get_logger()
+
+# rule sets of this many contents are kept, so switching back to a previous version costs nothing
+COMPILED_VERSIONS = 4
+
+# (version, content), content is None if the version is the one passed in
+RuleFetcher = Callable[[Any], Tuple[Any, str | None]]
+
+
+class RuleSnapshot(NamedTuple):
+    version: Any
+    digest: str | None
+    rule_set: RuleSet
+    ignore_rule_set: RuleSet
+    # digest rules come from the environment only, see digest.py
+    digest_rule_set: RuleSet | None = None
+
+    @property
+    def errors(self) -> List[Dict[str, Any]]: # noqa: ANN101
+        digest_errors = self.digest_rule_set.errors if self.digest_rule_set is not None else []
+        return self.rule_set.errors + self.ignore_rule_set.errors + digest_errors
+
+
+def ssm_parameter_fetcher(name: str) -> RuleFetcher:
+    def fetch(known_version: Any) -> Tuple[Any, str | None]: # noqa: ANN401
+        parameter = config.retrieve_extension_value(config.CONFIG_PARAMETER_PATH + name)["Parameter"]
+        version = parameter.get("Version")
+        if version is not None and version == known_version:
+            return version, None
+        return version, parameter["Value"]
+    return fetch
+
+
+def file_fetcher(path: str) -> RuleFetcher:
+    def fetch(known_version: Any) -> Tuple[Any, str | None]: # noqa: ANN401
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == known_version:
+            return version, None
+        with open(path, encoding="utf-8") as f:
+            return version, f.read()
+    return fetch
+
+
+def parse_rules(content: str) -> Tuple[List[str], List[str]]:
+    document = json.loads(content)
+    if not isinstance(document, dict):
+        raise ValueError("Rules must be a JSON object with the keys rules and ignore_rules")
+    rules, ignore_rules = document.get("rules") or [], document.get("ignore_rules") or []
+    for name, value in (("rules", rules), ("ignore_rules", ignore_rules)):
+        if not isinstance(value, list) or not all(isinstance(rule, str) for rule in value):
+            raise ValueError(f"{name} must be a list of strings")
+    return rules, ignore_rules
+
+
+class RuleStore:
+    """
+    The rules in use. Without a fetcher these are the base rules, otherwise the base rules
+    followed by the rules read from the parameter or file.
+    """
+
+    def __init__( # noqa: PLR0913
+        self, # noqa: ANN101
+        base_rules: Sequence[str],
+        base_ignore_rules: Sequence[str],
+        fetch: RuleFetcher | None = None,
+        ttl: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.base_rules = list(base_rules)
+        self.base_ignore_rules = list(base_ignore_rules)
+        self.ttl = ttl
+        self._fetch = fetch
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._compiled: OrderedDict[str, RuleSnapshot] = OrderedDict()
+        self._fetched_at = 0.0
+        self._snapshot: RuleSnapshot | None = None
+        self.digest_rule_set: RuleSet | None = None
+        if fetch is None:
+            self._snapshot = RuleSnapshot(None, None, RuleSet(self.base_rules), RuleSet(self.base_ignore_rules))
+
+    @classmethod
+    def from_config(cls, cfg: config.Config) -> "RuleStore": # noqa: ANN102
+        fetch = None
+        if cfg.rules_ssm_parameter_name:
+            fetch = ssm_parameter_fetcher(cfg.rules_ssm_parameter_name)
+        elif cfg.rules_file:
+            fetch = file_fetcher(cfg.rules_file)
+        store = cls(cfg.rules, cfg.ignore_rules, fetch, ttl=cfg.config_cache_ttl_seconds)
+        if cfg.digest_rules:
+            store.digest_rule_set = cfg.digest_rule_set
+        if fetch is None:
+            # the base rules are already compiled by Config
+            store._snapshot = RuleSnapshot(None, None, cfg.rule_set, cfg.ignore_rule_set, store.digest_rule_set)
+        return store
+
+    def current(self) -> RuleSnapshot: # noqa: ANN101
+        """Rules for the next invocation, read again first if the last read is older than ttl."""
+        snapshot = self._snapshot
+        if self._fetch is None or (snapshot is not None and (self.ttl <= 0 or self._clock() - self._fetched_at < self.ttl)):
+            return snapshot
+        try:
+            return self.refresh()
+        except Exception as e:
+            if snapshot is None:
+                raise
+            # the rules in use stay, the next attempt is made after ttl
+            logger.exception({"Failed to refresh rules": {"error": str(e)}})
+            self._fetched_at = self._clock()
+            return snapshot
+
+    def refresh(self) -> RuleSnapshot: # noqa: ANN101
+        with self._lock:
+            snapshot = self._snapshot
+            version, content = self._fetch(snapshot.version if snapshot else None)
+            if content is not None:
+                snapshot = self._compile(version, content)
+            self._snapshot = snapshot
+            self._fetched_at = self._clock()
+            return snapshot
+
+    def _compile(self, version: Any, content: str) -> RuleSnapshot: # noqa: ANN101, ANN401
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        snapshot = self._compiled.get(digest)
+        if snapshot is None:
+            rules, ignore_rules = parse_rules(content)
+            # compiled rules are cached by source, the base rules are not compiled again
+            snapshot = RuleSnapshot(
+                version, digest, RuleSet(self.base_rules + rules), RuleSet(self.base_ignore_rules + ignore_rules), self.digest_rule_set,
+            )
+            # errors of the digest rules were logged by Config already
+            for error in snapshot.rule_set.errors + snapshot.ignore_rule_set.errors:
+                logger.error({"Rule compilation failed": {"error": str(error["error"]), "rule": error["rule"]}})
+            logger.info({"Loaded rules": {"version": version, "digest": digest, "rules": len(rules), "ignore_rules": len(ignore_rules)}})
+        else:
+            snapshot = snapshot._replace(version=version)
+        self._compiled[digest] = snapshot
+        self._compiled.move_to_end(digest)
+        while len(self._compiled) > COMPILED_VERSIONS:
+            self._compiled.popitem(last=False)
+        return snapshot
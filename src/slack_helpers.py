@@ -1,11 +1,11 @@
-import http.client
 import json
 
 from config import  get_logger, SlackAppConfig, SlackWebhookConfig
-from dateutil.parser import parse as parse_date
-from slack_sdk import WebClient
-from typing import Any
-from slack_sdk.web.slack_response import SlackResponse
+from slack_transport import post_to_webhook, slack_api_client
+from typing import TYPE_CHECKING, Any, List
+
+if TYPE_CHECKING:
+    from slack_sdk.web.slack_response import SlackResponse
 
 logger = get_logger()
 
@@ -16,16 +16,10 @@ def post_message( # noqa: ANN201
         message: dict,
         account_id: str | None = None,
         thread_ts: str | None = None,
-) -> None | SlackResponse:
+) -> "None | SlackResponse":
     logger.info
     if isinstance(slack_config, SlackAppConfig):
-        if account_id and slack_config.configuration:
-            channel_id = next(
-                (cfg["slack_channel_id"] for cfg in slack_config.configuration if account_id in cfg["accounts"]), # noqa: E501
-                slack_config.default_channel_id
-            )
-        else:
-            channel_id = slack_config.default_channel_id
+        channel_id = slack_config.channel_id_for_account(account_id)
         return slack_app_post_message(
             message = message,
             channel_id = channel_id,
@@ -34,13 +28,7 @@ def post_message( # noqa: ANN201
         )
 
     if isinstance(slack_config, SlackWebhookConfig):
-        if account_id and slack_config.configuration:
-            hook_url = next(
-                (cfg["slack_hook_url"] for cfg in slack_config.configuration if account_id in cfg["accounts"]), # noqa: E501
-                slack_config.default_hook_url
-            )
-        else:
-            hook_url = slack_config.default_hook_url
+        hook_url = slack_config.hook_url_for_account(account_id)
         webhook_post_message(
             message = message,
             hook_url = hook_url,
@@ -53,36 +41,35 @@ def slack_app_post_message( # noqa: ANN201
         slack_config: SlackAppConfig,
         thread_ts: str | None = None
 ):
-    client = WebClient(token=slack_config.bot_token)
-    return client.chat_postMessage(
-        channel = channel_id,
-        blocks = message["blocks"],
-        thread_ts = thread_ts,
-        text="New message from CloudTrailToSlack"
-    )
+    client = slack_api_client(slack_config.bot_token)
+    return client.api_call("chat.postMessage", {
+        "channel": channel_id,
+        "blocks": message["blocks"],
+        "thread_ts": thread_ts,
+        "text": "New message from CloudTrailToSlack",
+    })
 
 
 
 # Slack web hook example
 # https://hooks.slack.com/services/XXXXXXX/XXXXXXX/XXXXXXXXXX
-def webhook_post_message(message: dict, hook_url: str) -> int:
+def webhook_post_message(message: dict, hook_url: str) -> int | None:
     if not hook_url:
         logger.error("No hook URL provided")
         return 200
     logger.info({"Sending message to slack": message})
-    headers = {"Content-type": "application/json"}
-    connection = http.client.HTTPSConnection("hooks.slack.com")
-    connection.request("POST",
-                       hook_url.replace("https://hooks.slack.com", ""),
-                       json.dumps(message),
-                       headers)
-    response = connection.getresponse()
-    logger.info({"Slack response": {"status": response.status, "message": response.read().decode()}})
+    response = post_to_webhook(hook_url, json.dumps(message).encode())
+    if response is None:
+        return None
+    logger.info({"Slack response": {"status": response.status, "message": response.data.decode()}})
     return response.status
 
 
 # Format message
 def event_to_slack_message(event:  dict, source_file :str , account_id_from_event: str ) ->  dict[str, Any]:
+    # imported on first use, it is not needed to load the module
+    from dateutil.parser import parse as parse_date
+
     event_name = event["eventName"]
     error_code = event.get("errorCode")
     error_message = event.get("errorMessage")
@@ -180,6 +167,83 @@ def event_to_slack_message(event:  dict, source_file :str , account_id_from_even
     return message
 
 
+def add_occurrences_to_slack_message(
+        message: dict,
+        count: int,
+        first_time: str,
+        last_time: str,
+        event_ids: List[str],
+) -> dict[str, Any]:
+    # the message of the first event of a group stands for all of them, the count goes below the title
+    more = f" and {count - len(event_ids)} more" if count > len(event_ids) else ""
+    occurrences = {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": f":repeat: *{count} times* between {first_time} and {last_time}\n*Event ids:* {', '.join(event_ids)}{more}"
+        }
+    }
+    return {**message, "blocks": message["blocks"][:1] + [occurrences] + message["blocks"][1:]}
+
+
+# Slack allows 50 blocks per message
+DIGEST_RULES_SHOWN = 40
+
+
+def message_for_digest(
+        start: str,
+        end: str,
+        rules: List[tuple[str, dict[str, int]]],
+) ->  dict[str, Any]:
+    # rules with the number of matching events per account, the most frequent first
+    rules = sorted(rules, key=lambda rule: -sum(rule[1].values()))
+    total = sum(sum(accounts.values()) for _, accounts in rules)
+    blocks = [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f":bell: *Digest:* {total} events matched digest rules between {start} and {end} UTC"
+            }
+        }
+    ]
+    for rule, accounts in rules[:DIGEST_RULES_SHOWN]:
+        per_account = ", ".join(f"{account_id}: {count}" for account_id, count in sorted(accounts.items()))
+        blocks.append(
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"*{sum(accounts.values())}* ```{rule}```\nAccount Id: {per_account}"
+                }
+            }
+        )
+    if len(rules) > DIGEST_RULES_SHOWN:
+        blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": f"and {len(rules) - DIGEST_RULES_SHOWN} more rules"}]})
+    blocks.append({"type": "divider"})
+    return {"blocks": blocks}
+
+
+def message_for_suppressed_alerts(
+        principal: str,
+        principal_account_id: str,
+        count: int,
+        since: str,
+) ->  dict[str, Any]:
+    return {
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f":mute: *{count} more* alerts of `{principal}` (account {principal_account_id}) were suppressed since {since} UTC, it is over the alert limit per principal" # noqa: E501
+                }
+            },
+            {"type": "divider"},
+        ]
+    }
+
+
 def message_for_slack_error_notification(
         error: Exception,
         s3_notification_event:  dict
@@ -0,0 +1,114 @@
+import random
+import threading
+import time
+from typing import Callable, Dict
+
+import urllib3
+from config import get_logger
+
+logger = get_logger()
+
+# Slack allows about one message per second per channel or webhook, with short bursts above that
+MESSAGES_PER_SECOND = 1.0
+BURST = 3
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# time left for the rest of the invocation once no more messages are sent
+DEADLINE_MARGIN_SECONDS = 2.0
+
+
+class TokenBucket:
+    """Rate limit of one destination, slots are handed out in the order they are asked for."""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float]) -> None: # noqa: ANN101
+        self._interval = 1 / rate
+        self._tolerance = (burst - 1) * self._interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        # earliest time the bucket is empty again
+        self._empty_at = 0.0
+
+    def reserve(self, deadline: float | None) -> float | None: # noqa: ANN101
+        """Takes a slot and returns the seconds to wait for it, None if the slot is after the deadline."""
+        with self._lock:
+            now = self._clock()
+            empty_at = max(self._empty_at, now)
+            wait = max(0.0, empty_at - self._tolerance - now)
+            if deadline is not None and now + wait > deadline:
+                return None
+            self._empty_at = empty_at + self._interval
+            return wait
+
+    def pause(self, seconds: float) -> None: # noqa: ANN101
+        """No slot is handed out for the given time, like after a 429 from Slack."""
+        with self._lock:
+            self._empty_at = max(self._empty_at, self._clock() + seconds + self._tolerance)
+
+
+class OutboundScheduler:
+    """
+    Sends Slack requests as fast as each channel or webhook allows. Rate limited requests are
+    retried after Retry-After or a jittered backoff, until the deadline.
+    """
+
+    def __init__( # noqa: PLR0913
+        self, # noqa: ANN101
+        rate: float = MESSAGES_PER_SECOND,
+        burst: int = BURST,
+        max_attempts: int = MAX_ATTEMPTS,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.deadline: float | None = None
+
+    def set_deadline(self, seconds_from_now: float | None) -> None: # noqa: ANN101
+        self.deadline = None if seconds_from_now is None else self._clock() + seconds_from_now - DEADLINE_MARGIN_SECONDS
+
+    def _bucket(self, destination: str) -> TokenBucket: # noqa: ANN101
+        with self._lock:
+            bucket = self._buckets.get(destination)
+            if bucket is None:
+                bucket = self._buckets[destination] = TokenBucket(self.rate, self.burst, self._clock)
+            return bucket
+
+    def send(self, destination: str, request: Callable[[], urllib3.HTTPResponse]) -> urllib3.HTTPResponse | None: # noqa: ANN101
+        """Returns the last response, or None if the request could not be sent before the deadline."""
+        bucket = self._bucket(destination)
+        response = None
+        for attempt in range(self.max_attempts):
+            wait = bucket.reserve(self.deadline)
+            if wait is None:
+                logger.error({"Slack message dropped, no time left to send it": {"destination": destination, "attempts": attempt}}) # noqa: E501
+                return None
+            if wait:
+                self._sleep(wait)
+            response = request()
+            if not should_retry(response):
+                return response
+            delay = retry_after(response)
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)) # noqa: S311
+            logger.warning({"Slack request will be retried": {"destination": destination, "status": response.status, "delay": delay}}) # noqa: E501
+            bucket.pause(delay)
+        return response
+
+
+def should_retry(response: urllib3.HTTPResponse) -> bool:
+    # Messages are not idempotent and Slack can answer with a 5xx after it posted one, other 5xx go back to the caller
+    return response.status == 429 or (response.status == 503 and retry_after(response) is not None) # noqa: PLR2004
+
+
+def retry_after(response: urllib3.HTTPResponse) -> float | None:
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
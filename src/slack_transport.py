@@ -0,0 +1,106 @@
+import hashlib
+import json
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict
+from urllib.parse import urlsplit
+
+import urllib3
+from config import get_logger
+from slack_scheduler import OutboundScheduler
+
+if TYPE_CHECKING:
+    from slack_sdk.web.slack_response import SlackResponse
+
+logger = get_logger()
+
+SLACK_API_HOST = "slack.com"
+# connections kept per host, enough for the delivery thread pool
+POOL_SIZE = 10
+TIMEOUT = urllib3.Timeout(connect=5.0, read=30.0)
+
+# shared by all threads, the rate limits are per channel and webhook and not per caller
+scheduler = OutboundScheduler()
+
+
+class SlackTransport:
+    """Keep-alive HTTPS connections to one Slack host, shared by all messages of the container."""
+
+    def __init__(self, host: str) -> None: # noqa: ANN101
+        self.host = host
+        # POST is not retried by urllib3 once it was sent, only connecting is. Sockets Slack closed while
+        # they were idle are dropped when they are checked out of the pool.
+        self.pool = urllib3.HTTPSConnectionPool(
+            host,
+            maxsize=POOL_SIZE,
+            timeout=TIMEOUT,
+            retries=urllib3.Retry(total=2, connect=2, read=0, redirect=0, status=0, raise_on_status=False),
+        )
+
+    def post(self, path: str, body: bytes, headers: Dict[str, str]) -> urllib3.HTTPResponse: # noqa: ANN101
+        # a connection that breaks after the request was written is not sent again, Slack may have posted it
+        return self.pool.urlopen("POST", path, body=body, headers=headers)
+
+
+@lru_cache(maxsize=None)
+def slack_transport(host: str) -> SlackTransport:
+    return SlackTransport(host)
+
+
+class SlackApiClient:
+    """Posts to the Slack Web API over a pooled transport, responses behave like the ones of slack_sdk."""
+
+    def __init__(self, bot_token: str) -> None: # noqa: ANN101
+        self.transport = slack_transport(SLACK_API_HOST)
+        self.headers = {
+            "Authorization": f"Bearer {bot_token}",
+            "Content-Type": "application/json;charset=utf-8",
+        }
+        # slack_sdk is loaded with the first Slack app client, webhook setups don't need it
+        from slack_sdk import WebClient
+        # only used by SlackResponse, it never opens a connection itself
+        self.web_client = WebClient(token=bot_token)
+
+    def api_call(self, api_method: str, payload: Dict[str, Any]) -> "SlackResponse | None": # noqa: ANN101
+        """Returns None if the message could not be sent before the deadline of the scheduler."""
+        from slack_sdk.web.slack_response import SlackResponse
+
+        payload = {key: value for key, value in payload.items() if value is not None}
+        body = json.dumps(payload).encode()
+        response = scheduler.send(
+            payload.get("channel", api_method),
+            lambda: self.transport.post(f"/api/{api_method}", body, self.headers),
+        )
+        if response is None:
+            return None
+        return SlackResponse(
+            client = self.web_client,
+            http_verb = "POST",
+            api_url = f"https://{SLACK_API_HOST}/api/{api_method}",
+            req_args = {"json": payload},
+            data = _json_or_empty(response),
+            headers = dict(response.headers),
+            status_code = response.status,
+        ).validate()
+
+
+def _json_or_empty(response: urllib3.HTTPResponse) -> Dict[str, Any]:
+    # error pages of a load balancer in front of Slack are not JSON, SlackResponse reports them as failed
+    try:
+        return json.loads(response.data)
+    except ValueError:
+        return {}
+
+
+@lru_cache(maxsize=None)
+def slack_api_client(bot_token: str) -> SlackApiClient:
+    return SlackApiClient(bot_token)
+
+
+def post_to_webhook(hook_url: str, body: bytes) -> urllib3.HTTPResponse | None:
+    """Returns None if the message could not be sent before the deadline of the scheduler."""
+    url = urlsplit(hook_url)
+    path = f"{url.path}?{url.query}" if url.query else url.path
+    transport = slack_transport(url.hostname or "hooks.slack.com")
+    # the hook url is a secret, it is not used as the name of the destination in logs
+    destination = "webhook-" + hashlib.sha256(hook_url.encode()).hexdigest()[:12]
+    return scheduler.send(destination, lambda: transport.post(path, body, {"Content-type": "application/json"}))
@@ -1,13 +1,38 @@
 import json
-from typing import Any
+import threading
+from functools import lru_cache
+from typing import Dict, List, NamedTuple
 
+import clients
 import config
 from config import get_logger
-import os
-from dateutil.parser import parse as parse_date
 
 logger = get_logger()
 
+# SNS limits for one PublishBatch request
+PUBLISH_BATCH_SIZE = 10
+PUBLISH_BATCH_BYTES = 256 * 1024
+
+
+@lru_cache(maxsize=1024)
+def topic_arn_for_account(pattern: str, account_id: str) -> str:
+    return pattern.replace("ACCOUNT_ID", account_id)
+
+
+def message_attributes(event: dict) -> Dict[str, Dict[str, str]]:
+    attributes = {}
+    for key, value in event.items():
+        if isinstance(value, str):
+            attributes[key] = {'DataType': 'String', 'StringValue': str(value)}
+    return attributes
+
+
+def publish_status(error: Exception) -> int:
+    # Missing topics and topics we may not publish to are not treated as failures
+    if "NotFound" in str(error) or "AuthorizationError" in str(error):
+        return 200
+    return 500
+
 
 def send_message_to_sns(
     event: dict,
@@ -18,23 +43,118 @@ def send_message_to_sns(
 )-> None:
     if pattern := cfg.sns_topic_pattern:
         logger.info("Sending message to SNS.")
-        attributes = {}
-        for key, value in event.items():
-            if isinstance(value, str):
-                attributes[key] = {'DataType': 'String', 'StringValue': str(value)}
+        attributes = message_attributes(event)
         message = json.dumps(event)
 
         logger.debug(f"SNS Message: {message}")
-        topic_arn = pattern.replace("ACCOUNT_ID", account_id)
+        topic_arn = topic_arn_for_account(pattern, account_id)
         logger.debug(f"Topic ARN: {topic_arn}")
         try:
             return sns_client.publish(
                 TargetArn=topic_arn,
-                Message=json.dumps(event),
+                Message=message,
                 MessageAttributes=attributes
             )['ResponseMetadata']['HTTPStatusCode']
         except Exception as e:
             logger.info(f"Topic {topic_arn}: {e}")
-            if "NotFound" in str(e) or "AuthorizationError" in str(e):
-                return 200
-            return 500
+            return publish_status(e)
+
+
+class SnsMessage(NamedTuple):
+    topic_arn: str
+    message: str
+    attributes: Dict[str, Dict[str, str]]
+
+
+class SnsBatch:
+    """
+    Collects the SNS messages of one invocation and sends them per topic with PublishBatch.
+    flush() returns the status of every message in the order they were added,
+    with the same meaning as the return value of send_message_to_sns.
+    """
+
+    def __init__(self, cfg: config.Config, sns_client=None) -> None: # noqa: ANN001, ANN101
+        self.cfg = cfg
+        self._sns_client = sns_client
+        self._lock = threading.Lock()
+        self._messages: List[SnsMessage | None] = []
+
+    def add(self, event: dict, source_file: str, account_id: str | None) -> None: # noqa: ANN101, ARG002
+        message = None
+        if pattern := self.cfg.sns_topic_pattern:
+            message = SnsMessage(topic_arn_for_account(pattern, account_id), json.dumps(event), message_attributes(event))
+        with self._lock:
+            self._messages.append(message)
+
+    def flush(self) -> List[int | None]: # noqa: ANN101
+        with self._lock:
+            messages, self._messages = self._messages, []
+        statuses: List[int | None] = [None] * len(messages)
+        by_topic: Dict[str, List[int]] = {}
+        for position, message in enumerate(messages):
+            if message is not None:
+                by_topic.setdefault(message.topic_arn, []).append(position)
+        for topic_arn, positions in by_topic.items():
+            logger.info({"Sending messages to SNS": {"topic": topic_arn, "count": len(positions)}})
+            for batch in self._batches(messages, positions):
+                self._publish_batch(topic_arn, messages, batch, statuses)
+        return statuses
+
+    @staticmethod
+    def _batches(messages: List[SnsMessage | None], positions: List[int]) -> List[List[int]]:
+        batches: List[List[int]] = []
+        size = 0
+        for position in positions:
+            message = messages[position]
+            message_size = len(message.message.encode()) + len(json.dumps(message.attributes))
+            if not batches or len(batches[-1]) == PUBLISH_BATCH_SIZE or size + message_size > PUBLISH_BATCH_BYTES:
+                batches.append([])
+                size = 0
+            batches[-1].append(position)
+            size += message_size
+        return batches
+
+    def _publish_batch(
+        self, # noqa: ANN101
+        topic_arn: str,
+        messages: List[SnsMessage | None],
+        batch: List[int],
+        statuses: List[int | None],
+    ) -> None:
+        if len(batch) == 1:
+            statuses[batch[0]] = self._publish(messages[batch[0]])
+            return
+        try:
+            response = (self._sns_client or clients.sns_client()).publish_batch(
+                TopicArn=topic_arn,
+                PublishBatchRequestEntries=[
+                    {"Id": str(position), "Message": messages[position].message, "MessageAttributes": messages[position].attributes}
+                    for position in batch
+                ],
+            )
+        except Exception as e:
+            logger.info(f"Topic {topic_arn}: {e}")
+            status = publish_status(e)
+            if status == 200: # noqa: PLR2004
+                for position in batch:
+                    statuses[position] = status
+                return
+            # a failed request is sent again message by message
+            response = {"Successful": [], "Failed": [{"Id": str(position)} for position in batch]}
+
+        for entry in response.get("Successful", []):
+            statuses[int(entry["Id"])] = response["ResponseMetadata"]["HTTPStatusCode"]
+        for entry in response.get("Failed", []):
+            logger.info({"SNS message failed, sending it again": {"topic": topic_arn, "code": entry.get("Code"), "error": entry.get("Message")}}) # noqa: E501
+            statuses[int(entry["Id"])] = self._publish(messages[int(entry["Id"])])
+
+    def _publish(self, message: SnsMessage) -> int: # noqa: ANN101
+        try:
+            return (self._sns_client or clients.sns_client()).publish(
+                TargetArn=message.topic_arn,
+                Message=message.message,
+                MessageAttributes=message.attributes,
+            )["ResponseMetadata"]["HTTPStatusCode"]
+        except Exception as e:
+            logger.info(f"Topic {message.topic_arn}: {e}")
+            return publish_status(e)
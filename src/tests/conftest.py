@@ -1,5 +1,13 @@
+import copy
+import json
+from functools import lru_cache
+from typing import Any, Dict, List
+
 import boto3
 import os
+import pytest
+
+TEST_EVENTS_PATH = "tests/test_events.json"
 
 
 def pytest_sessionstart(session):  # noqa: ANN201, ARG001, ANN001
@@ -16,3 +24,51 @@ def pytest_sessionstart(session):  # noqa: ANN201, ARG001, ANN001
     }
     os.environ |= mock_env
     boto3.setup_default_session(region_name="us-east-1")
+
+
+@lru_cache(maxsize=None)
+def load_test_events() -> List[Dict[str, Any]]:
+    # read once per session, tests get copies they can change
+    with open(TEST_EVENTS_PATH) as f:
+        return json.load(f)["test_events"]
+
+
+def pytest_generate_tests(metafunc: pytest.Metafunc) -> None:
+    # a test that takes test_event runs once for every event of test_events.json
+    if "test_event" in metafunc.fixturenames:
+        test_events = load_test_events()
+        metafunc.parametrize(
+            "test_event",
+            [copy.deepcopy(test_event["event"]) for test_event in test_events],
+            ids=[test_event["test_event_name"] for test_event in test_events],
+        )
+
+
+@pytest.fixture()
+def test_events() -> List[Dict[str, Any]]:
+    return [copy.deepcopy(test_event["event"]) for test_event in load_test_events()]
+
+
+@pytest.fixture()
+def events_by_name(test_events: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    return {event["eventName"]: event for event in test_events}
+
+
+class Clock:
+    """Time that only moves when a test sets it or sleeps."""
+
+    def __init__(self, now: float = 0.0) -> None: # noqa: ANN101
+        self.now = now
+        self.sleeps: List[float] = []
+
+    def __call__(self) -> float: # noqa: ANN101
+        return self.now
+
+    def sleep(self, seconds: float) -> None: # noqa: ANN101
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture()
+def clock() -> Clock:
+    return Clock()
@@ -0,0 +1,68 @@
+"""
+Throughput of the hot paths on synthetic events, with pytest-benchmark (skipped if it is not installed).
+
+The default addopts pass --benchmark-skip, so plain pytest runs leave them out; run them with --benchmark-only.
+
+Save a baseline on a machine and compare later runs on the same machine against it:
+
+    cd src && pytest tests/test_benchmarks.py --benchmark-only --benchmark-autosave
+    cd src && pytest tests/test_benchmarks.py --benchmark-only --benchmark-compare --benchmark-compare-fail=median:15%
+
+Baselines are saved in src/.benchmarks. Every benchmark handles EVENTS events per round.
+"""
+import logging
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import main # noqa: E402
+from dynamodb import hash_user_identity_and_event_name # noqa: E402
+from flat_event import flatten_json # noqa: E402
+from rule_engine import RuleSet # noqa: E402
+from rules import default_rules # noqa: E402
+from slack_helpers import event_to_slack_message # noqa: E402
+from tools.synthetic_events import generate_events, subscription_payload, synthetic_rules # noqa: E402
+
+# ruff: noqa: ANN201, ANN001
+
+EVENTS = 1000
+SEED = 42
+
+events = generate_events(EVENTS, seed=SEED)
+payload = subscription_payload(events)
+
+
+@pytest.fixture(autouse=True)
+def quiet_logger():
+    # the handler logs every event at INFO, formatting the log lines would be most of the time
+    logger = logging.getLogger("main")
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    yield
+    logger.setLevel(level)
+
+
+def test_get_cloudtrail_log_records(benchmark):
+    records = benchmark(main.get_cloudtrail_log_records, payload)
+    assert len(records) == EVENTS
+
+
+def test_flatten_json(benchmark):
+    benchmark(lambda: [flatten_json(event) for event in events])
+
+
+@pytest.mark.parametrize("rule_count", [len(default_rules), 100], ids=["default_rules", "100_rules"])
+def test_should_message_be_processed(benchmark, rule_count):
+    rules = RuleSet(default_rules if rule_count == len(default_rules) else synthetic_rules(rule_count, seed=SEED))
+    ignore_rules = RuleSet([])
+    matches = benchmark(lambda: sum(main.should_message_be_processed(event, rules, ignore_rules).should_be_processed for event in events))
+    assert matches > 0 or rule_count != len(default_rules)
+
+
+def test_event_to_slack_message(benchmark):
+    benchmark(lambda: [event_to_slack_message(event, "aws-cloudtrail-logs", event["recipientAccountId"]) for event in events])
+
+
+def test_hash_user_identity_and_event_name(benchmark):
+    benchmark(lambda: [hash_user_identity_and_event_name(event) for event in events])
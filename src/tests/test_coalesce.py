@@ -0,0 +1,76 @@
+import copy
+import json
+
+import main
+import pytest
+from coalesce import AlertGroup, group_by_key
+from config import SlackWebhookConfig
+from log_stream import CloudTrailRecord, LogBatch
+from rule_source import RuleStore
+from rules import default_rules
+from sns import SnsBatch
+
+# ruff: noqa: ANN201, ANN001, E501
+
+@pytest.fixture()
+def repeated(events_by_name):
+    def make(name, count, account_id=None) -> list:
+        events = []
+        for number in range(count):
+            event = copy.deepcopy(events_by_name[name])
+            event["eventID"] = f"{name}-{number}"
+            event["eventTime"] = f"2024-05-01T10:00:{number:02d}Z"
+            if account_id:
+                event["recipientAccountId"] = account_id
+            events.append(event)
+        return events
+    return make
+
+
+def test_group_by_key_keeps_the_order_of_first_occurrence():
+    items = ["a1", "b1", "x", "a2", "x", "b2"]
+    assert group_by_key(items, lambda item: None if item == "x" else item[0]) == [["a1", "a2"], ["b1", "b2"], ["x"], ["x"]]
+
+
+def test_alert_group(repeated):
+    events = repeated("DeleteTrail", 7)
+    group = AlertGroup(list(reversed(events)))
+    assert group.count == len(events)
+    assert (group.first_time, group.last_time) == ("2024-05-01T10:00:00Z", "2024-05-01T10:00:06Z")
+    assert group.sample_event_ids() == ["DeleteTrail-6", "DeleteTrail-5", "DeleteTrail-4", "DeleteTrail-3", "DeleteTrail-2"]
+
+
+def run_handler(monkeypatch, events, coalesce_alerts):
+    monkeypatch.setattr(main.cfg, "coalesce_alerts", coalesce_alerts)
+    monkeypatch.setattr(main, "rule_store", RuleStore(default_rules, []))
+    monkeypatch.setattr(main, "slack_config", SlackWebhookConfig("https://hooks.slack.com/x", []))
+    posted = []
+    monkeypatch.setattr(main, "post_message", lambda message, **kwargs: posted.append((message, kwargs["account_id"])))
+    published = []
+    add = SnsBatch.add
+    monkeypatch.setattr(SnsBatch, "add", lambda self, event, *args: published.append(event["eventID"]) or add(self, event, *args))
+    batch = LogBatch("/aws/cloudtrail", "123456789012")
+    monkeypatch.setattr(main, "iter_cloudtrail_log_records", lambda *_: [CloudTrailRecord(event, batch) for event in events])
+    main.lambda_handler({}, None)
+    return posted, published
+
+
+def test_repeated_alerts_are_one_message(monkeypatch, repeated):
+    events = repeated("DeleteTrail", 8) + repeated("StopLogging", 1) + repeated("DeleteTrail", 2, account_id="999999999999")
+    posted, published = run_handler(monkeypatch, events, coalesce_alerts=True)
+
+    message, account_id = posted[0]
+    occurrences = message["blocks"][1]["text"]["text"]
+    assert "*8 times* between 2024-05-01T10:00:00Z and 2024-05-01T10:00:07Z" in occurrences
+    assert "DeleteTrail-0, DeleteTrail-1, DeleteTrail-2, DeleteTrail-3, DeleteTrail-4 and 3 more" in occurrences
+    # alerts of other accounts go to their own channel
+    assert [account_id for _, account_id in posted] == [events[0]["recipientAccountId"], events[8]["recipientAccountId"], "999999999999"]
+    assert "times*" not in json.dumps(posted[1][0])
+    # SNS still gets every event
+    assert sorted(published) == sorted(event["eventID"] for event in events)
+
+
+def test_alerts_are_not_coalesced_by_default(monkeypatch, repeated):
+    events = repeated("DeleteTrail", 4)
+    posted, published = run_handler(monkeypatch, events, coalesce_alerts=False)
+    assert len(posted) == len(published) == len(events)
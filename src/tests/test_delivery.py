@@ -0,0 +1,83 @@
+import threading
+import time
+
+import main
+import pytest
+from config import SlackAppConfig
+from delivery import OrderedExecutor
+
+# ruff: noqa: ANN201, ANN001, E501
+
+
+def test_tasks_with_the_same_key_run_in_order():
+    delivered = {key: [] for key in "abc"}
+    with OrderedExecutor(max_workers=4) as executor:
+        for i in range(50):
+            key = "abc"[i % 3]
+            # later tasks are faster, without the lane they would overtake the earlier ones
+            executor.submit(key, lambda key, i: (time.sleep((50 - i) / 20000), delivered[key].append(i)), key, i)
+        executor.wait()
+    assert delivered == {key: [i for i in range(50) if "abc"[i % 3] == key] for key in "abc"}
+
+
+def test_tasks_with_different_keys_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    with OrderedExecutor(max_workers=3) as executor:
+        for key in ("a", "b", None):
+            executor.submit(key, barrier.wait)
+        executor.wait()
+
+
+def test_first_error_is_raised_and_the_lane_continues():
+    delivered = []
+
+    def deliver(i) -> None:
+        if i in (1, 2):
+            raise ValueError(i)
+        delivered.append(i)
+
+    with OrderedExecutor(max_workers=2) as executor:
+        for i in range(4):
+            executor.submit("a", deliver, i)
+        with pytest.raises(ValueError, match="1"):
+            executor.wait()
+    assert delivered == [0, 3]
+
+
+def test_pending_tasks_are_bounded():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def deliver() -> None:
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.001)
+        with lock:
+            running.pop()
+
+    max_pending, tasks = 2, 30
+    with OrderedExecutor(max_workers=8, max_pending=max_pending) as executor:
+        for _ in range(tasks):
+            executor.submit(None, deliver)
+        executor.wait()
+    assert max(peak) <= max_pending
+    assert len(peak) == tasks
+
+
+def test_deliveries_keep_slack_threads_in_order(monkeypatch):
+    monkeypatch.setattr(main, "slack_config", SlackAppConfig("token", "channel", []))
+    monkeypatch.setattr(main.cfg, "delivery_concurrency", 4)
+    delivered = []
+    monkeypatch.setattr(main, "deliver_event", lambda delivery, *_: delivered.append(delivery.event["eventID"]))
+    user = {"type": "IAMUser", "principalId": "A", "arn": "arn:aws:iam::1:user/a", "accountId": "1"}
+    names = ("StopLogging", "DeleteTrail")
+    events = [{"eventName": name, "eventID": f"{name}-{i}", "userIdentity": user} for i in range(10) for name in names]
+    deliveries = []
+    for event in events:
+        main.handle_event(event, "log-group", ['event.get("eventName", "") != ""'], [], invocation=main.Invocation(deliveries))
+    assert len({delivery.thread_key for delivery in deliveries}) == len(names)
+    main.deliver_events(deliveries, thread_store=None)
+    for name in names:
+        assert [d for d in delivered if d.startswith(name)] == [f"{name}-{i}" for i in range(10)]
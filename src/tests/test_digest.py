@@ -0,0 +1,118 @@
+import json
+
+import main
+from config import SlackWebhookConfig
+from digest import DigestStore, group_by_destination, rule_key
+from log_stream import CloudTrailRecord, LogBatch
+from rule_engine import RuleSet
+from rule_source import RuleStore
+from sns import SnsBatch
+from tools.stubs import FakeDynamoDbClient
+
+# ruff: noqa: ANN201, ANN001, E501
+
+DIGEST_RULE = 'event.get("eventName", "") == "StopLogging"'
+
+
+def store(monkeypatch, client, clock):
+    monkeypatch.setattr(main.cfg, "dynamodb_table_name", "table")
+    monkeypatch.setattr(main.cfg, "digest_window_seconds", 3600)
+    return DigestStore(main.cfg, client, clock)
+
+
+def test_counts_are_summarized_once_after_the_window(monkeypatch, clock):
+    client, clock.now = FakeDynamoDbClient(), 7200 + 100
+    first, second = store(monkeypatch, client, clock), store(monkeypatch, client, clock)
+    first.add("111111111111", DIGEST_RULE)
+    first.add("111111111111", DIGEST_RULE)
+    second.add("222222222222", DIGEST_RULE)
+    first.flush()
+    second.flush()
+    first.flush()
+    # one update per container
+    assert dict(client.calls) == {"update_item": 2}
+    assert first.claim_summaries() == []
+
+    clock.now = 3 * 3600 + 5
+    assert first.claim_summaries() == [(7200, {("111111111111", rule_key(DIGEST_RULE)): 2, ("222222222222", rule_key(DIGEST_RULE)): 1})]
+    # claimed by the first container, the second one finds nothing
+    assert second.claim_summaries() == []
+    assert first.claim_summaries() == []
+    assert client.items == {}
+
+
+def test_windows_missed_while_idle_are_checked(monkeypatch, clock):
+    client, clock.now = FakeDynamoDbClient(), 100
+    digest_store = store(monkeypatch, client, clock)
+    digest_store.claim_summaries()
+    digest_store.add("111111111111", DIGEST_RULE)
+    digest_store.flush()
+    clock.now = 5 * 3600 + 100
+    assert [window for window, _ in digest_store.claim_summaries()] == [0]
+    assert client.calls["delete_item"] == 1 + 5
+
+
+def test_many_counters_are_split_into_several_updates(monkeypatch, clock):
+    client, clock.now = FakeDynamoDbClient(), 100
+    digest_store = store(monkeypatch, client, clock)
+    for account in range(120):
+        digest_store.add(f"{account:012d}", DIGEST_RULE)
+    digest_store.flush()
+    assert dict(client.calls) == {"update_item": 3}
+    assert len(client.items["digest#0"]) == 120 + 2
+
+
+def test_group_by_destination():
+    counts = {("1", "a"): 1, ("2", "a"): 2, ("3", "b"): 3}
+    assert group_by_destination(counts, lambda account_id: "odd" if int(account_id) % 2 else "even") == [
+        ("1", {("1", "a"): 1, ("3", "b"): 3}),
+        ("2", {("2", "a"): 2}),
+    ]
+
+
+def test_handler_counts_digest_rules_and_posts_the_summary(monkeypatch, clock, events_by_name):
+    client, clock.now = FakeDynamoDbClient(), 3600 + 60
+    monkeypatch.setattr(main, "digest_store", store(monkeypatch, client, clock))
+    monkeypatch.setattr(main.cfg, "digest_rules", [DIGEST_RULE])
+    monkeypatch.setattr(main.cfg, "digest_rule_set", RuleSet([DIGEST_RULE]))
+    monkeypatch.setattr(main.cfg, "rule_set", RuleSet(['event.get("eventName", "") == "DeleteTrail"']))
+    monkeypatch.setattr(main, "rule_store", RuleStore.from_config(main.cfg))
+    monkeypatch.setattr(main, "slack_config", SlackWebhookConfig("https://hooks.slack.com/x", []))
+    posted = []
+    monkeypatch.setattr(main, "post_message", lambda message, **_: posted.append(message))
+    published = []
+    add = SnsBatch.add
+    monkeypatch.setattr(SnsBatch, "add", lambda self, event, *args: published.append(event["eventName"]) or add(self, event, *args))
+    batch = LogBatch("/aws/cloudtrail", "123456789012")
+    records = [CloudTrailRecord(events_by_name[name], batch) for name in ("DeleteTrail", "StopLogging", "StopLogging", "StopLogging")]
+    monkeypatch.setattr(main, "iter_cloudtrail_log_records", lambda *_: records)
+
+    main.lambda_handler({}, None)
+    # the other rule still posts right away
+    assert len(posted) == 1
+    assert "DeleteTrail" in json.dumps(posted[0])
+    # SNS gets the counted events as well
+    assert sorted(published) == ["DeleteTrail", "StopLogging", "StopLogging", "StopLogging"]
+
+    clock.now = 2 * 3600 + 1
+    monkeypatch.setattr(main, "iter_cloudtrail_log_records", lambda *_: [])
+    main.lambda_handler({}, None)
+    main.lambda_handler({}, None)
+    [summary] = posted[1:]
+    text = json.dumps(summary)
+    assert "*Digest:* 3 events matched digest rules between 1970-01-01 01:00 and 1970-01-01 02:00 UTC" in text
+    assert json.dumps(DIGEST_RULE)[1:-1] in text
+    assert f"{events_by_name['StopLogging']['recipientAccountId']}: 3" in text
+
+
+def test_broken_digest_rules_are_reported(monkeypatch):
+    monkeypatch.setattr(main.cfg, "digest_rules", ["event["])
+    monkeypatch.setattr(main.cfg, "digest_rule_set", RuleSet(["event["]))
+    monkeypatch.setattr(main, "rule_compilation_errors_reported", set())
+    monkeypatch.setattr(main, "slack_config", SlackWebhookConfig("https://hooks.slack.com/x", []))
+    reported = []
+    monkeypatch.setattr(main, "post_message", lambda message, **_: reported.append(message))
+
+    main.report_rule_compilation_errors(RuleStore.from_config(main.cfg).current())
+    assert len(reported) == 1
+    assert "event[" in json.dumps(reported[0])
@@ -0,0 +1,162 @@
+import dynamodb
+import main
+import pytest
+from config import SlackAppConfig
+from dynamodb import ThreadStore
+from ttl_cache import TTLCache
+
+# ruff: noqa: ANN201, ANN001, E501
+
+TABLE = "threads"
+
+
+class FakeDynamoDB:
+    """Answers batch requests, the first request of each kind leaves one key or item unprocessed."""
+
+    def __init__(self, items: dict | None = None) -> None: # noqa: ANN101
+        self.items = dict(items or {})
+        self.batch_get_calls = []
+        self.batch_write_calls = []
+
+    def batch_get_item(self, RequestItems: dict) -> dict: # noqa: ANN101
+        request = RequestItems[TABLE]
+        keys = [key["principal_structure_and_action_hash"]["S"] for key in request["Keys"]]
+        assert len(keys) <= dynamodb.BATCH_GET_SIZE
+        self.batch_get_calls.append(keys)
+        processed, unprocessed = (keys[:-1], keys[-1:]) if len(self.batch_get_calls) == 1 else (keys, [])
+        response = {"Responses": {TABLE: [self.items[key] for key in processed if key in self.items]}}
+        if unprocessed:
+            response["UnprocessedKeys"] = {TABLE: {**request, "Keys": [{"principal_structure_and_action_hash": {"S": key}} for key in unprocessed]}}
+        return response
+
+    def batch_write_item(self, RequestItems: dict) -> dict: # noqa: ANN101
+        requests = RequestItems[TABLE]
+        assert len(requests) <= dynamodb.BATCH_WRITE_SIZE
+        self.batch_write_calls.append(requests)
+        processed, unprocessed = (requests[:-1], requests[-1:]) if len(self.batch_write_calls) == 1 else (requests, [])
+        for request in processed:
+            item = request["PutRequest"]["Item"]
+            self.items[item["principal_structure_and_action_hash"]["S"]] = item
+        return {"UnprocessedItems": {TABLE: unprocessed} if unprocessed else {}}
+
+
+def item(hash_value, thread_ts, ttl=4102444800):
+    return {"principal_structure_and_action_hash": {"S": hash_value}, "thread_ts": {"S": thread_ts}, "ttl": {"N": str(ttl)}}
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(dynamodb.time, "sleep", lambda _: None)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    dynamodb.thread_ts_cache.clear()
+
+
+@pytest.fixture()
+def cfg(monkeypatch):
+    monkeypatch.setattr(main.cfg, "dynamodb_table_name", TABLE)
+    return main.cfg
+
+
+def test_prefetch_reads_in_batches_and_retries_unprocessed_keys(cfg):
+    client = FakeDynamoDB({f"h{i}": item(f"h{i}", f"ts{i}") for i in range(0, 250, 2)} | {"expired": item("expired", "old", ttl=1)})
+    store = ThreadStore(cfg, client)
+    store.prefetch([f"h{i}" for i in range(250)] + ["h0", None, "expired"])
+    assert [len(keys) for keys in client.batch_get_calls] == [100, 1, 100, 51]
+    calls = len(client.batch_get_calls)
+    assert store.get("h10") == "ts10"
+    assert store.get("h11") is None
+    assert store.get("expired") is None
+    assert len(client.batch_get_calls) == calls
+
+
+def test_warm_containers_use_the_cache(cfg):
+    client = FakeDynamoDB({"known": item("known", "ts1")})
+    ThreadStore(cfg, client).prefetch(["known", "new", "unknown"])
+    assert [len(keys) for keys in client.batch_get_calls] == [3, 1]
+
+    store = ThreadStore(cfg, client)
+    store.put("new", "ts2")
+    # the next invocation gets all three from the cache, misses included
+    store = ThreadStore(cfg, client)
+    store.prefetch(["known", "new", "unknown"])
+    assert (store.get("known"), store.get("new"), store.get("unknown")) == ("ts1", "ts2", None)
+    assert [len(keys) for keys in client.batch_get_calls] == [3, 1]
+
+
+def test_cached_misses_expire(cfg, monkeypatch, clock):
+    clock.now = 1000.0
+    monkeypatch.setattr(dynamodb, "thread_ts_cache", TTLCache(10, clock=clock))
+    client = FakeDynamoDB()
+    ThreadStore(cfg, client).prefetch(["a", "b"])
+    ThreadStore(cfg, client).prefetch(["a", "b"])
+    # one unprocessed key retried
+    assert [len(keys) for keys in client.batch_get_calls] == [2, 1]
+    clock.now += dynamodb.MISS_CACHE_SECONDS
+    ThreadStore(cfg, client).prefetch(["a", "b"])
+    assert [len(keys) for keys in client.batch_get_calls] == [2, 1, 2]
+
+
+def test_ttl_cache_evicts_least_recently_used_and_expired_entries(clock):
+    cache = TTLCache(2, clock=clock)
+    cache.set("a", 1, 10)
+    cache.set("b", None, 5)
+    assert cache.get("a") == 1
+    cache.set("c", 3, 10)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a", "default") == "default"
+    assert cache.get("c") is None
+    cache.set("d", 4, 0)
+    assert "d" not in cache
+
+
+def test_new_threads_are_visible_at_once_and_written_on_flush(cfg):
+    client = FakeDynamoDB()
+    store = ThreadStore(cfg, client)
+    for i in range(30):
+        store.put(f"h{i}", f"ts{i}")
+    assert store.get("h3") == "ts3"
+    assert client.batch_write_calls == []
+    store.flush()
+    assert [len(requests) for requests in client.batch_write_calls] == [25, 1, 5]
+    assert {key: value["thread_ts"]["S"] for key, value in client.items.items()} == {f"h{i}": f"ts{i}" for i in range(30)}
+    store.flush()
+    assert [len(requests) for requests in client.batch_write_calls] == [25, 1, 5]
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_events_with_the_same_hash_thread_onto_the_first_message(monkeypatch, cfg, concurrency):
+    client = FakeDynamoDB({})
+    posted = []
+
+    def post_message(message, thread_ts=None, **_: object) -> dict:
+        posted.append((message["name"], thread_ts))
+        return {"ts": f"ts-{message['name']}-{len(posted)}"}
+
+    monkeypatch.setattr(main, "slack_config", SlackAppConfig("token", "channel", []))
+    monkeypatch.setattr(main, "post_message", post_message)
+    monkeypatch.setattr(main, "send_message_to_sns", lambda **_: None)
+    monkeypatch.setattr(main, "event_to_slack_message", lambda event, *_: {"blocks": [], "name": event["eventName"]})
+    monkeypatch.setattr(cfg, "delivery_concurrency", concurrency)
+
+    user = {"type": "IAMUser", "principalId": "A", "arn": "arn:aws:iam::1:user/a", "accountId": "1"}
+    deliveries = []
+    for name in ["StopLogging", "StopLogging", "DeleteTrail", "StopLogging"]:
+        main.handle_event({"eventName": name, "userIdentity": user}, "log-group", ['event.get("eventName", "") != ""'], [], invocation=main.Invocation(deliveries))
+
+    store = ThreadStore(cfg, client)
+    store.prefetch(delivery.thread_key for delivery in deliveries)
+    main.deliver_events(deliveries, store)
+    store.flush()
+
+    stop_logging = [thread_ts for name, thread_ts in posted if name == "StopLogging"]
+    assert stop_logging[0] is None
+    assert stop_logging[1] == stop_logging[2] and stop_logging[1].startswith("ts-StopLogging")
+    assert [thread_ts for name, thread_ts in posted if name == "DeleteTrail"] == [None]
+    # one unprocessed key retried
+    assert [len(keys) for keys in client.batch_get_calls] == [2, 1]
+    assert sorted(client.items) == sorted({delivery.thread_key for delivery in deliveries})
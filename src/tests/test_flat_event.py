@@ -0,0 +1,47 @@
+import pytest
+from flat_event import LazyFlatEvent, flatten_json
+
+# ruff: noqa: ANN201, ANN001, E501
+
+tricky_events = [
+    {"a.b": 1, "a": {"c": 2}, "list": [{"x": None}, "y", [1, [2]]], "empty": {}, "none": None},
+    # the same flat key from two different paths, flatten_json keeps the last one
+    {"a": {"b": 1}, "a.b": None},
+    {"a.b": None, "a": {"b": 1}},
+    {"": {"": "empty keys"}, "01": ["leading zero"], "n": ["0", "1"]},
+]
+
+
+def assert_lazy_flat_event_matches_flatten_json(event):
+    expected = {k: v for k, v in flatten_json(event).items() if v is not None}
+    lazy = LazyFlatEvent(event)
+    for key, value in expected.items():
+        assert key in lazy
+        assert lazy[key] == value
+        assert lazy.get(key) == value
+    for key in ("missing", "a", "list.0", "list.0.x", "list.2.1", "list.5", "01.0", "n.00", "none", "userIdentity"):
+        if key not in expected:
+            assert key not in lazy
+            assert lazy.get(key, "default") == "default"
+            with pytest.raises(KeyError):
+                lazy[key]
+    assert dict(lazy) == expected
+    assert len(lazy) == len(expected)
+
+
+def test_lazy_flat_event_matches_flatten_json(test_event):
+    assert_lazy_flat_event_matches_flatten_json(test_event)
+
+
+@pytest.mark.parametrize("event", tricky_events)
+def test_lazy_flat_event_matches_flatten_json_for_tricky_events(event):
+    assert_lazy_flat_event_matches_flatten_json(event)
+
+
+def test_lazy_flat_event_does_not_flatten_for_lookups(test_events):
+    lazy = LazyFlatEvent(test_events[0])
+    assert lazy.get("userIdentity.arn") == "arn:aws:iam::XXXXXXXXXXX:user/xxxxxxxx"
+    assert "additionalEventData.MFAUsed" in lazy
+    assert lazy._flat is None
+    list(lazy)
+    assert lazy._flat is not None
@@ -0,0 +1,38 @@
+import clients
+import main
+from tools.load_test import StandIns, run_size
+
+# ruff: noqa: ANN201, ANN001, E501
+
+MATCH_ALL = ['event.get("eventName", "") != ""']
+
+
+def test_handler_runs_against_the_stand_ins():
+    sns_client, slack_config, rule_store = clients.sns_client, main.slack_config, main.rule_store
+    with StandIns(mode="app", rules=MATCH_ALL, slack_rate=1000) as stand_ins:
+        invocations = 2
+        first = run_size(stand_ins, 5, invocations)
+        second = run_size(stand_ins, 20, 1)
+
+    assert first["events_per_second"] > 0
+    assert first["p99_ms"] >= first["p50_ms"]
+    # the Slack parameters are read once, threads are read and saved once per invocation
+    assert first["calls"]["parameters"] == {"get": 2}
+    assert first["calls"]["slack"] == {"chat.postMessage": 10}
+    assert first["calls"]["dynamodb"] == {"batch_get_item": 2, "batch_write_item": 2}
+    assert sum(first["calls"]["sns"].values()) >= invocations
+    assert second["calls"]["parameters"] == {}
+    assert second["calls"]["slack"] == {"chat.postMessage": 20}
+    # everything is put back
+    assert (clients.sns_client, main.slack_config, main.rule_store) == (sns_client, slack_config, rule_store)
+    assert main.cfg.sns_topic_pattern is None
+
+
+def test_throttled_webhook_messages_are_sent_again():
+    with StandIns(mode="webhook", rules=MATCH_ALL, throttle_every=3, retry_after=0, slack_rate=1000) as stand_ins:
+        result = run_size(stand_ins, 12, 1)
+
+    calls = result["calls"]["slack"]
+    assert calls["429"] > 0
+    assert calls["webhook"] == 12 + calls["429"]
+    assert result["calls"]["dynamodb"] == {}
@@ -0,0 +1,89 @@
+import base64
+import gzip
+import json
+
+import log_stream
+import pytest
+from log_stream import LogBatch, iter_cloudtrail_log_records
+from main import get_cloudtrail_log_records
+
+# ruff: noqa: ANN201, ANN001, E501
+
+@pytest.fixture()
+def events(test_events):
+    return [*test_events, {**test_events[0], "userAgent": "ünïcödé ☃ \U0001F600", "count": 12345678901234567890}]
+
+
+def cloudwatch_logs_event(payload, indent=None) -> dict:
+    text = payload if isinstance(payload, str) else json.dumps(payload, indent=indent, ensure_ascii=False)
+    return {"awslogs": {"data": base64.b64encode(gzip.compress(text.encode())).decode()}}
+
+
+def payload(log_events, **header: object) -> dict:
+    return {
+        "messageType": "DATA_MESSAGE",
+        "owner": "123456789012",
+        "logGroup": "cloudtrail",
+        "logStream": "123456789012_CloudTrail_eu-central-1",
+        "subscriptionFilters": ["cloudtrail"],
+        **header,
+        "logEvents": [{"id": str(i), "timestamp": i, "message": json.dumps(event)} for i, event in enumerate(log_events)],
+    }
+
+
+@pytest.fixture(params=[(8, 3), (64, 7), (65536, 262144)], ids=["tiny", "small", "default"])
+def chunk_sizes(request, monkeypatch):
+    base64_chunk_size, decompress_chunk_size = request.param
+    monkeypatch.setattr(log_stream, "BASE64_CHUNK_SIZE", base64_chunk_size)
+    monkeypatch.setattr(log_stream, "DECOMPRESS_CHUNK_SIZE", decompress_chunk_size)
+
+
+@pytest.mark.parametrize("indent", [None, 4])
+def test_stream_yields_all_records(chunk_sizes, indent, events): # noqa: ARG001
+    records = list(iter_cloudtrail_log_records(cloudwatch_logs_event(payload(events), indent)))
+    assert [record.event for record in records] == events
+    assert {record.batch for record in records} == {LogBatch("cloudtrail", "123456789012")}
+    # the shared values are held once
+    assert len({id(record.batch) for record in records}) == 1
+
+
+def test_header_after_log_events(chunk_sizes, events): # noqa: ARG001
+    body = payload(events)
+    reordered = {"logEvents": body.pop("logEvents"), **body}
+    records = list(iter_cloudtrail_log_records(cloudwatch_logs_event(reordered)))
+    assert [record.event for record in records] == events
+    assert records[0].batch == LogBatch("cloudtrail", "123456789012")
+
+
+def test_list_matches_stream(events):
+    cw_event = cloudwatch_logs_event(payload(events))
+    assert get_cloudtrail_log_records(cw_event) == [
+        {"key": "cloudtrail", "accountId": "123456789012", "event": event} for event in events
+    ]
+
+
+def test_empty_log_events():
+    assert list(iter_cloudtrail_log_records(cloudwatch_logs_event(payload([])))) == []
+
+
+@pytest.mark.parametrize(
+    "malform",
+    [
+        lambda text: text[:-10],
+        lambda text: text + "{}",
+        lambda text: text.replace('"logEvents": [{', '"logEvents": [[{', 1),
+        lambda _: "[]",
+        lambda _: "",
+    ],
+    ids=["truncated", "extra_data", "malformed", "array", "empty"],
+)
+def test_malformed_payloads_raise(chunk_sizes, malform, events): # noqa: ARG001
+    text = malform(json.dumps(payload(events)))
+    with pytest.raises((ValueError, TypeError, KeyError)):
+        list(iter_cloudtrail_log_records(cloudwatch_logs_event(text)))
+
+
+def test_truncated_compressed_data_raises(events):
+    data = gzip.compress(json.dumps(payload(events)).encode())[:-20]
+    with pytest.raises(EOFError):
+        list(iter_cloudtrail_log_records({"awslogs": {"data": base64.b64encode(data).decode()}}))
@@ -0,0 +1,96 @@
+import base64
+import copy
+import gzip
+import json
+
+import pytest
+from flat_event import LazyFlatEvent
+from main import get_cloudtrail_log_records, should_message_be_processed
+from prefilter import could_match, extract_index_fields
+from rule_engine import RuleSet
+from rule_planner import INDEXED_FIELDS
+from rules import default_rules
+
+# ruff: noqa: ANN201, ANN001, E501
+
+def event_variants(event):
+    yield "original", event
+    # read only calls, the bulk of CloudTrail traffic
+    read_event = {key: value for key, value in event.items() if key not in ("errorCode", "errorMessage")}
+    for event_name in ("GetObject", "ListBuckets", "DescribeInstances"):
+        yield event_name, {**read_event, "eventName": event_name}
+    # the same keys nested deeper must not be taken for the top level ones
+    decoy = copy.deepcopy(read_event)
+    decoy["requestParameters"] = {"eventName": "ConsoleLogin", "errorCode": "AccessDenied", "userIdentity": {"type": "Root"}}
+    yield "nested", decoy
+    yield "null-error", {**read_event, "errorCode": None}
+    yield "quoted", {**read_event, "userAgent": 'agent "with" {brackets} [and] "eventName": "x"'}
+
+
+@pytest.mark.parametrize("indent", [None, 4])
+def test_extracted_fields_match_full_parse(test_event, indent):
+    for name, event in event_variants(test_event):
+        message = json.dumps(event, indent=indent)
+        fields = extract_index_fields(message)
+        assert fields is not None, name
+        flat_event = LazyFlatEvent(json.loads(message))
+        assert fields == {field: flat_event.get(field) for field in INDEXED_FIELDS}, name
+
+
+def test_rejected_records_do_not_match_on_full_parse(test_event):
+    rule_set = RuleSet(default_rules)
+    for name, event in event_variants(test_event):
+        message = json.dumps(event)
+        if not could_match(message, rule_set):
+            assert should_message_be_processed(json.loads(message), rule_set, RuleSet([])).should_be_processed is False, name
+
+
+def test_read_only_calls_are_rejected(test_events):
+    rule_set = RuleSet(default_rules)
+    variants = [variant for test_event in test_events for variant in event_variants(test_event)]
+    for name, event in variants:
+        if name.endswith(("GetObject", "ListBuckets", "DescribeInstances")) and event["userIdentity"].get("type") != "Root":
+            assert not could_match(json.dumps(event), rule_set), name
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        json.dumps({"x": "y" * 20000, "eventName": "GetObject"}),  # field after the scan limit
+        json.dumps({"eventName": {"nested": "object"}}),
+        json.dumps({"userIdentity.type": "Root", "eventName": "GetObject"}),
+        json.dumps([{"eventName": "GetObject"}]),
+    ],
+    ids=["scan_limit", "object", "dotted_key", "array"],
+)
+def test_undecidable_records_are_parsed(message):
+    assert extract_index_fields(message) is None
+    assert could_match(message, RuleSet(default_rules))
+
+
+def test_escaped_keys_and_values_are_decoded():
+    message = '{"event\\u004eame": "Get\\u00e9", "errorCode": "Access\\"Denied"}'
+    assert extract_index_fields(message) == {"eventName": "Geté", "errorCode": 'Access"Denied', "eventSource": None, "userIdentity.type": None}
+
+
+def test_unindexed_rules_disable_the_filter():
+    rule_set = RuleSet([*default_rules, 'event.get("awsRegion", "") == "us-east-1"'])
+    assert could_match(json.dumps({"eventName": "GetObject"}), rule_set)
+
+
+def test_get_cloudtrail_log_records_with_filter(test_events):
+    events = [event for test_event in test_events for _, event in event_variants(test_event)]
+    payload = {
+        "owner": "123456789012",
+        "logGroup": "cloudtrail",
+        "logEvents": [{"id": str(i), "message": json.dumps(event)} for i, event in enumerate(events)],
+    }
+    cw_event = {"awslogs": {"data": base64.b64encode(gzip.compress(json.dumps(payload).encode())).decode()}}
+    rule_set = RuleSet(default_rules)
+
+    all_records = get_cloudtrail_log_records(cw_event)
+    filtered_records = get_cloudtrail_log_records(cw_event, rule_set)
+
+    assert len(filtered_records) < len(all_records)
+    matching = [r["event"] for r in all_records if should_message_be_processed(r["event"], rule_set, []).should_be_processed]
+    assert matching == [r["event"] for r in filtered_records if should_message_be_processed(r["event"], rule_set, []).should_be_processed]
@@ -0,0 +1,104 @@
+import copy
+import json
+from typing import NoReturn
+
+import main
+from config import SlackWebhookConfig
+from log_stream import CloudTrailRecord, LogBatch
+from principal_throttle import PrincipalThrottle, principal_of
+from rule_source import RuleStore
+from sns import SnsBatch
+from tools.stubs import FakeDynamoDbClient
+
+# ruff: noqa: ANN201, ANN001, E501
+
+A = ("111111111111", "arn:aws:iam::111111111111:user/a")
+B = ("111111111111", "arn:aws:iam::111111111111:user/b")
+
+
+def throttle(monkeypatch, clock, shared=False, client=None):
+    monkeypatch.setattr(main.cfg, "principal_alert_limit", 3)
+    monkeypatch.setattr(main.cfg, "principal_alert_window_seconds", 60)
+    monkeypatch.setattr(main.cfg, "principal_throttle_shared", shared)
+    monkeypatch.setattr(main.cfg, "dynamodb_table_name", "table")
+    return PrincipalThrottle(main.cfg, client, clock)
+
+
+def test_principal_of():
+    event = {"recipientAccountId": "2", "userIdentity": {"accountId": "1", "arn": "arn", "principalId": "id"}}
+    assert principal_of(event) == ("1", "arn")
+    assert principal_of({"recipientAccountId": "2", "userIdentity": {"principalId": "id"}}) == ("2", "id")
+    assert principal_of({"userIdentity": {"type": "AWSService"}}) is None
+
+
+def test_alerts_over_the_limit_are_suppressed_and_summarized(monkeypatch, clock):
+    clock.now = 1000
+    principal_throttle = throttle(monkeypatch, clock)
+    alerts = [(A, "9", 1)] * 5 + [(B, "9", 1), (None, "9", 1)]
+    assert principal_throttle.admit(alerts) == [True, True, True, False, False, True, True]
+
+    # a token every 20 seconds
+    clock.now += 20
+    assert principal_throttle.admit([(A, "8", 4), (A, "8", 1)]) == [True, False]
+    assert principal_throttle.due_summaries() == []
+
+    clock.now = 1000 + 60
+    [(principal, suppression)] = principal_throttle.due_summaries()
+    assert (principal, suppression.account_id, suppression.since, suppression.count) == (A, "9", 1000, 3)
+    assert principal_throttle.due_summaries() == []
+
+
+def test_shared_counters_hold_across_containers(monkeypatch, clock):
+    client, clock.now = FakeDynamoDbClient(), 1000
+    first, second = throttle(monkeypatch, clock, True, client), throttle(monkeypatch, clock, True, client)
+    assert first.admit([(A, "9", 1), (A, "9", 1), (B, "9", 1)]) == [True, True, True]
+    assert second.admit([(A, "9", 1), (A, "9", 1)]) == [True, False]
+    # one update per principal and invocation
+    assert dict(client.calls) == {"update_item": 3}
+    # the next window starts from zero
+    clock.now = 1020
+    assert second.admit([(A, "9", 1)]) == [True]
+
+
+def test_shared_counters_fall_back_to_the_container(monkeypatch, clock):
+    class BrokenClient:
+        def update_item(self, **_: object) -> NoReturn: # noqa: ANN101
+            raise RuntimeError("throttled")
+
+    principal_throttle = throttle(monkeypatch, clock, True, BrokenClient())
+    assert principal_throttle.admit([(A, "9", 1)] * 4) == [True, True, True, False]
+
+
+def test_handler_posts_other_principals_and_the_summary(monkeypatch, clock, events_by_name):
+    clock.now = 1000
+    monkeypatch.setattr(main, "principal_throttle", throttle(monkeypatch, clock))
+    monkeypatch.setattr(main, "rule_store", RuleStore(['event.get("eventName", "") == "DeleteTrail"'], []))
+    monkeypatch.setattr(main, "slack_config", SlackWebhookConfig("https://hooks.slack.com/x", []))
+    posted = []
+    monkeypatch.setattr(main, "post_message", lambda message, **_: posted.append(message))
+    published = []
+    add = SnsBatch.add
+    monkeypatch.setattr(SnsBatch, "add", lambda self, event, *args: published.append(event["eventID"]) or add(self, event, *args))
+
+    events = []
+    for number in range(6):
+        event = copy.deepcopy(events_by_name["DeleteTrail"])
+        event["eventID"] = f"event-{number}"
+        events.append(event)
+    other = events[-1]
+    other["userIdentity"]["arn"] = "arn:aws:iam::123456789012:user/other"
+    batch = LogBatch("/aws/cloudtrail", "123456789012")
+    monkeypatch.setattr(main, "iter_cloudtrail_log_records", lambda *_: [CloudTrailRecord(event, batch) for event in events])
+    main.lambda_handler({}, None)
+
+    # the limit of the first principal, the other one is not held up
+    alerts = posted[:]
+    assert len(alerts) == main.cfg.principal_alert_limit + 1
+    assert [message for message in alerts if ":mute:" in json.dumps(message)] == []
+    assert sorted(published) == sorted(event["eventID"] for event in events)
+
+    clock.now += 60
+    monkeypatch.setattr(main, "iter_cloudtrail_log_records", lambda *_: [])
+    main.lambda_handler({}, None)
+    [summary] = posted[len(alerts):]
+    assert f"*2 more* alerts of `{events[0]['userIdentity']['arn']}`" in summary["blocks"][0]["text"]["text"]
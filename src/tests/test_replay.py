@@ -0,0 +1,61 @@
+import base64
+import gzip
+import json
+
+import pytest
+from tools import replay
+
+# ruff: noqa: ANN201, ANN001, E501
+
+@pytest.fixture()
+def archive(tmp_path, test_events):
+    quiet_event = {**test_events[0], "eventName": "GetObject", "eventSource": "s3.amazonaws.com", "eventID": "quiet"}
+    directory = tmp_path / "cloudtrail"
+    (directory / "2024" / "05").mkdir(parents=True)
+    # CloudTrail archive from S3
+    with gzip.open(directory / "2024" / "05" / "a.json.gz", "wt") as f:
+        json.dump({"Records": [*test_events[:4], quiet_event]}, f)
+    # CloudWatch Logs export
+    with gzip.open(directory / "2024" / "05" / "b.gz", "wt") as f:
+        f.write("Permission Check Successful\n")
+        for event in test_events[4:]:
+            f.write(f"2024-05-01T00:00:00.000Z {json.dumps(event)}\n")
+    # subscription payload, as the Lambda receives it
+    payload = {"owner": "123456789012", "logGroup": "cloudtrail", "logEvents": [{"id": "1", "timestamp": 0, "message": json.dumps(quiet_event)}]}
+    (directory / "c.json").write_text(json.dumps({"awslogs": {"data": base64.b64encode(gzip.compress(json.dumps(payload).encode())).decode()}}))
+    (directory / "broken.json.gz").write_bytes(b"\x1f\x8bnot gzip")
+    return directory
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_replay_writes_matches_and_hits(archive, tmp_path, processes, test_events):
+    output = tmp_path / "out"
+    rules = [*replay.default_rules, 'event.get("eventName", "") == "GetObject"', "event.get("]
+    summary = replay.replay(str(archive), str(output), rules, ['event.get("eventID", "") == "quiet" and event["awsRegion"] == "nowhere"'], processes=processes)
+
+    assert summary["files"] == 4 # noqa: PLR2004
+    assert summary["events"] == len(test_events) + 2
+    matches = [json.loads(line) for line in (output / "matches.jsonl").read_text().splitlines()]
+    # in file order, files of a directory before its subdirectories
+    assert [match["event"]["eventID"] for match in matches] == ["quiet"] + [event["eventID"] for event in test_events[:4]] + ["quiet"] + [event["eventID"] for event in test_events[4:]]
+    assert [match["file"] for match in matches][:2] == [str(archive / "c.json"), str(archive / "2024" / "05" / "a.json.gz")]
+    assert matches[0]["rule"] == 'event.get("eventName", "") == "GetObject"'
+
+    hits = json.loads((output / "rule_hits.json").read_text())
+    assert hits["matches"] == len(matches)
+    assert hits["rules"][-1] == {"rule": 'event.get("eventName", "") == "GetObject"', "hits": 2}
+    assert sum(rule["hits"] for rule in hits["rules"]) >= len(matches)
+    assert hits["ignore_rules"][0]["hits"] == 0
+
+    errors = [json.loads(line) for line in (output / "errors.jsonl").read_text().splitlines()]
+    # the rule that does not compile and the file that can not be read
+    assert [error.get("rule", error.get("file")) for error in errors] == ["event.get(", str(archive / "broken.json.gz")]
+    assert not (output / "slack_messages.jsonl").exists()
+
+
+def test_dry_run_renders_slack_messages(archive, tmp_path, test_events):
+    output = tmp_path / "out"
+    replay.replay(str(archive), str(output), list(replay.default_rules), [], processes=1, dry_run=True)
+    messages = [json.loads(line) for line in (output / "slack_messages.jsonl").read_text().splitlines()]
+    assert len(messages) == len(test_events)
+    assert all(message["message"]["blocks"] for message in messages)
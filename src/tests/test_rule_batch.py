@@ -0,0 +1,116 @@
+import pytest
+import rule_batch
+from flat_event import LazyFlatEvent
+from main import should_message_be_processed
+from rule_batch import BatchEvaluator, evaluate_batch
+from rule_engine import RuleSet, compile_rule
+from rules import default_rules
+
+# ruff: noqa: ANN201, ANN001, E501
+
+
+@pytest.fixture()
+def events(test_events):
+    return [
+        *test_events,
+        *[{**event, "eventName": name} for event in test_events for name in ("GetObject", "DeleteTrail", "ListBuckets")],
+        *[{key: value for key, value in event.items() if key != "errorCode"} for event in test_events],
+        {"eventName": 7, "errorCode": ["AccessDenied"], "userIdentity": {"type": "Root"}},
+        {"eventName": True, "errorCode": 1, "userIdentity": {"type": 1.0}},
+        {},
+    ]
+
+RULES = [
+    *default_rules,
+    '"eventName" in event and event["eventName"] in ["GetObject", "CreateTrail"]',
+    'event.get("eventName").endswith("Trail")',
+    'event["errorCode"] == "Throttling" or event.get("eventName") == "ListBuckets"',
+    'event.get("awsRegion", "") == event.get("userIdentity.type", "") or not event.get("eventName")',
+    'event.get("eventName") == 1',
+    "not event",
+    '1 == 1 and event.get("eventName", "").startswith("Get")',
+]
+
+IGNORE_RULES = [
+    'event.get("eventName", "") == "ListBuckets" and event["userIdentity.type"] == "Root"',
+    'event.get("userIdentity.type") == 1',
+]
+
+
+def per_event(events, rule_set, ignore_rule_set):
+    rows, errors = [], {}
+    for position, event in enumerate(events):
+        result = should_message_be_processed(event, rule_set, ignore_rule_set)
+        if result.should_be_processed:
+            rows.append(position)
+        if result.errors:
+            errors[position] = result.errors
+    return rows, errors
+
+
+def comparable(errors):
+    return {position: [(type(e["error"]), str(e["error"]), e["rule"]) for e in event_errors] for position, event_errors in errors.items()}
+
+
+@pytest.fixture(params=["columnar", "per_event"])
+def engine(request, monkeypatch):
+    if request.param == "columnar":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(rule_batch, "np", None)
+    return request.param
+
+
+@pytest.mark.parametrize(("rules", "ignore_rules"), [(default_rules, []), (RULES, IGNORE_RULES), (RULES[::-1], IGNORE_RULES[::-1])])
+@pytest.mark.usefixtures("engine")
+def test_batch_gives_the_same_result_as_per_event(rules, ignore_rules, events):
+    rule_set, ignore_rule_set = RuleSet(rules), RuleSet(ignore_rules)
+    expected_rows, expected_errors = per_event(events, rule_set, ignore_rule_set)
+    result = evaluate_batch(events, rule_set, ignore_rule_set)
+    assert result.rows == expected_rows
+    assert comparable(result.errors) == comparable(expected_errors)
+    assert expected_rows and expected_errors
+
+
+@pytest.mark.usefixtures("engine")
+def test_test_events_all_match(test_events):
+    assert evaluate_batch(test_events, default_rules, []).rows == list(range(len(test_events)))
+    assert evaluate_batch(test_events, default_rules, default_rules).rows == []
+    assert evaluate_batch([], default_rules, []).rows == []
+
+
+@pytest.mark.usefixtures("engine")
+def test_rules_outside_the_ast_subset_are_evaluated_per_event(test_events):
+    evaluator = BatchEvaluator([compile_rule('len(event.get("eventName", "")) == 11', "eval")], [])
+    assert evaluator.evaluate(test_events).rows == [
+        position for position, event in enumerate(test_events) if len(event["eventName"]) == 11 # noqa: PLR2004
+    ]
+
+
+def test_single_field_parts_are_evaluated_once_per_value():
+    pytest.importorskip("numpy")
+    calls = []
+    evaluator = BatchEvaluator(['event.get("eventName", "") == "DeleteTrail"'], [])
+    plan = evaluator.plans[0]
+    evaluator.plans[0] = plan._replace(evaluate=lambda event: calls.append(event) or plan.evaluate(event))
+    events = [{"eventName": name} for name in ("DeleteTrail", "GetObject") * 1000]
+    assert len(evaluator.evaluate(events).rows) == 1000 # noqa: PLR2004
+    assert len(calls) == 2 # noqa: PLR2004
+
+
+@pytest.mark.usefixtures("engine")
+def test_hits_are_counted_for_every_rule(events):
+    rule_set, ignore_rule_set = RuleSet(RULES), RuleSet(IGNORE_RULES)
+    result = BatchEvaluator(rule_set, ignore_rule_set).evaluate(events, count_hits=True)
+
+    def is_true(rule, event) -> bool:
+        try:
+            return rule.evaluate(LazyFlatEvent(event)) is True
+        except Exception:
+            return False
+
+    ignored = [any(is_true(rule, event) for rule in ignore_rule_set.rules) for event in events]
+    assert result.ignore_rule_hits == [sum(is_true(rule, event) for event in events) for rule in ignore_rule_set.rules]
+    assert result.rule_hits == [sum(is_true(rule, event) for event, skip in zip(events, ignored, strict=True) if not skip) for rule in rule_set.rules]
+    assert result.rows == evaluate_batch(events, rule_set, ignore_rule_set).rows
+    assert sum(result.rule_hits) > len(result.rows)
@@ -0,0 +1,75 @@
+import pytest
+from flat_event import LazyFlatEvent
+from rule_compiler import UnsupportedRuleError, compile_rule_to_closure
+from rule_engine import RuleSet, compile_rule, compile_rule_for_eval
+from rules import default_rules
+
+# ruff: noqa: ANN201, ANN001, E501
+
+RULES = [
+    *default_rules,
+    '"eventName" in event and event["eventName"] in ["ConsoleLogin", "StopLogging"]',
+    '"eventName" not in event or event["eventName"] in {"A", "B"}',
+    'event.get("eventName") == "ConsoleLogin" or event.get("errorCode")',
+    'event.get("errorCode") and event["errorCode"].startswith("Access")',
+    'event.get("userIdentity.accountId", 0) != 0 != 1',
+    'event["requestParameters.name"] == "x"',
+    'event.get("responseElements.ConsoleLogin").endswith(("Success", "Failure"))',
+    'event.get("eventName").endswith(event.get("eventName")[0])',
+    '"AWSReservedSSO" in event.get("userIdentity.arn", "") or not event',
+    "\t 1 == 1",
+    "None",
+]
+
+
+def outcome(evaluate, event):
+    try:
+        return "value", evaluate(LazyFlatEvent(event))
+    except Exception as e:
+        return type(e), str(e)
+
+
+@pytest.mark.parametrize("rule", RULES)
+def test_closures_behave_like_eval(rule, test_events):
+    by_closure, by_eval = compile_rule_to_closure(rule), compile_rule_for_eval(rule)
+    for event in [*test_events, {}, {"eventName": 7, "errorCode": ["AccessDenied"]}]:
+        assert outcome(by_closure, event) == outcome(by_eval, event), event
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        '__import__("os").system("true")',
+        'event.get("eventName").lower() == "x"',
+        "len(event) > 0",
+        "[key for key in event]",
+        "(lambda: 1)()",
+        "event.__class__",
+        'event.get("a", default="b")',
+        'event.get(*["a"])',
+        "1 + 1",
+        "-1",
+        'event["eventName"][0:3] == "Get"',
+        'event.get("eventName", "") < "B"',
+        'event.get("eventName") is None',
+        "{[1]}",
+    ],
+)
+def test_unsupported_rules_are_rejected_at_load_time(rule):
+    with pytest.raises(UnsupportedRuleError):
+        compile_rule_to_closure(rule)
+
+
+def test_unknown_names_raise_name_error_at_load_time():
+    with pytest.raises(NameError, match="name 'incorrect_rule' is not defined"):
+        compile_rule_to_closure("incorrect_rule")
+    rule_set = RuleSet(["incorrect_rule", "len(event) > 0", default_rules[0]])
+    assert [rule.source for rule in rule_set.rules] == [default_rules[0]]
+    assert [type(error["error"]) for error in rule_set.errors] == [NameError, UnsupportedRuleError]
+
+
+def test_eval_engine_accepts_any_expression():
+    rule = compile_rule("len(event) > 0", "eval")
+    assert rule.evaluate({"eventName": "x"}) is True
+    with pytest.raises(ValueError, match="Unknown rule engine"):
+        compile_rule("1 == 1", "python")
@@ -0,0 +1,91 @@
+import pytest
+from main import ProcessingResult, flatten_json, should_message_be_processed
+from rule_engine import RuleSet, compile_rule, evaluate_rule
+from rule_planner import RuleGuard, plan_rule
+from rules import default_rules
+
+# ruff: noqa: ANN201, ANN001, E501
+
+def linear_scan_matches(event: dict, rule_set: RuleSet) -> list:
+    flat_event = {k: v for k, v in flatten_json(event).items() if v is not None}
+    matches = []
+    for rule in rule_set.rules:
+        try:
+            matches.append(evaluate_rule(rule, flat_event))
+        except Exception:
+            matches.append(None)
+    return matches
+
+
+def test_rule_set_reports_syntax_errors_at_load_time():
+    rule_set = RuleSet(['event.get("eventName", "") == "ConsoleLogin"', "event.get(", " 1 == 1"])
+
+    assert [rule.source for rule in rule_set.rules] == ['event.get("eventName", "") == "ConsoleLogin"', " 1 == 1"]
+    assert len(rule_set.errors) == 1
+    assert rule_set.errors[0]["rule"] == "event.get("
+    assert isinstance(rule_set.errors[0]["error"], SyntaxError)
+
+
+def test_compile_rule_is_cached():
+    assert compile_rule(default_rules[0]) is compile_rule(default_rules[0])
+
+
+def test_rule_sets_give_same_result_as_rule_strings(test_events):
+    rule_set = RuleSet(default_rules)
+    assert rule_set.errors == []
+    for event in test_events:
+        assert should_message_be_processed(event, rule_set, RuleSet([])) == ProcessingResult(True, [])
+        assert should_message_be_processed(event, rule_set, rule_set) == ProcessingResult(False, [])
+
+
+def test_all_default_rules_are_indexed():
+    assert RuleSet(default_rules).index.fully_indexed
+
+
+@pytest.mark.parametrize(
+    ("rule", "guard"),
+    [
+        ('event.get("eventName", "") == "ConsoleLogin" and event.get("x", "") != "Yes"', RuleGuard("eventName", "exact", ("ConsoleLogin",), False)),
+        ('event.get("errorCode", "").startswith(("AccessDenied"))and (event.get("userIdentity.accountId", "") != "ANONYMOUS_PRINCIPAL")', RuleGuard("errorCode", "prefix", ("AccessDenied",), False)),
+        ('event.get("eventSource", "") == "cloudtrail.amazonaws.com" and event.get("eventName", "") == "StopLogging"', RuleGuard("eventName", "exact", ("StopLogging",), False)),
+        ('"eventName" in event and event["eventName"] in ["A", "B"]', RuleGuard("eventName", "exact", ("A", "B"), False)),
+        ('event.get("eventName").endswith("Trail")', RuleGuard("eventName", "suffix", ("Trail",), True)),
+        ('event.get("userIdentity.type", "Root") == "Root"', RuleGuard("userIdentity.type", "exact", ("Root",), True)),
+        # the more selective guard is not reached when the first one raises
+        ('event.get("errorCode").startswith("Access") and event.get("eventName") == "X"', RuleGuard("errorCode", "prefix", ("Access",), True)),
+        # the subscript can raise before the guard is reached
+        ('event["requestParameters.name"] == "x" and event.get("eventName", "") == "A"', None),
+        ('"x" in event.get("userIdentity.arn", "") and event.get("eventName", "") == "A"', None),
+        ('event.get("eventName", "") == "A" or event.get("eventName", "") == "B"', None),
+        ("incorrect_rule", None),
+    ],
+)
+def test_plan_rule(rule, guard):
+    assert plan_rule(rule) == guard
+
+
+def test_index_candidates_match_linear_scan(test_events):
+    rules = [
+        *default_rules,
+        *[f'event.get("eventName", "") == "CustomEvent{i}" and event.get("awsRegion", "") == "us-east-1"' for i in range(50)],
+        'event.get("eventName").endswith("Trail")',
+        '"eventName" in event and event["eventName"] in ["GetObject", "ListBuckets"]',
+        'event["errorCode"] == "Throttling"',
+        'event.get("errorCode").startswith("Access") and event.get("eventName") == "X"',
+    ]
+    rule_set = RuleSet(rules)
+    events = list(test_events)
+    events += [{**event, "eventName": name} for event in events for name in ("GetObject", "CustomEvent7", "CreateTrail", "UpdateFunctionCode")]
+    events += [{key: value for key, value in event.items() if key != "eventName"} for event in events]
+    events += [{"eventName": "ListBuckets", "errorCode": 42}, {"eventName": "Y"}]
+    for event in events:
+        flat_event = {k: v for k, v in flatten_json(event).items() if v is not None}
+        expected = linear_scan_matches(event, rule_set)
+        candidates = {rule.source for rule in rule_set.candidates(flat_event)}
+        for rule, matched in zip(rule_set.rules, expected, strict=True):
+            # every rule that matches or fails has to be a candidate
+            if matched is not False:
+                assert rule.source in candidates, (rule.source, event)
+        # selective rules keep the candidate list short, non string fields fall back to the linear scan
+        if isinstance(event.get("errorCode", ""), str):
+            assert len(candidates) < len(rule_set.rules) / 2
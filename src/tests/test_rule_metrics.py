@@ -0,0 +1,95 @@
+import io
+import json
+from http import HTTPStatus
+
+import main
+from log_stream import CloudTrailRecord, LogBatch
+from rule_engine import RuleSet
+from rule_metrics import DIMENSIONS, NAMESPACE, RuleMetrics
+from rule_source import RuleStore
+
+# ruff: noqa: ANN201, ANN001, E501
+
+RULES = [
+    'event["eventName"] == "DeleteTrail"',
+    'event["missing"].startswith("x")',
+    'event.get("eventSource") == "cloudtrail.amazonaws.com"',
+]
+IGNORE_RULES = ['event.get("userIdentity.type") == "AWSService"']
+
+
+def event(name, identity_type="IAMUser"):
+    return {"eventName": name, "eventSource": "cloudtrail.amazonaws.com", "userIdentity": {"type": identity_type}}
+
+
+def test_evaluations_matches_and_errors_are_counted_per_rule():
+    rules, ignore_rules = RuleSet(RULES), RuleSet(IGNORE_RULES)
+    metrics = RuleMetrics(rules, ignore_rules)
+
+    assert main.should_message_be_processed(event("DeleteTrail"), rules, ignore_rules, metrics).should_be_processed
+    assert main.should_message_be_processed(event("StopLogging"), rules, ignore_rules, metrics).should_be_processed
+    assert not main.should_message_be_processed(event("StopLogging", "AWSService"), rules, ignore_rules, metrics).should_be_processed
+
+    # the ignore rule is only evaluated for events the rule index can not rule out
+    assert metrics.ignore_rules.evaluations == [1]
+    assert metrics.ignore_rules.matches == [1]
+    # evaluation stops at the first rule that matches
+    assert metrics.rules.evaluations == [2, 1, 1]
+    assert metrics.rules.matches == [1, 0, 1]
+    assert metrics.rules.errors == [0, 1, 0]
+    assert all(nanoseconds > 0 for nanoseconds in metrics.rules.nanoseconds)
+
+
+def test_documents_are_written_for_evaluated_rules_only():
+    rules, ignore_rules = RuleSet(RULES), RuleSet(IGNORE_RULES)
+    metrics = RuleMetrics(rules, ignore_rules)
+    main.should_message_be_processed(event("DeleteTrail", "AWSService"), rules, ignore_rules, metrics)
+    main.should_message_be_processed(event("DeleteTrail"), rules, ignore_rules, metrics)
+
+    documents = metrics.documents("cloudtrail-to-slack", timestamp_ms=1700000000000)
+    assert [(document["RuleType"], document["RuleIndex"]) for document in documents] == [("rule", "0"), ("ignore_rule", "0")]
+    rule = documents[0]
+    assert rule["_aws"] == {
+        "Timestamp": 1700000000000,
+        "CloudWatchMetrics": [{"Namespace": NAMESPACE, "Dimensions": [DIMENSIONS], "Metrics": rule["_aws"]["CloudWatchMetrics"][0]["Metrics"]}],
+    }
+    assert {metric["Name"] for metric in rule["_aws"]["CloudWatchMetrics"][0]["Metrics"]} == {"Evaluations", "Matches", "Errors", "EvaluationTime"}
+    assert rule["FunctionName"] == "cloudtrail-to-slack"
+    assert (rule["Evaluations"], rule["Matches"], rule["Errors"]) == (1, 1, 0)
+    assert rule["Rule"] == RULES[0]
+
+
+def test_emit_writes_one_json_line_per_document(monkeypatch):
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "fn")
+    rules, ignore_rules = RuleSet(RULES), RuleSet([])
+    metrics = RuleMetrics(rules, ignore_rules)
+    stream = io.StringIO()
+    metrics.emit(stream)
+    assert not stream.getvalue()
+
+    main.should_message_be_processed(event("StopLogging"), rules, ignore_rules, metrics)
+    metrics.emit(stream)
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["RuleIndex"] for line in lines] == ["0", "1", "2"]
+    assert {line["FunctionName"] for line in lines} == {"fn"}
+
+
+def test_handler_emits_metrics_when_enabled(monkeypatch, capsys):
+    monkeypatch.setattr(main.cfg, "rule_metrics", True)
+    monkeypatch.setattr(main, "rule_store", RuleStore(RULES, IGNORE_RULES))
+    batch = LogBatch("/aws/cloudtrail", "123456789012")
+    records = [CloudTrailRecord(event("StopLogging", "AWSService"), batch), CloudTrailRecord(event("StopLogging", "AWSService"), batch)]
+    monkeypatch.setattr(main, "iter_cloudtrail_log_records", lambda *_: records)
+
+    assert main.lambda_handler({}, None) == HTTPStatus.OK
+    documents = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert [(document["RuleType"], document["Evaluations"], document["Matches"]) for document in documents] == [("ignore_rule", 2, 2)]
+
+
+def test_handler_does_not_emit_metrics_by_default(monkeypatch, capsys):
+    monkeypatch.setattr(main, "rule_store", RuleStore(RULES, IGNORE_RULES))
+    batch = LogBatch("/aws/cloudtrail", "123456789012")
+    monkeypatch.setattr(main, "iter_cloudtrail_log_records", lambda *_: [CloudTrailRecord(event("StopLogging", "AWSService"), batch)])
+
+    main.lambda_handler({}, None)
+    assert '"_aws"' not in capsys.readouterr().out
@@ -0,0 +1,112 @@
+import json
+import os
+
+import main
+import pytest
+import rule_engine
+from config import SlackWebhookConfig
+from rule_source import RuleStore, file_fetcher, ssm_parameter_fetcher
+from tools.stubs import ParametersExtensionStub
+
+# ruff: noqa: ANN201, ANN001, E501
+
+BASE_RULES = ['event["eventName"] == "StopLogging"']
+
+
+def rules_document(*rules: str, ignore_rules=()):
+    return json.dumps({"rules": list(rules), "ignore_rules": list(ignore_rules)})
+
+
+def sources(rule_set):
+    return [rule.source for rule in rule_set.rules]
+
+
+def test_rules_from_file_are_reloaded_after_ttl(tmp_path, clock):
+    path = tmp_path / "rules.json"
+    path.write_text(rules_document('event["eventName"] == "DeleteTrail"'))
+    store = RuleStore(BASE_RULES, [], file_fetcher(str(path)), ttl=60, clock=clock)
+    first = store.current()
+    assert sources(first.rule_set) == BASE_RULES + ['event["eventName"] == "DeleteTrail"']
+
+    path.write_text(rules_document('event["eventName"] == "UpdateTrail"', ignore_rules=['event["eventName"] == "X"']))
+    clock.now = 30
+    assert store.current() is first
+
+    clock.now = 60
+    second = store.current()
+    assert sources(second.rule_set) == BASE_RULES + ['event["eventName"] == "UpdateTrail"']
+    assert sources(second.ignore_rule_set) == ['event["eventName"] == "X"']
+    assert second.digest != first.digest
+
+
+def test_compiled_rules_are_reused(tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    content = rules_document('event["eventName"] == "DeleteTrail"')
+    path.write_text(content)
+    store = RuleStore(BASE_RULES, [], file_fetcher(str(path)), ttl=0)
+    first = store.current()
+    # the base rules are taken from the compile cache
+    assert first.rule_set.rules[0] is rule_engine.compile_rule(BASE_RULES[0])
+
+    # a file written again with the same content is read, but not compiled again
+    path.write_text(content)
+    os.utime(path, ns=(0, 0))
+    monkeypatch.setattr("rule_source.RuleSet", lambda *_: pytest.fail("compiled again"))
+    second = store.refresh()
+    assert second.version != first.version
+    assert second.rule_set is first.rule_set
+
+
+def test_rules_from_ssm_parameter(monkeypatch):
+    with ParametersExtensionStub({"rules": rules_document('event["eventName"] == "DeleteTrail"')}) as extension:
+        monkeypatch.setenv("PARAMETERS_SECRETS_EXTENSION_HTTP_PORT", str(extension.port))
+        monkeypatch.setenv("AWS_SESSION_TOKEN", "session")
+        store = RuleStore(BASE_RULES, [], ssm_parameter_fetcher("rules"), ttl=0)
+        first = store.current()
+        assert first.version == 1
+        assert store.refresh() is first
+
+        extension.put("rules", rules_document('event["eventName"] == "UpdateTrail"'))
+        second = store.refresh()
+        assert second.version == first.version + 1
+        assert sources(second.rule_set)[-1] == 'event["eventName"] == "UpdateTrail"'
+
+
+def test_failed_reload_keeps_the_rules(tmp_path, clock):
+    path = tmp_path / "rules.json"
+    path.write_text(rules_document('event["eventName"] == "DeleteTrail"'))
+    store = RuleStore(BASE_RULES, [], file_fetcher(str(path)), ttl=60, clock=clock)
+    first = store.current()
+    path.write_text('{"rules": "not a list"}')
+    clock.now = 60
+    assert store.current() is first
+    path.unlink()
+    clock.now = 120
+    assert store.current() is first
+
+
+def test_first_load_errors_are_raised(tmp_path):
+    store = RuleStore(BASE_RULES, [], file_fetcher(str(tmp_path / "missing.json")))
+    with pytest.raises(FileNotFoundError):
+        store.current()
+
+
+def test_handler_uses_the_rules_of_the_store(tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    path.write_text(rules_document('event["eventName"] == "DeleteTrail"', "event[", ignore_rules=['event["eventName"] == "StopLogging"']))
+    monkeypatch.setattr(main, "rule_store", RuleStore([], [], file_fetcher(str(path))))
+    monkeypatch.setattr(main, "rule_compilation_errors_reported", set())
+    monkeypatch.setattr(main, "slack_config", SlackWebhookConfig("https://hooks.slack.com/x", []))
+    reported = []
+    monkeypatch.setattr(main, "post_message", lambda message, **_: reported.append(message))
+    deliveries = []
+    monkeypatch.setattr(main, "handle_event", lambda **kwargs: deliveries.append(kwargs))
+    monkeypatch.setattr(main, "iter_cloudtrail_log_records", lambda *_: [])
+
+    main.lambda_handler({}, None)
+    main.lambda_handler({}, None)
+    # the broken rule of this version is reported once
+    assert len(reported) == 1
+    rules = main.rule_store.current()
+    assert sources(rules.rule_set) == ['event["eventName"] == "DeleteTrail"']
+    assert sources(rules.ignore_rule_set) == ['event["eventName"] == "StopLogging"']
@@ -0,0 +1,117 @@
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import pytest
+import urllib3
+from config import SlackAppConfig, SlackConfigCache, fetch_slack_parameters, get_slack_config
+from tools.stubs import ParametersExtensionStub
+
+# ruff: noqa: ANN201, ANN001, E501
+
+CONFIGURATION = [{"accounts": ["111111111111"], "slack_channel_id": "C111"}]
+
+
+@pytest.fixture()
+def extension(monkeypatch):
+    stub = ParametersExtensionStub({"slack-config": json.dumps(CONFIGURATION), "bot-token": "xoxb-1"})
+    with stub:
+        monkeypatch.setenv("PARAMETERS_SECRETS_EXTENSION_HTTP_PORT", str(stub.port))
+        monkeypatch.setenv("AWS_SESSION_TOKEN", "session")
+        monkeypatch.setenv("CONFIG_SSM_PARAMETER_NAME", "slack-config")
+        monkeypatch.setenv("SLACK_BOT_TOKEN_SSM_PARAMETER_NAME", "bot-token")
+        monkeypatch.setenv("DEFAULT_SLACK_CHANNEL_ID", "CDEFAULT")
+        yield stub
+
+
+def fetches(extension):
+    return Counter(name for _, name, _ in extension.requests)
+
+
+def test_parameters_are_fetched_concurrently(extension):
+    extension.hold()
+    with ThreadPoolExecutor(1) as executor:
+        fetched = executor.submit(fetch_slack_parameters)
+        # both requests wait in the extension at the same time
+        assert extension.wait_for_in_flight(2)
+        extension.release()
+        configuration, bot_token = fetched.result()
+    assert (configuration["Value"], bot_token["Value"]) == (json.dumps(CONFIGURATION), "xoxb-1")
+    assert fetches(extension) == {"slack-config": 1, "bot-token": 1}
+
+    slack_config = get_slack_config()
+    assert slack_config == SlackAppConfig("xoxb-1", "CDEFAULT", CONFIGURATION)
+    assert slack_config.channel_id_for_account("111111111111") == "C111"
+
+
+def test_cache_refreshes_in_the_background(extension, clock):
+    cache = SlackConfigCache(ttl=60, clock=clock)
+    first = cache.get()
+    assert first.channel_id_for_account("111111111111") == "C111"
+
+    clock.now = 30
+    assert cache.get() is first
+    assert fetches(extension) == {"slack-config": 1, "bot-token": 1}
+
+    # an unchanged version keeps the configuration and its routing table
+    clock.now = 61
+    extension.hold()
+    assert cache.get() is first
+    # the hot path returned while the refresh still waits for the extension
+    assert extension.wait_for_in_flight(1)
+    extension.release()
+    cache.wait_for_refresh()
+    assert fetches(extension) == {"slack-config": 2, "bot-token": 2}
+    assert cache.get() is first
+
+    extension.put("slack-config", json.dumps([{"accounts": ["111111111111"], "slack_channel_id": "C222"}]))
+    clock.now = 122
+    assert cache.get() is first
+    cache.wait_for_refresh()
+    second = cache.get()
+    assert second is not first
+    assert second.channel_id_for_account("111111111111") == "C222"
+
+
+def test_failed_refresh_keeps_the_configuration(extension, clock):
+    cache = SlackConfigCache(ttl=60, clock=clock)
+    first = cache.get()
+    del extension.parameters["bot-token"]
+    clock.now = 61
+    cache.get()
+    cache.wait_for_refresh()
+    assert cache.get() is first
+    # the next attempt is made after ttl
+    assert fetches(extension) == {"slack-config": 2, "bot-token": 2}
+    clock.now = 100
+    cache.get()
+    cache.wait_for_refresh()
+    assert fetches(extension) == {"slack-config": 2, "bot-token": 2}
+
+
+def test_hanging_refresh_times_out(extension, clock, monkeypatch):
+    monkeypatch.setattr(config, "EXTENSION_TIMEOUT", urllib3.Timeout(connect=1.0, read=0.1))
+    cache = SlackConfigCache(ttl=60, clock=clock)
+    first = cache.get()
+    extension.hold()
+    clock.now = 61
+    cache.get()
+    cache.wait_for_refresh(timeout=2)
+    # the timed out refresh is finished, the next one starts after ttl
+    assert cache._refreshing is None
+    assert cache.get() is first
+    extension.release()
+    extension.put("slack-config", json.dumps([{"accounts": ["111111111111"], "slack_channel_id": "C222"}]))
+    clock.now = 122
+    cache.get()
+    cache.wait_for_refresh()
+    assert cache.get().channel_id_for_account("111111111111") == "C222"
+
+
+def test_zero_ttl_reads_once(extension, clock):
+    cache = SlackConfigCache(ttl=0, clock=clock)
+    first = cache.get()
+    clock.now = 10_000
+    assert cache.get() is first
+    assert fetches(extension) == {"slack-config": 1, "bot-token": 1}
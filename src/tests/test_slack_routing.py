@@ -0,0 +1,33 @@
+import random
+
+import pytest
+from config import SlackAppConfig, SlackWebhookConfig
+
+# ruff: noqa: ANN201, ANN001, E501
+
+
+def linear_search(configuration, account_id, key, default):
+    if account_id and configuration:
+        return next((cfg[key] for cfg in configuration if account_id in cfg["accounts"]), default)
+    return default
+
+
+def random_configuration(rng, key):
+    accounts = [f"{i:012d}" for i in range(300)]
+    # accounts can be listed more than once, the first entry wins
+    return [{"accounts": rng.sample(accounts, 20), key: f"{key}-{i}"} for i in range(40)]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_routes_match_linear_search(seed):
+    rng = random.Random(seed)
+    app = SlackAppConfig("token", "default-channel", random_configuration(rng, "slack_channel_id"))
+    webhook = SlackWebhookConfig("https://hooks.slack.com/default", random_configuration(rng, "slack_hook_url"))
+    for account_id in [None, "", "unknown", *[f"{i:012d}" for i in range(300)]]:
+        assert app.channel_id_for_account(account_id) == linear_search(app.configuration, account_id, "slack_channel_id", "default-channel")
+        assert webhook.hook_url_for_account(account_id) == linear_search(webhook.configuration, account_id, "slack_hook_url", "https://hooks.slack.com/default")
+
+
+def test_empty_configuration_uses_defaults():
+    assert SlackAppConfig("token", "default-channel", []).channel_id_for_account("111111111111") == "default-channel"
+    assert SlackWebhookConfig(None, None).hook_url_for_account("111111111111") is None
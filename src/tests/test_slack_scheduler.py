@@ -0,0 +1,79 @@
+from http import HTTPStatus
+
+import pytest
+import urllib3
+from slack_scheduler import OutboundScheduler
+
+# ruff: noqa: ANN201, ANN001, E501
+
+
+@pytest.fixture()
+def clock(clock):
+    clock.now = 1000.0
+    return clock
+
+
+def response(status, headers=None):
+    return urllib3.HTTPResponse(body=b"{}", status=status, headers=headers or {})
+
+
+def scheduler(clock, **kwargs: int):
+    return OutboundScheduler(rate=1.0, burst=2, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_each_destination_is_limited_on_its_own(clock):
+    s = scheduler(clock)
+    sent = []
+    for destination in ["a", "a", "b", "a", "b", "a"]:
+        s.send(destination, lambda destination=destination: sent.append((destination, clock.now)) or response(HTTPStatus.OK))
+    # two messages as a burst, one per second after that, b is not held up by a
+    assert sent == [("a", 1000.0), ("a", 1000.0), ("b", 1000.0), ("a", 1001.0), ("b", 1001.0), ("a", 1002.0)]
+
+
+def test_retry_after_is_honored(clock):
+    s = scheduler(clock)
+    responses = [response(HTTPStatus.TOO_MANY_REQUESTS, {"Retry-After": "7"}), response(HTTPStatus.OK)]
+    sent = []
+    result = s.send("a", lambda: sent.append(clock.now) or responses.pop(0))
+    assert result.status == HTTPStatus.OK
+    assert sent == [1000.0, 1007.0]
+
+
+def test_rate_limits_without_retry_after_are_retried_with_backoff_until_attempts_run_out(clock):
+    max_attempts = 3
+    s = scheduler(clock, max_attempts=max_attempts)
+    sent = []
+    result = s.send("a", lambda: sent.append(clock.now) or response(HTTPStatus.TOO_MANY_REQUESTS))
+    assert result.status == HTTPStatus.TOO_MANY_REQUESTS
+    assert len(sent) == max_attempts
+    assert sent == sorted(sent)
+
+
+def test_server_errors_are_only_retried_when_unavailable_with_retry_after(clock):
+    s = scheduler(clock)
+    sent = []
+    # Slack may have posted the message before it failed
+    assert s.send("a", lambda: sent.append(clock.now) or response(HTTPStatus.INTERNAL_SERVER_ERROR)).status == HTTPStatus.INTERNAL_SERVER_ERROR
+    assert s.send("b", lambda: sent.append(clock.now) or response(HTTPStatus.SERVICE_UNAVAILABLE)).status == HTTPStatus.SERVICE_UNAVAILABLE
+    assert sent == [1000.0, 1000.0]
+
+    responses = [response(HTTPStatus.SERVICE_UNAVAILABLE, {"Retry-After": "3"}), response(HTTPStatus.OK)]
+    assert s.send("c", lambda: sent.append(clock.now) or responses.pop(0)).status == HTTPStatus.OK
+    assert sent[2:] == [1000.0, 1003.0]
+
+
+def test_client_errors_are_not_retried(clock):
+    s = scheduler(clock)
+    sent = []
+    assert s.send("a", lambda: sent.append(clock.now) or response(HTTPStatus.NOT_FOUND)).status == HTTPStatus.NOT_FOUND
+    assert sent == [1000.0]
+
+
+def test_messages_after_the_deadline_are_dropped(clock):
+    s = scheduler(clock)
+    s.set_deadline(5.0) # 2 seconds of it are kept for the rest of the invocation
+    sent = []
+    results = [s.send("a", lambda: sent.append(clock.now) or response(HTTPStatus.OK)) for _ in range(6)]
+    assert sent == [1000.0, 1000.0, 1001.0, 1002.0, 1003.0]
+    assert results[-1] is None
+    assert s.send("a", lambda: response(HTTPStatus.TOO_MANY_REQUESTS, {"Retry-After": "60"})) is None
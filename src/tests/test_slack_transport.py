@@ -0,0 +1,82 @@
+import json
+
+import pytest
+import slack_transport
+import urllib3
+from slack_scheduler import OutboundScheduler
+from slack_sdk.errors import SlackApiError
+from slack_transport import post_to_webhook, slack_api_client, slack_transport as transport_for_host
+from urllib3.exceptions import ProtocolError
+
+# ruff: noqa: ANN201, ANN001, E501
+
+
+class FakePool:
+    def __init__(self, responses: list) -> None: # noqa: ANN101
+        self.responses = list(responses)
+        self.requests = []
+
+    def urlopen(self, method: str, path: str, body: bytes, headers: dict) -> urllib3.HTTPResponse: # noqa: ANN101
+        self.requests.append((method, path, body, headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def response(status, data):
+    return urllib3.HTTPResponse(body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json"}, preload_content=True)
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch):
+    monkeypatch.setattr(slack_transport, "scheduler", OutboundScheduler(sleep=lambda _: None))
+
+
+@pytest.fixture()
+def fake_pool(monkeypatch):
+    def install(host, *responses: urllib3.HTTPResponse | Exception) -> FakePool:
+        pool = FakePool(responses)
+        monkeypatch.setattr(transport_for_host(host), "pool", pool)
+        return pool
+    return install
+
+
+def test_transports_are_cached_per_host_and_token():
+    assert transport_for_host("hooks.slack.com") is transport_for_host("hooks.slack.com")
+    assert slack_api_client("token-a") is slack_api_client("token-a")
+    assert slack_api_client("token-a") is not slack_api_client("token-b")
+    assert slack_api_client("token-a").transport is slack_api_client("token-b").transport
+    # urllib3 only retries connecting, never a request that was sent
+    retries = transport_for_host("hooks.slack.com").pool.retries
+    assert (retries.connect, retries.read, retries.status) == (2, 0, 0)
+
+
+def test_api_call_returns_slack_response(fake_pool):
+    pool = fake_pool(slack_transport.SLACK_API_HOST, response(200, {"ok": True, "ts": "123.456"}))
+    result = slack_api_client("token").api_call("chat.postMessage", {"channel": "C1", "blocks": [], "thread_ts": None})
+    assert result.get("ts") == "123.456"
+    method, path, body, headers = pool.requests[0]
+    assert (method, path) == ("POST", "/api/chat.postMessage")
+    assert json.loads(body) == {"channel": "C1", "blocks": []}
+    assert headers["Authorization"] == "Bearer token"
+
+
+def test_api_errors_raise(fake_pool):
+    fake_pool(slack_transport.SLACK_API_HOST, response(200, {"ok": False, "error": "channel_not_found"}))
+    with pytest.raises(SlackApiError):
+        slack_api_client("token").api_call("chat.postMessage", {"channel": "C1"})
+
+
+def test_broken_connection_is_not_sent_again(fake_pool):
+    # the request may have arrived before the connection broke
+    pool = fake_pool("hooks.slack.com", ProtocolError("Connection aborted."), response(200, "ok"))
+    with pytest.raises(ProtocolError):
+        post_to_webhook("https://hooks.slack.com/services/A/B/C", b"{}")
+    assert len(pool.requests) == 1
+
+
+def test_rate_limited_messages_are_sent_again(fake_pool):
+    pool = fake_pool(slack_transport.SLACK_API_HOST, response(429, {"ok": False, "error": "ratelimited"}), response(200, {"ok": True, "ts": "1.2"}))
+    assert slack_api_client("token").api_call("chat.postMessage", {"channel": "C1"}).get("ts") == "1.2"
+    assert [path for _, path, _, _ in pool.requests] == ["/api/chat.postMessage"] * 2
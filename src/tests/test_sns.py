@@ -0,0 +1,103 @@
+import json
+from typing import Iterable
+
+import main
+import pytest
+import sns
+from sns import SnsBatch, send_message_to_sns
+
+# ruff: noqa: ANN201, ANN001, E501
+
+PATTERN = "arn:aws:sns:eu-central-1:ACCOUNT_ID:cloudtrail-notifications"
+
+
+class FakeSNS:
+    def __init__(self, failing_messages: Iterable[str] = (), batch_error: Exception | None = None, publish_errors: dict | None = None) -> None: # noqa: ANN101
+        self.failing_messages = set(failing_messages)
+        self.batch_error = batch_error
+        self.publish_errors = dict(publish_errors or {})
+        self.batches = []
+        self.published = []
+
+    def publish_batch(self, TopicArn: str, PublishBatchRequestEntries: list) -> dict: # noqa: ANN101
+        assert len(PublishBatchRequestEntries) <= sns.PUBLISH_BATCH_SIZE
+        self.batches.append((TopicArn, [json.loads(entry["Message"])["eventID"] for entry in PublishBatchRequestEntries]))
+        if self.batch_error:
+            raise self.batch_error
+        failed = [entry for entry in PublishBatchRequestEntries if json.loads(entry["Message"])["eventID"] in self.failing_messages]
+        return {
+            "Successful": [{"Id": entry["Id"]} for entry in PublishBatchRequestEntries if entry not in failed],
+            "Failed": [{"Id": entry["Id"], "Code": "InternalError", "SenderFault": False} for entry in failed],
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+        }
+
+    def publish(self, TargetArn: str, Message: str, MessageAttributes: dict) -> dict: # noqa: ANN101, ARG002
+        event_id = json.loads(Message)["eventID"]
+        self.published.append((TargetArn, event_id))
+        if event_id in self.publish_errors:
+            raise self.publish_errors[event_id]
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+@pytest.fixture()
+def cfg(monkeypatch):
+    monkeypatch.setattr(main.cfg, "sns_topic_pattern", PATTERN)
+    return main.cfg
+
+
+def event(i, account_id="111111111111"):
+    return {"eventID": f"e{i}", "eventName": "StopLogging", "recipientAccountId": account_id}
+
+
+def test_messages_are_grouped_by_topic_in_batches_of_ten(cfg):
+    client = FakeSNS()
+    batch = SnsBatch(cfg, client)
+    for i in range(23):
+        account_id = "111111111111" if i % 2 else "222222222222"
+        batch.add(event(i, account_id), "log-group", account_id)
+    assert batch.flush() == [200] * 23
+    assert [(topic.split(":")[4], len(ids)) for topic, ids in client.batches] == [("222222222222", 10), ("222222222222", 2), ("111111111111", 10)]
+    # a single message is published without a batch
+    assert [(topic.split(":")[4], event_id) for topic, event_id in client.published] == [("111111111111", "e21")]
+    assert sorted([i for _, ids in client.batches for i in ids] + [i for _, i in client.published]) == sorted(f"e{i}" for i in range(23))
+    assert batch.flush() == []
+
+
+def test_failed_entries_are_sent_again_one_by_one(cfg):
+    client = FakeSNS(failing_messages={"e1", "e2"}, publish_errors={"e2": Exception("InternalError")})
+    batch = SnsBatch(cfg, client)
+    for i in range(4):
+        batch.add(event(i), "log-group", "111111111111")
+    assert batch.flush() == [200, 200, 500, 200]
+    assert [event_id for _, event_id in client.published] == ["e1", "e2"]
+
+
+@pytest.mark.parametrize(("error", "statuses"), [(Exception("NotFound: Topic does not exist"), [200, 200]), (Exception("Throttling"), [200, 200])])
+def test_failed_requests(cfg, error, statuses):
+    client = FakeSNS(batch_error=error)
+    batch = SnsBatch(cfg, client)
+    batch.add(event(0), "log-group", "111111111111")
+    batch.add(event(1), "log-group", "111111111111")
+    assert batch.flush() == statuses
+    # only a request that may succeed on its own is sent again
+    assert len(client.published) == (0 if "NotFound" in str(error) else 2)
+
+
+def test_large_messages_are_split_by_size(cfg):
+    client = FakeSNS()
+    batch = SnsBatch(cfg, client)
+    for i in range(5):
+        batch.add({**event(i), "requestParameters": {"policy": "x" * 100_000}}, "log-group", "111111111111")
+    assert batch.flush() == [200] * 5
+    assert [len(ids) for _, ids in client.batches] == [2, 2]
+    assert [event_id for _, event_id in client.published] == ["e4"]
+
+
+def test_without_pattern_nothing_is_sent(cfg, monkeypatch):
+    monkeypatch.setattr(cfg, "sns_topic_pattern", None)
+    client = FakeSNS()
+    batch = SnsBatch(cfg, client)
+    batch.add(event(0), "log-group", "111111111111")
+    assert batch.flush() == [None]
+    assert send_message_to_sns(event(0), "log-group", "111111111111", cfg, client) is None
+    assert client.batches == client.published == []
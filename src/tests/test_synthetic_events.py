@@ -0,0 +1,38 @@
+import main
+from log_stream import iter_cloudtrail_log_records
+from rule_engine import RuleSet
+from rules import default_rules
+from tools.synthetic_events import generate_events, subscription_payloads, synthetic_rules
+
+# ruff: noqa: ANN201, ANN001, E501
+
+
+def test_same_seed_gives_same_events():
+    assert generate_events(500, seed=3) == generate_events(500, seed=3)
+    assert generate_events(500, seed=3) != generate_events(500, seed=4)
+
+
+def test_event_mix():
+    count = 5000
+    events = generate_events(count, seed=1)
+    assert len(events) == count
+    assert sum(not event["readOnly"] for event in events) > count // 10
+    assert sum("errorCode" in event for event in events) > count // 50
+    assert any("policyDocument" in (event["requestParameters"] or {}) for event in events)
+    rules = RuleSet(default_rules)
+    matches = sum(main.should_message_be_processed(event, rules, RuleSet([])).should_be_processed for event in events)
+    assert 0 < matches < len(events) // 5
+
+
+def test_payloads_decode_to_the_events():
+    events = generate_events(250, seed=2)
+    payloads = list(subscription_payloads(events, events_per_payload=100))
+    assert [len(list(iter_cloudtrail_log_records(payload))) for payload in payloads] == [100, 100, 50]
+    assert [record.event for payload in payloads for record in iter_cloudtrail_log_records(payload)] == events
+
+
+def test_synthetic_rules_compile():
+    expressions = synthetic_rules(100)
+    rules = RuleSet(expressions)
+    assert len(rules.rules) == len(expressions)
+    assert rules.errors == []
@@ -0,0 +1,74 @@
+import logging
+from typing import Iterator
+
+import main
+import tracing
+from config import SlackWebhookConfig
+from log_stream import CloudTrailRecord, LogBatch
+from rule_source import RuleStore
+from tracing import CollectingTracer, percentile
+
+# ruff: noqa: ANN201, ANN001, E501
+
+
+def test_summary_has_percentiles_per_stage_in_pipeline_order(clock):
+    tracer = CollectingTracer(clock)
+    for milliseconds in range(1, 101):
+        with tracer.span("slack_post"):
+            clock.now += milliseconds / 1000
+    with tracer.span("rules"):
+        clock.now += 0.002
+
+    summary = tracer.summary()
+    assert list(summary) == ["rules", "slack_post"]
+    assert summary["slack_post"] == {"count": 100, "total_ms": 5050.0, "p50_ms": 50.0, "p99_ms": 99.0}
+    assert summary["rules"] == {"count": 1, "total_ms": 2.0, "p50_ms": 2.0, "p99_ms": 2.0}
+
+
+def test_percentile():
+    assert [percentile([], 50), percentile([3.0], 99)] == [0.0, 3.0]
+    assert [percentile([1.0, 2.0, 3.0, 4.0], p) for p in (50, 99)] == [2.0, 4.0]
+
+
+def test_spans_are_no_ops_by_default():
+    assert tracing.span("rules") is tracing.NOOP_TRACER.span("decode")
+    with tracing.span("rules"):
+        pass
+
+
+def test_timed_records_one_span_per_item(clock):
+    tracer = CollectingTracer(clock)
+
+    def records() -> Iterator[int]:
+        for record in range(3):
+            clock.now += 0.001
+            yield record
+
+    with tracing.use(tracer):
+        decoded = list(tracing.timed("decode", records()))
+    assert decoded == [0, 1, 2]
+    assert tracer.summary()["decode"]["count"] == len(decoded)
+    assert tracing.span("decode") is tracing.NOOP_TRACER.span("decode")
+
+
+def test_handler_logs_stage_timings(monkeypatch, caplog, test_events):
+    monkeypatch.setattr(main.cfg, "stage_timings", True)
+    monkeypatch.setattr(main, "rule_store", RuleStore(['event["eventName"] == "DeleteTrail"'], []))
+    monkeypatch.setattr(main, "slack_config", SlackWebhookConfig("https://hooks.slack.com/x", []))
+    posted = []
+    monkeypatch.setattr(main, "post_message", lambda message, **_: posted.append(message) or 200)
+    batch = LogBatch("/aws/cloudtrail", "123456789012")
+    events = [event for event in test_events if event["eventName"] in ("DeleteTrail", "StopLogging")]
+    monkeypatch.setattr(main, "iter_cloudtrail_log_records", lambda *_: [CloudTrailRecord(event, batch) for event in events])
+
+    with caplog.at_level(logging.INFO):
+        main.lambda_handler({}, None)
+
+    assert len(posted) == 1
+    timings = [record.msg["Stage timings"] for record in caplog.records if isinstance(record.msg, dict) and "Stage timings" in record.msg]
+    assert len(timings) == 1
+    counts = {stage: values["count"] for stage, values in timings[0].items()}
+    assert counts["decode"] == counts["rules"] == len(events)
+    assert counts["slack_message"] == counts["slack_post"] == 1
+    assert set(timings[0]["rules"]) == {"count", "total_ms", "p50_ms", "p99_ms"}
+    assert tracing.span("rules") is tracing.NOOP_TRACER.span("rules")
@@ -0,0 +1,71 @@
+"""
+Compares the rule engines on the default rules and the test events:
+
+- compile_us: compiling all rules once
+- evaluate_ns: one evaluation of one rule on one flat event, all rules on all events
+
+Rules are evaluated directly, without the index, so every rule runs on every event.
+Prints one JSON line per engine.
+
+    cd src && python tools/benchmark_rules.py --repeat 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+
+from flat_event import LazyFlatEvent # noqa: E402
+from rule_engine import RULE_ENGINES, compile_rule, evaluate_rule # noqa: E402
+from rules import default_rules # noqa: E402
+
+
+def flat_events() -> list:
+    with open(os.path.join(SRC, "tests", "test_events.json")) as f:
+        events = [test_event["event"] for test_event in json.load(f)["test_events"]]
+    # resolved once, so the lookups of the lazy view are not part of the measurement
+    flat = [LazyFlatEvent(event) for event in events]
+    for event in flat:
+        event.materialize()
+    return flat
+
+
+def benchmark(engine: str, events: list, repeat: int) -> dict:
+    start = time.perf_counter()
+    rules = [compile_rule.__wrapped__(rule, engine) for rule in default_rules]
+    compile_us = (time.perf_counter() - start) * 1e6
+
+    matches = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for event in events:
+            for rule in rules:
+                try:
+                    matches += evaluate_rule(rule, event)
+                except Exception: # noqa: S112
+                    continue
+    evaluations = repeat * len(events) * len(rules)
+    evaluate_ns = (time.perf_counter() - start) * 1e9 / evaluations
+    return {
+        "engine": engine,
+        "rules": len(rules),
+        "compile_us": round(compile_us, 1),
+        "evaluate_ns": round(evaluate_ns, 1),
+        "matches": matches,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    events = flat_events()
+    for engine in RULE_ENGINES:
+        print(json.dumps(benchmark(engine, events, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
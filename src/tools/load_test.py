@@ -0,0 +1,215 @@
+"""
+Load test of lambda_handler against local stand-ins, nothing is sent to AWS or Slack:
+
+- Slack webhooks and chat.postMessage: SlackStub, the Slack transports connect to it instead of Slack
+- SNS and DynamoDB: in-process fakes in place of the boto3 clients
+- Slack configuration and bot token: ParametersExtensionStub on PARAMETERS_SECRETS_EXTENSION_HTTP_PORT
+
+Runs invocations with synthetic events for every batch size and prints one JSON line per size with
+events per second, p50/p99 handler duration and the calls made to every destination.
+
+    cd src && python tools/load_test.py --sizes 10,100,1000 --invocations 5 --slack-latency 0.05 --throttle-every 50
+
+Slack allows about one message per second per channel. The Lambda waits for that, which would make
+Slack the only thing measured, so the rate is raised to --slack-rate, use --slack-rate 1 for the real one.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+
+CONFIG_PARAMETER = "cloudtrail-to-slack-config"
+TOKEN_PARAMETER = "cloudtrail-to-slack-bot-token"
+WEBHOOK_URL = "https://hooks.slack.com/services/T0000000/B0000000/load-test"
+SNS_TOPIC_PATTERN = "arn:aws:sns:eu-central-1:ACCOUNT_ID:cloudtrail-to-slack"
+DYNAMODB_TABLE_NAME = "cloudtrail-to-slack"
+
+
+class _Context:
+    """The part of the Lambda context the handler uses."""
+
+    def __init__(self, timeout_seconds: float) -> None: # noqa: ANN101
+        self._end = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int: # noqa: ANN101
+        return int((self._end - time.monotonic()) * 1000)
+
+
+class StandIns:
+    """
+    Points the handler at the stand-ins until the block ends. mode is "app" for the Slack app with
+    threads in DynamoDB or "webhook" for a Slack webhook.
+    """
+
+    def __init__( # noqa: PLR0913
+        self, # noqa: ANN101
+        mode: str = "app",
+        slack_latency: float = 0.0,
+        throttle_every: int = 0,
+        retry_after: float = 1.0,
+        aws_latency: float = 0.0,
+        slack_rate: float | None = 100.0,
+        delivery_concurrency: int | None = None,
+        rules: List[str] | None = None,
+        ignore_rules: List[str] | None = None,
+    ) -> None:
+        from tools.stubs import FakeDynamoDbClient, FakeSnsClient, ParametersExtensionStub, SlackStub
+
+        self.mode = mode
+        self.slack = SlackStub(slack_latency, throttle_every, retry_after)
+        self.extension = ParametersExtensionStub({CONFIG_PARAMETER: "[]", TOKEN_PARAMETER: "xoxb-load-test"})
+        self.sns = FakeSnsClient(aws_latency)
+        self.dynamodb = FakeDynamoDbClient(aws_latency)
+        self.slack_rate = slack_rate
+        self.delivery_concurrency = delivery_concurrency
+        self.rules = rules
+        self.ignore_rules = ignore_rules or []
+        self._undo: List[tuple] = []
+
+    def _set(self, target: Any, name: str, value: Any) -> None: # noqa: ANN101, ANN401
+        self._undo.append((target, name, getattr(target, name)))
+        setattr(target, name, value)
+
+    def _setenv(self, name: str, value: str) -> None: # noqa: ANN101
+        self._undo.append((os.environ, name, os.environ.get(name)))
+        os.environ[name] = value
+
+    def __enter__(self) -> "StandIns": # noqa: ANN101
+        import clients
+        import dynamodb
+        import main
+        import slack_transport
+        import urllib3
+        from config import SlackConfigCache, SlackWebhookConfig
+        from rule_source import RuleStore
+        from slack_scheduler import OutboundScheduler
+
+        self.slack.__enter__()
+        self.extension.__enter__()
+        self._setenv("PARAMETERS_SECRETS_EXTENSION_HTTP_PORT", str(self.extension.port))
+        self._setenv("AWS_SESSION_TOKEN", "load-test")
+        self._setenv("CONFIG_SSM_PARAMETER_NAME", CONFIG_PARAMETER)
+        self._setenv("SLACK_BOT_TOKEN_SSM_PARAMETER_NAME", TOKEN_PARAMETER)
+        self._setenv("DEFAULT_SLACK_CHANNEL_ID", "C0LOADTEST")
+
+        self._set(clients, "sns_client", lambda: self.sns)
+        self._set(clients, "dynamodb_client", lambda: self.dynamodb)
+        for host in (slack_transport.SLACK_API_HOST, "hooks.slack.com"):
+            # the cached transport of the host is used by every client, its connections go to the stub
+            pool = urllib3.HTTPConnectionPool(
+                "127.0.0.1", self.slack.port, maxsize=slack_transport.POOL_SIZE, timeout=slack_transport.TIMEOUT
+            )
+            self._set(slack_transport.slack_transport(host), "pool", pool)
+        scheduler = OutboundScheduler() if self.slack_rate is None else OutboundScheduler(rate=self.slack_rate)
+        self._set(slack_transport, "scheduler", scheduler)
+        self._set(main, "slack_scheduler", scheduler)
+
+        self._set(main.cfg, "sns_topic_pattern", SNS_TOPIC_PATTERN)
+        self._set(main.cfg, "dynamodb_table_name", DYNAMODB_TABLE_NAME)
+        if self.delivery_concurrency is not None:
+            self._set(main.cfg, "delivery_concurrency", self.delivery_concurrency)
+        if self.rules is not None:
+            self._set(main, "rule_store", RuleStore(self.rules, self.ignore_rules))
+        if self.mode == "app":
+            self._set(main, "slack_config", {})
+            self._set(main, "slack_config_cache", SlackConfigCache(ttl = main.cfg.config_cache_ttl_seconds))
+        else:
+            self._set(main, "slack_config", SlackWebhookConfig(WEBHOOK_URL, []))
+        dynamodb.thread_ts_cache.clear()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None: # noqa: ANN101
+        for target, name, value in reversed(self._undo):
+            if target is os.environ:
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            else:
+                setattr(target, name, value)
+        self._undo = []
+        self.extension.__exit__(*exc_info)
+        self.slack.__exit__(*exc_info)
+
+    def calls(self) -> Dict[str, Dict[str, int]]: # noqa: ANN101
+        return {
+            "slack": dict(self.slack.calls),
+            "sns": dict(self.sns.calls),
+            "dynamodb": dict(self.dynamodb.calls),
+            "parameters": {"get": len(self.extension.requests)},
+        }
+
+
+def _difference(after: Dict[str, Dict[str, int]], before: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+    difference = {}
+    for destination, counts in after.items():
+        previous = before[destination]
+        difference[destination] = {name: count - previous.get(name, 0) for name, count in counts.items() if count != previous.get(name, 0)}
+    return difference
+
+
+def run_size(stand_ins: StandIns, size: int, invocations: int, seed: int = 0, timeout_seconds: float = 60) -> Dict[str, Any]:
+    """Runs invocations with size events each and returns the measurements."""
+    import main
+    from tools.synthetic_events import generate_events, subscription_payload
+    from tracing import percentile
+
+    events = generate_events(size * invocations, seed=seed)
+    payloads = [subscription_payload(events[start:start + size]) for start in range(0, len(events), size)]
+    before = stand_ins.calls()
+    durations = []
+    for payload in payloads:
+        start = time.perf_counter()
+        main.lambda_handler(payload, _Context(timeout_seconds))
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return {
+        "events_per_invocation": size,
+        "invocations": invocations,
+        "events_per_second": round(size * invocations / sum(durations), 1),
+        "p50_ms": round(percentile(durations, 50) * 1000, 2),
+        "p99_ms": round(percentile(durations, 99) * 1000, 2),
+        "calls": _difference(stand_ins.calls(), before),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000", help="events per invocation, comma separated")
+    parser.add_argument("--invocations", type=int, default=5, help="invocations per size")
+    parser.add_argument("--mode", choices=["app", "webhook"], default="app")
+    parser.add_argument("--slack-latency", type=float, default=0.0, help="seconds every Slack request takes")
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every n-th Slack request with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429 responses")
+    parser.add_argument("--aws-latency", type=float, default=0.0, help="seconds every SNS and DynamoDB call takes")
+    parser.add_argument("--slack-rate", type=float, default=100.0, help="Slack messages per second and channel")
+    parser.add_argument("--delivery-concurrency", type=int)
+    parser.add_argument("--rule", action="append", help="rule instead of the configured ones, can be repeated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60, help="Lambda timeout in seconds")
+    args = parser.parse_args()
+
+    # set before main is imported, logging every event would be most of the time measured
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    stand_ins = StandIns(
+        mode = args.mode,
+        slack_latency = args.slack_latency,
+        throttle_every = args.throttle_every,
+        retry_after = args.retry_after,
+        aws_latency = args.aws_latency,
+        slack_rate = args.slack_rate,
+        delivery_concurrency = args.delivery_concurrency,
+        rules = args.rule,
+    )
+    with stand_ins:
+        for size in (int(size) for size in args.sizes.split(",")):
+            print(json.dumps(run_size(stand_ins, size, args.invocations, args.seed, args.timeout)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Replays CloudTrail history against the rules without AWS or Slack.
+
+Reads every file below the input directory, in any of these formats, optionally gzip compressed:
+
+- CloudTrail archives from S3, {"Records": [...]}
+- CloudWatch Logs exports, one "<timestamp> <event JSON>" per line, or JSON lines
+- CloudWatch Logs subscription payloads as the Lambda receives them, {"awslogs": {"data": ...}}
+
+Files are parsed and evaluated in a process pool and the results written to the output directory:
+
+- matches.jsonl: the events that would be sent, with the file and the first rule that matched
+- rule_hits.json: totals and the number of events every rule and ignore rule is True for
+- errors.jsonl: rules that raised and files that could not be read
+- slack_messages.jsonl: with --dry-run, the Slack message of every match, nothing is sent
+
+    cd src && python tools/replay.py ~/cloudtrail/2024/05 --output /tmp/replay --rules-file new_rules.json --dry-run
+
+The rules file has the format of the rules parameter, see rule_source.py.
+Rules are the default rules, unless --no-default-rules, followed by --rules-file and --rule.
+"""
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+
+from flat_event import LazyFlatEvent # noqa: E402
+from log_stream import iter_cloudtrail_log_records # noqa: E402
+from rule_batch import BatchEvaluator # noqa: E402
+from rule_engine import RuleSet, evaluate_rule # noqa: E402
+from rule_source import parse_rules # noqa: E402
+from rules import default_rules # noqa: E402
+
+# set in every worker process by _init_worker
+_evaluator: BatchEvaluator | None = None
+_dry_run = False
+
+
+def read_events(path: str) -> List[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    text = data.decode("utf-8")
+
+    if text.lstrip().startswith("{"):
+        try:
+            document = json.loads(text)
+        except json.JSONDecodeError:
+            # more than one JSON document, read line by line below
+            document = None
+        if isinstance(document, dict) and isinstance(document.get("Records"), list):
+            return document["Records"]
+        if isinstance(document, dict) and "awslogs" in document:
+            return [record.event for record in iter_cloudtrail_log_records(document)]
+        if isinstance(document, dict):
+            return [document]
+
+    events = []
+    for line in text.splitlines():
+        # export lines start with the timestamp of the log event
+        start = line.find("{")
+        if start != -1:
+            events.append(json.loads(line[start:]))
+    return events
+
+
+def find_files(directory: str) -> List[str]:
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        files += [os.path.join(root, name) for name in sorted(names) if not name.startswith(".")]
+    return files
+
+
+def _init_worker(rules: List[str], ignore_rules: List[str], dry_run: bool) -> None:
+    global _evaluator, _dry_run # noqa: PLW0603
+    _evaluator = BatchEvaluator(rules, ignore_rules)
+    _dry_run = dry_run
+
+
+def _first_matching_rule(event: Dict[str, Any]) -> str | None:
+    flat_event = LazyFlatEvent(event)
+    for rule in _evaluator.rule_set.candidates(flat_event):
+        try:
+            if evaluate_rule(rule, flat_event):
+                return rule.source
+        except Exception: # noqa: S112
+            continue
+    return None
+
+
+def replay_file(path: str) -> Dict[str, Any]:
+    """Runs in a worker process, returns everything the parent writes for this file."""
+    try:
+        events = read_events(path)
+    except Exception as e:
+        return {"file": path, "events": 0, "matches": [], "errors": [{"file": path, "error": repr(e)}], "rule_hits": None}
+
+    result = _evaluator.evaluate(events, count_hits=True)
+    matches = []
+    for row in result.rows:
+        event = events[row]
+        match = {"file": path, "rule": _first_matching_rule(event), "event": event}
+        if _dry_run:
+            from slack_helpers import event_to_slack_message
+            account_id = event.get("recipientAccountId") or event.get("userIdentity", {}).get("accountId")
+            match["slack_message"] = event_to_slack_message(event, path, account_id)
+        matches.append(match)
+    errors = [
+        {"file": path, "eventID": events[row].get("eventID"), "rule": error["rule"], "error": repr(error["error"])}
+        for row, event_errors in result.errors.items()
+        for error in event_errors
+    ]
+    return {
+        "file": path,
+        "events": len(events),
+        "matches": matches,
+        "errors": errors,
+        "rule_hits": result.rule_hits,
+        "ignore_rule_hits": result.ignore_rule_hits,
+    }
+
+
+def _results(files: List[str], processes: int, initargs: Tuple) -> Iterator[Dict[str, Any]]:
+    if processes == 1:
+        _init_worker(*initargs)
+        yield from map(replay_file, files)
+        return
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+        # in file order, so the output does not depend on which worker finished first
+        yield from pool.imap(replay_file, files)
+
+
+def replay( # noqa: PLR0913
+    directory: str,
+    output: str,
+    rules: List[str],
+    ignore_rules: List[str],
+    processes: int | None = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Replays all files below directory, writes the results to output and returns the summary."""
+    start = time.perf_counter()
+    files = find_files(directory)
+    processes = max(1, min(processes or os.cpu_count() or 1, len(files) or 1))
+    os.makedirs(output, exist_ok=True)
+
+    # rules that do not compile are reported once here, the workers get the others
+    rule_set, ignore_rule_set = RuleSet(rules), RuleSet(ignore_rules)
+    compilation_errors = [{"rule": error["rule"], "error": repr(error["error"])} for error in rule_set.errors + ignore_rule_set.errors]
+    rules = [rule.source for rule in rule_set.rules]
+    ignore_rules = [rule.source for rule in ignore_rule_set.rules]
+
+    summary: Dict[str, Any] = {"files": len(files), "events": 0, "matches": 0, "errors": len(compilation_errors)}
+    rule_hits = [0] * len(rules)
+    ignore_rule_hits = [0] * len(ignore_rules)
+    with (
+        open(os.path.join(output, "matches.jsonl"), "w") as matches_file,
+        open(os.path.join(output, "errors.jsonl"), "w") as errors_file,
+        open(os.path.join(output, "slack_messages.jsonl") if dry_run else os.devnull, "w") as messages_file,
+    ):
+        for error in compilation_errors:
+            errors_file.write(json.dumps(error) + "\n")
+        for result in _results(files, processes, (rules, ignore_rules, dry_run)):
+            summary["events"] += result["events"]
+            summary["matches"] += len(result["matches"])
+            summary["errors"] += len(result["errors"])
+            if result["rule_hits"] is not None:
+                rule_hits = [total + hits for total, hits in zip(rule_hits, result["rule_hits"], strict=True)]
+                ignore_rule_hits = [total + hits for total, hits in zip(ignore_rule_hits, result["ignore_rule_hits"], strict=True)]
+            for match in result["matches"]:
+                message = match.pop("slack_message", None)
+                matches_file.write(json.dumps(match) + "\n")
+                if message is not None:
+                    line = {"file": match["file"], "eventID": match["event"].get("eventID"), "message": message}
+                    messages_file.write(json.dumps(line) + "\n")
+            for error in result["errors"]:
+                errors_file.write(json.dumps(error) + "\n")
+
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    summary["processes"] = processes
+    summary["rules"] = [{"rule": rule, "hits": hits} for rule, hits in zip(rules, rule_hits, strict=True)]
+    summary["ignore_rules"] = [{"rule": rule, "hits": hits} for rule, hits in zip(ignore_rules, ignore_rule_hits, strict=True)]
+    with open(os.path.join(output, "rule_hits.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--output", required=True, help="directory the results are written to")
+    parser.add_argument("--rules-file", help='JSON file {"rules": [...], "ignore_rules": [...]}')
+    parser.add_argument("--rule", action="append", default=[], help="rule to add, can be repeated")
+    parser.add_argument("--ignore-rule", action="append", default=[], help="ignore rule to add, can be repeated")
+    parser.add_argument("--no-default-rules", action="store_true")
+    parser.add_argument("--processes", type=int, help="worker processes, defaults to the number of CPUs")
+    parser.add_argument("--dry-run", action="store_true", help="render the Slack message of every match")
+    args = parser.parse_args()
+
+    rules = [] if args.no_default_rules else list(default_rules)
+    ignore_rules = []
+    if args.rules_file:
+        with open(args.rules_file, encoding="utf-8") as f:
+            file_rules, file_ignore_rules = parse_rules(f.read())
+        rules += file_rules
+        ignore_rules += file_ignore_rules
+    rules += args.rule
+    ignore_rules += args.ignore_rule
+    if not rules:
+        parser.error("no rules to replay")
+
+    summary = replay(args.directory, args.output, rules, ignore_rules, args.processes, args.dry_run)
+    print(json.dumps({key: value for key, value in summary.items() if key not in ("rules", "ignore_rules")}))
+
+
+if __name__ == "__main__":
+    main()
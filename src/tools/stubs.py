@@ -0,0 +1,258 @@
+"""
+Local stand-ins for the services the Lambda talks to, for tests, local runs and load tests:
+HTTP servers for the Parameters and Secrets extension and Slack, in-process fakes of the boto3
+SNS and DynamoDB clients.
+
+    with ParametersExtensionStub({"config": "[]", "token": "xoxb-..."}) as extension:
+        os.environ["PARAMETERS_SECRETS_EXTENSION_HTTP_PORT"] = str(extension.port)
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlsplit
+
+HOLD_TIMEOUT_SECONDS = 5.0
+
+
+class _StubServer:
+    def __init__(self, handler: type) -> None: # noqa: ANN101
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self): # noqa: ANN101, ANN204
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None: # noqa: ANN101
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _ParametersHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None: # noqa: ANN101, N802
+        stub: ParametersExtensionStub = self.server.stub
+        url = urlsplit(self.path)
+        name = parse_qs(url.query).get("name", [""])[0]
+        stub.requests.append((url.path, name, time.monotonic()))
+        stub.wait_until_released()
+        if url.path != "/systemsmanager/parameters/get/" or "X-Aws-Parameters-Secrets-Token" not in self.headers:
+            self._reply(400, {"error": "bad request"})
+        elif name not in stub.parameters:
+            self._reply(400, {"error": f"parameter {name} not found"})
+        else:
+            value, version = stub.parameters[name]
+            self._reply(200, {"Parameter": {"Name": name, "Type": "String", "Value": value, "Version": version}})
+
+    def _reply(self, status: int, body: dict) -> None: # noqa: ANN101
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: object) -> None: # noqa: ANN101
+        pass
+
+
+class ParametersExtensionStub(_StubServer):
+    """
+    The SSM part of the AWS Parameters and Secrets Lambda extension. After hold() requests are
+    answered only after release(), in_flight counts the requests that are waiting.
+    """
+
+    def __init__(self, values: Dict[str, str]) -> None: # noqa: ANN101
+        super().__init__(_ParametersHandler)
+        self.parameters = {name: (value, 1) for name, value in values.items()}
+        self.requests: List[tuple] = []
+        self.in_flight = 0
+        self._released = threading.Event()
+        self._released.set()
+        self._condition = threading.Condition()
+
+    def hold(self) -> None: # noqa: ANN101
+        self._released.clear()
+
+    def release(self) -> None: # noqa: ANN101
+        self._released.set()
+
+    def wait_until_released(self) -> None: # noqa: ANN101
+        with self._condition:
+            self.in_flight += 1
+            self._condition.notify_all()
+        # a test that never releases fails instead of hanging
+        self._released.wait(HOLD_TIMEOUT_SECONDS)
+        with self._condition:
+            self.in_flight -= 1
+
+    def wait_for_in_flight(self, count: int) -> bool: # noqa: ANN101
+        """Waits until count requests are held at the same time, False after HOLD_TIMEOUT_SECONDS."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.in_flight >= count, HOLD_TIMEOUT_SECONDS)
+
+    def put(self, name: str, value: str) -> None: # noqa: ANN101
+        """Changes a parameter like put-parameter, which increases its version."""
+        _, version = self.parameters.get(name, (None, 0))
+        self.parameters[name] = (value, version + 1)
+
+
+class _SlackHandler(BaseHTTPRequestHandler):
+    # keep-alive, like Slack, the transport reuses its connections
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None: # noqa: ANN101, N802
+        stub: SlackStub = self.server.stub
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        api = self.path.startswith("/api/")
+        destination = self.path[len("/api/"):] if api else "webhook"
+        number = stub.count(destination)
+        time.sleep(stub.latency)
+        if stub.throttle_every and number % stub.throttle_every == 0:
+            stub.count("429")
+            self._reply(429, b'{"ok": false, "error": "ratelimited"}' if api else b"rate_limited", {"Retry-After": str(stub.retry_after)})
+        elif api:
+            channel = json.loads(body or b"{}").get("channel")
+            self._reply(200, json.dumps({"ok": True, "channel": channel, "ts": f"{time.time():.0f}.{number:06d}"}).encode())
+        else:
+            self._reply(200, b"ok")
+
+    def _reply(self, status: int, data: bytes, headers: Dict[str, str] | None = None) -> None: # noqa: ANN101
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json" if data.startswith(b"{") else "text/html")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: object) -> None: # noqa: ANN101
+        pass
+
+
+class SlackStub(_StubServer):
+    """
+    Webhooks and the Web API of Slack on one port. Every request waits latency seconds,
+    every throttle_every-th request is answered with 429 and Retry-After.
+    calls counts requests per API method, "webhook" and "429".
+    """
+
+    def __init__(self, latency: float = 0.0, throttle_every: int = 0, retry_after: float = 1.0) -> None: # noqa: ANN101
+        super().__init__(_SlackHandler)
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, name: str) -> int: # noqa: ANN101
+        with self._lock:
+            self.calls[name] += 1
+            return self.calls[name]
+
+
+class _FakeClient:
+    def __init__(self, latency: float = 0.0) -> None: # noqa: ANN101
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str) -> None: # noqa: ANN101
+        with self._lock:
+            self.calls[operation] += 1
+        time.sleep(self.latency)
+
+
+class FakeSnsClient(_FakeClient):
+    """publish and publish_batch of the boto3 SNS client, every message is accepted."""
+
+    def publish(self, **kwargs: Any) -> Dict[str, Any]: # noqa: ANN101, ANN401, ARG002
+        self._call("publish")
+        return {"MessageId": "fake", "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def publish_batch(self, TopicArn: str, PublishBatchRequestEntries: List[Dict[str, Any]]) -> Dict[str, Any]: # noqa: ANN101, N803, ARG002
+        self._call("publish_batch")
+        return {
+            "Successful": [{"Id": entry["Id"], "MessageId": "fake"} for entry in PublishBatchRequestEntries],
+            "Failed": [],
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+        }
+
+
+class FakeDynamoDbClient(_FakeClient):
+    """The item operations of the boto3 DynamoDB client on one in-memory table with a string hash key."""
+
+    def __init__(self, latency: float = 0.0, hash_key: str = "principal_structure_and_action_hash") -> None: # noqa: ANN101
+        super().__init__(latency)
+        self.hash_key = hash_key
+        self.items: Dict[str, Dict[str, Any]] = {}
+
+    def _key(self, item: Dict[str, Any]) -> str: # noqa: ANN101
+        return item[self.hash_key]["S"]
+
+    def get_item(self, TableName: str, Key: Dict[str, Any]) -> Dict[str, Any]: # noqa: ANN101, N803, ARG002
+        self._call("get_item")
+        item = self.items.get(self._key(Key))
+        return {"Item": item} if item else {}
+
+    def put_item(self, TableName: str, Item: Dict[str, Any]) -> Dict[str, Any]: # noqa: ANN101, N803, ARG002
+        self._call("put_item")
+        self.items[self._key(Item)] = Item
+        return {}
+
+    def update_item( # noqa: PLR0913
+        self, # noqa: ANN101
+        TableName: str, # noqa: N803, ARG002
+        Key: Dict[str, Any], # noqa: N803
+        UpdateExpression: str, # noqa: N803
+        ExpressionAttributeNames: Dict[str, str], # noqa: N803
+        ExpressionAttributeValues: Dict[str, Any], # noqa: N803
+        ReturnValues: str = "NONE", # noqa: N803
+    ) -> Dict[str, Any]:
+        """ADD of numbers and SET #name = if_not_exists(#name, :value), nothing else."""
+        self._call("update_item")
+        with self._lock:
+            item = self.items.setdefault(self._key(Key), dict(Key))
+            for action, body in re.findall(r"(ADD|SET) (.*?)(?= ADD | SET |$)", UpdateExpression):
+                for part in re.split(r", (?![^(]*\))", body):
+                    if action == "ADD":
+                        name, value = part.split(" ")
+                        name = ExpressionAttributeNames[name]
+                        total = int(item.get(name, {"N": "0"})["N"]) + int(ExpressionAttributeValues[value]["N"])
+                        item[name] = {"N": str(total)}
+                    else:
+                        name, value = re.fullmatch(r"(#\w+) = if_not_exists\(#\w+, (:\w+)\)", part).groups()
+                        item.setdefault(ExpressionAttributeNames[name], ExpressionAttributeValues[value])
+            if ReturnValues == "UPDATED_NEW":
+                return {"Attributes": {name: dict(item[name]) for name in ExpressionAttributeNames.values()}}
+        return {}
+
+    def delete_item(self, TableName: str, Key: Dict[str, Any], ReturnValues: str = "NONE") -> Dict[str, Any]: # noqa: ANN101, N803, ARG002
+        self._call("delete_item")
+        with self._lock:
+            item = self.items.pop(self._key(Key), None)
+        return {"Attributes": item} if item and ReturnValues == "ALL_OLD" else {}
+
+    def batch_get_item(self, RequestItems: Dict[str, Any]) -> Dict[str, Any]: # noqa: ANN101, N803
+        self._call("batch_get_item")
+        return {
+            "Responses": {
+                table: [self.items[self._key(key)] for key in request["Keys"] if self._key(key) in self.items]
+                for table, request in RequestItems.items()
+            },
+            "UnprocessedKeys": {},
+        }
+
+    def batch_write_item(self, RequestItems: Dict[str, Any]) -> Dict[str, Any]: # noqa: ANN101, N803
+        self._call("batch_write_item")
+        for requests in RequestItems.values():
+            for request in requests:
+                item = request["PutRequest"]["Item"]
+                self.items[self._key(item)] = item
+        return {"UnprocessedItems": {}}
@@ -0,0 +1,285 @@
+"""
+Seeded generator of CloudTrail events for benchmarks and load tests. The same seed gives the same events.
+
+The mix is close to what an organization trail sees:
+
+- mostly read calls (Describe*, Get*, List*) by assumed roles, some writes, a few calls by root
+- bursts of AccessDenied/UnauthorizedOperation from one principal retrying the same call
+- some events with large requestParameters (policy documents, long filter lists)
+- rare events that the default rules alert on (StopLogging, ConsoleLogin without MFA, ...)
+
+Events can be wrapped in CloudWatch Logs subscription payloads as the Lambda receives them.
+
+    cd src && python tools/synthetic_events.py --count 10000 --seed 1 --payloads > /tmp/payloads.json
+"""
+import argparse
+import base64
+import gzip
+import json
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List
+
+ACCOUNT_IDS = ["111111111111", "222222222222", "333333333333", "444444444444"]
+REGIONS = ["eu-central-1", "eu-west-1", "us-east-1", "us-west-2"]
+
+READ_CALLS = {
+    "ec2.amazonaws.com": ["DescribeInstances", "DescribeSecurityGroups", "DescribeVolumes", "DescribeSubnets"],
+    "s3.amazonaws.com": ["GetObject", "HeadObject", "ListBuckets", "GetBucketPolicy"],
+    "iam.amazonaws.com": ["GetRole", "ListRoles", "ListAttachedRolePolicies", "GetPolicyVersion"],
+    "lambda.amazonaws.com": ["GetFunction", "ListFunctions20150331"],
+    "sts.amazonaws.com": ["GetCallerIdentity", "AssumeRole"],
+    "kms.amazonaws.com": ["Decrypt", "DescribeKey"],
+    "logs.amazonaws.com": ["DescribeLogGroups", "FilterLogEvents"],
+}
+WRITE_CALLS = {
+    "ec2.amazonaws.com": ["RunInstances", "TerminateInstances", "AuthorizeSecurityGroupIngress", "CreateTags"],
+    "s3.amazonaws.com": ["PutObject", "DeleteObject", "PutBucketPolicy"],
+    "iam.amazonaws.com": ["CreateRole", "PutRolePolicy", "AttachRolePolicy", "CreateAccessKey"],
+    "lambda.amazonaws.com": ["UpdateFunctionConfiguration20150331v2", "UpdateFunctionCode20150331v2"],
+    "logs.amazonaws.com": ["PutRetentionPolicy", "CreateLogStream"],
+}
+# (eventSource, eventName) of events the default rules match, besides AccessDenied and root
+ALERTS = [
+    ("cloudtrail.amazonaws.com", "StopLogging"),
+    ("cloudtrail.amazonaws.com", "UpdateTrail"),
+    ("cloudtrail.amazonaws.com", "DeleteTrail"),
+    ("signin.amazonaws.com", "ConsoleLogin"),
+    ("iam.amazonaws.com", "AttachUserPolicy"),
+]
+USER_AGENTS = [
+    "aws-cli/2.15.30 Python/3.11.8 Linux/6.1.0 exe/x86_64.ubuntu.22",
+    "Boto3/1.34.69 md/Botocore#1.34.69 ua/2.0 os/linux#5.10.0 md/arch#x86_64 lang/python#3.12.2",
+    "aws-sdk-go-v2/1.25.2 os/linux lang/go#1.22.1 md/GOOS#linux md/GOARCH#amd64 api/ec2#1.150.1",
+    "Terraform/1.7.5 (+https://www.terraform.io) terraform-provider-aws/5.42.0",
+    "console.amazonaws.com",
+]
+
+
+class EventGenerator:
+    def __init__( # noqa: PLR0913
+        self, # noqa: ANN101
+        seed: int = 0,
+        write_rate: float = 0.25,
+        access_denied_rate: float = 0.01,
+        large_parameters_rate: float = 0.03,
+        alert_rate: float = 0.002,
+        root_rate: float = 0.005,
+    ) -> None:
+        self.random = random.Random(seed)
+        self.write_rate = write_rate
+        self.access_denied_rate = access_denied_rate
+        self.large_parameters_rate = large_parameters_rate
+        self.alert_rate = alert_rate
+        self.root_rate = root_rate
+        self.time = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        self.principals = [self._principal(account_id, number) for account_id in ACCOUNT_IDS for number in range(25)]
+
+    def events(self, count: int) -> List[Dict[str, Any]]: # noqa: ANN101
+        events: List[Dict[str, Any]] = []
+        while len(events) < count:
+            if self.random.random() < self.access_denied_rate:
+                events += self._access_denied_burst()
+            else:
+                events.append(self._event())
+        return events[:count]
+
+    def _principal(self, account_id: str, number: int) -> Dict[str, Any]: # noqa: ANN101
+        if number % 5 == 0:
+            name = f"user-{number}"
+            return {
+                "type": "IAMUser",
+                "principalId": f"AIDA{account_id}{number:04d}",
+                "arn": f"arn:aws:iam::{account_id}:user/{name}",
+                "accountId": account_id,
+                "accessKeyId": f"AKIA{account_id}{number:04d}",
+                "userName": name,
+            }
+        role = self.random.choice(["AWSReservedSSO_AdministratorAccess_0123456789abcdef", "deploy", "ci-runner", "app-backend"])
+        session = f"session-{number}"
+        return {
+            "type": "AssumedRole",
+            "principalId": f"AROA{account_id}{number:04d}:{session}",
+            "arn": f"arn:aws:sts::{account_id}:assumed-role/{role}/{session}",
+            "accountId": account_id,
+            "accessKeyId": f"ASIA{account_id}{number:04d}",
+            "sessionContext": {
+                "sessionIssuer": {
+                    "type": "Role",
+                    "principalId": f"AROA{account_id}{number:04d}",
+                    "arn": f"arn:aws:iam::{account_id}:role/{role}",
+                    "accountId": account_id,
+                    "userName": role,
+                },
+                "attributes": {"creationDate": "2024-05-01T00:00:00Z", "mfaAuthenticated": "false"},
+            },
+        }
+
+    def _identity(self) -> Dict[str, Any]: # noqa: ANN101
+        draw = self.random.random()
+        if draw < self.root_rate:
+            account_id = self.random.choice(ACCOUNT_IDS)
+            return {"type": "Root", "principalId": account_id, "arn": f"arn:aws:iam::{account_id}:root", "accountId": account_id}
+        if draw < self.root_rate + 0.08: # noqa: PLR2004
+            invoked_by = self.random.choice(["ec2.amazonaws.com", "lambda.amazonaws.com", "config.amazonaws.com"])
+            return {"type": "AWSService", "invokedBy": invoked_by}
+        return self.random.choice(self.principals)
+
+    def _base(self, identity: Dict[str, Any], event_source: str, event_name: str, read_only: bool) -> Dict[str, Any]: # noqa: ANN101
+        self.time += timedelta(milliseconds=self.random.randint(1, 200))
+        account_id = identity.get("accountId") or self.random.choice(ACCOUNT_IDS)
+        return {
+            "eventVersion": "1.09",
+            "userIdentity": identity,
+            "eventTime": self.time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "eventSource": event_source,
+            "eventName": event_name,
+            "awsRegion": self.random.choice(REGIONS),
+            "sourceIPAddress": identity.get("invokedBy") or self._private_ip(),
+            "userAgent": identity.get("invokedBy") or self.random.choice(USER_AGENTS),
+            "requestParameters": self._request_parameters(event_name),
+            "responseElements": None,
+            "requestID": "%032x" % self.random.getrandbits(128),
+            "eventID": "%032x" % self.random.getrandbits(128),
+            "readOnly": read_only,
+            "eventType": "AwsApiCall",
+            "managementEvent": True,
+            "recipientAccountId": account_id,
+            "eventCategory": "Management",
+        }
+
+    def _private_ip(self) -> str: # noqa: ANN101
+        return f"10.{self.random.randint(0, 255)}.{self.random.randint(0, 255)}.{self.random.randint(1, 254)}"
+
+    def _request_parameters(self, event_name: str) -> Dict[str, Any] | None: # noqa: ANN101
+        if self.random.random() < self.large_parameters_rate:
+            return self._large_request_parameters()
+        if event_name.startswith("Describe"):
+            return {"filterSet": {"items": [{"name": "tag:team", "valueSet": {"items": [{"value": "platform"}]}}]}, "maxResults": 1000}
+        if event_name in ("GetObject", "HeadObject", "PutObject", "DeleteObject"):
+            return {"bucketName": f"bucket-{self.random.randint(1, 40)}", "key": f"data/{self.random.getrandbits(32):08x}.json"}
+        if event_name.startswith("List"):
+            return None
+        return {"roleName": f"role-{self.random.randint(1, 100)}"}
+
+    def _large_request_parameters(self) -> Dict[str, Any]: # noqa: ANN101
+        statements = [
+            {
+                "Sid": f"Statement{number}",
+                "Effect": "Allow",
+                "Action": [f"s3:{action}" for action in ("GetObject", "PutObject", "ListBucket", "DeleteObject")],
+                "Resource": [f"arn:aws:s3:::bucket-{number}/*", f"arn:aws:s3:::bucket-{number}"],
+                "Condition": {"StringEquals": {"aws:PrincipalOrgID": "o-abcdefghij"}},
+            }
+            for number in range(self.random.randint(10, 80))
+        ]
+        return {
+            "policyName": "generated",
+            "policyDocument": json.dumps({"Version": "2012-10-17", "Statement": statements}),
+            "tags": [{"key": f"tag-{number}", "value": "x" * 40} for number in range(self.random.randint(10, 50))],
+        }
+
+    def _event(self) -> Dict[str, Any]: # noqa: ANN101
+        if self.random.random() < self.alert_rate:
+            return self._alert()
+        identity = self._identity()
+        write = self.random.random() < self.write_rate or identity["type"] == "Root"
+        calls = WRITE_CALLS if write else READ_CALLS
+        event_source = self.random.choice(sorted(calls))
+        event = self._base(identity, event_source, self.random.choice(calls[event_source]), read_only=not write)
+        if write:
+            event["responseElements"] = {"requestId": event["requestID"], "return": True}
+        return event
+
+    def _alert(self) -> Dict[str, Any]: # noqa: ANN101
+        event_source, event_name = self.random.choice(ALERTS)
+        identity = self.random.choice(self.principals)
+        event = self._base(identity, event_source, event_name, read_only=False)
+        if event_name == "ConsoleLogin":
+            event["eventType"] = "AwsConsoleSignIn"
+            event["additionalEventData"] = {"MFAUsed": "No", "LoginTo": "https://console.aws.amazon.com/console/home"}
+            event["responseElements"] = {"ConsoleLogin": "Success"}
+        elif event_name == "AttachUserPolicy":
+            event["requestParameters"] = {"userName": "intruder", "policyArn": "arn:aws:iam::aws:policy/AdministratorAccess"}
+        else:
+            event["requestParameters"] = {"name": f"arn:aws:cloudtrail:eu-central-1:{event['recipientAccountId']}:trail/organization"}
+        return event
+
+    def _access_denied_burst(self) -> List[Dict[str, Any]]: # noqa: ANN101
+        """One principal retrying a call it is not allowed to make."""
+        identity = self.random.choice(self.principals)
+        event_source = self.random.choice(sorted(WRITE_CALLS))
+        event_name = self.random.choice(WRITE_CALLS[event_source])
+        ec2 = event_source == "ec2.amazonaws.com"
+        burst = []
+        for _ in range(self.random.randint(5, 30)):
+            event = self._base(identity, event_source, event_name, read_only=False)
+            event["errorCode"] = "Client.UnauthorizedOperation" if ec2 else "AccessDenied"
+            event["errorMessage"] = f"User: {identity['arn']} is not authorized to perform: {event_source.split('.')[0]}:{event_name}"
+            burst.append(event)
+        return burst
+
+
+def generate_events(count: int, seed: int = 0, **rates: float) -> List[Dict[str, Any]]:
+    return EventGenerator(seed, **rates).events(count)
+
+
+def subscription_payload(
+    events: List[Dict[str, Any]], owner: str = "123456789012", log_group: str = "aws-cloudtrail-logs"
+) -> Dict[str, Any]:
+    """CloudWatch Logs subscription event with the events as log events, as the Lambda receives it."""
+    payload = {
+        "messageType": "DATA_MESSAGE",
+        "owner": owner,
+        "logGroup": log_group,
+        "logStream": f"{owner}_CloudTrail_eu-central-1",
+        "subscriptionFilters": ["cloudtrail-to-slack"],
+        "logEvents": [
+            {"id": str(position), "timestamp": 1714521600000 + position, "message": json.dumps(event)}
+            for position, event in enumerate(events)
+        ],
+    }
+    return {"awslogs": {"data": base64.b64encode(gzip.compress(json.dumps(payload).encode())).decode()}}
+
+
+def subscription_payloads(events: List[Dict[str, Any]], events_per_payload: int = 100) -> Iterator[Dict[str, Any]]:
+    for start in range(0, len(events), events_per_payload):
+        yield subscription_payload(events[start:start + events_per_payload])
+
+
+def synthetic_rules(count: int, seed: int = 0) -> List[str]:
+    """Rules in the shapes of the default rules, on calls that occur in the generated events."""
+    generator = random.Random(seed)
+    calls = [(source, name) for table in (READ_CALLS, WRITE_CALLS) for source, names in sorted(table.items()) for name in names]
+    rules = []
+    for number in range(count):
+        event_source, event_name = generator.choice(calls)
+        shape = number % 4
+        if shape == 0:
+            rules.append(f'event.get("eventSource", "") == "{event_source}" and event.get("eventName", "") == "{event_name}-{number}"')
+        elif shape == 1:
+            rules.append(f'event.get("eventName", "") == "{event_name}" and event.get("userIdentity.type", "") == "IAMUser" '
+                         f'and event.get("awsRegion", "") == "ap-south-{number}"')
+        elif shape == 2: # noqa: PLR2004
+            rules.append(f'event.get("errorCode", "") == "Throttling{number}"')
+        else:
+            rules.append(f'event.get("eventSource", "") == "{event_source}" and "tag-{number}" in event.get("requestParameters.tags", "")')
+    return rules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--payloads", action="store_true", help="one subscription payload per line instead of one event per line")
+    parser.add_argument("--events-per-payload", type=int, default=100)
+    args = parser.parse_args()
+    events = generate_events(args.count, args.seed)
+    lines = subscription_payloads(events, args.events_per_payload) if args.payloads else events
+    for line in lines:
+        sys.stdout.write(json.dumps(line) + "\n")
+
+
+if __name__ == "__main__":
+    main()
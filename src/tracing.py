@@ -0,0 +1,131 @@
+"""
+Timing of the stages of an invocation: decoding the payload, evaluating rules, building the Slack message,
+SNS, DynamoDB and posting to Slack.
+
+Stages are timed with `with tracing.span("stage"):`. The tracer in use is the no-op tracer unless an
+invocation installs another one with `tracing.use(...)`, which also applies to the delivery threads.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+# stages in pipeline order, used to order the summary
+STAGES = ("decode", "rules", "slack_message", "sns", "dynamodb", "slack_post")
+
+
+class _NoopSpan:
+    def __enter__(self) -> None: # noqa: ANN101
+        return None
+
+    def __exit__(self, *exc_info: object) -> None: # noqa: ANN101
+        return None
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Tracer that records nothing, spans cost one call."""
+
+    def span(self, stage: str) -> Any: # noqa: ANN101, ANN401, ARG002
+        return _NOOP_SPAN
+
+    def record(self, stage: str, seconds: float) -> None: # noqa: ANN101
+        pass
+
+
+class _Span:
+    __slots__ = ("_tracer", "_stage", "_start")
+
+    def __init__(self, tracer: "CollectingTracer", stage: str) -> None: # noqa: ANN101
+        self._tracer = tracer
+        self._stage = stage
+
+    def __enter__(self) -> None: # noqa: ANN101
+        self._start = self._tracer.clock()
+
+    def __exit__(self, *exc_info: object) -> None: # noqa: ANN101
+        self._tracer.record(self._stage, self._tracer.clock() - self._start)
+
+
+class CollectingTracer(Tracer):
+    """Keeps the duration of every span in memory, one instance per invocation."""
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter) -> None: # noqa: ANN101
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.durations: Dict[str, List[float]] = {}
+
+    def span(self, stage: str) -> _Span: # noqa: ANN101
+        return _Span(self, stage)
+
+    def record(self, stage: str, seconds: float) -> None: # noqa: ANN101
+        with self._lock:
+            self.durations.setdefault(stage, []).append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]: # noqa: ANN101
+        """Count, total, p50 and p99 in milliseconds per stage."""
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self.durations.items()}
+        order = {stage: position for position, stage in enumerate(STAGES)}
+        return {
+            stage: {
+                "count": len(values),
+                "total_ms": round(sum(values) * 1000, 3),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3),
+            }
+            for stage, values in sorted(durations.items(), key=lambda item: (order.get(item[0], len(STAGES)), item[0]))
+        }
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """Nearest rank percentile of sorted values, 0 for no values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+
+NOOP_TRACER = Tracer()
+_tracer: Tracer = NOOP_TRACER
+
+
+def span(stage: str) -> Any: # noqa: ANN401
+    return _tracer.span(stage)
+
+
+_END: Any = object()
+
+
+def timed(stage: str, items: Iterable[T]) -> Iterator[T]:
+    """Yields the items of a lazy iterable, the time to produce each one is a span of the stage."""
+    iterator = iter(items)
+    while True:
+        span = _tracer.span(stage)
+        span.__enter__()
+        item = next(iterator, _END)
+        if item is _END:
+            # reaching the end is not a span, the count of the stage is the number of items
+            return
+        span.__exit__(None, None, None)
+        yield item
+
+
+def set_tracer(tracer: Tracer) -> Tracer:
+    """Installs the tracer for all threads and returns the one it replaces."""
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+@contextmanager
+def use(tracer: Tracer) -> Iterator[Tracer]:
+    previous = set_tracer(tracer)
+    try:
+        yield tracer
+    finally:
+        set_tracer(previous)
@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread safe LRU cache whose entries expire after the time given when they are set."""
+
+    def __init__(self, maxsize: int, clock: Callable[[], float] = time.monotonic) -> None: # noqa: ANN101
+        self.maxsize = maxsize
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any: # noqa: ANN101, ANN401
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def __contains__(self, key: Hashable) -> bool: # noqa: ANN101
+        return self.get(key, _MISSING) is not _MISSING
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None: # noqa: ANN101, ANN401
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None: # noqa: ANN101
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int: # noqa: ANN101
+        return len(self._entries)
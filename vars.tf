@@ -15,6 +15,12 @@ variable "configuration" {
   default = null
 }
 
+variable "config_cache_ttl_seconds" {
+  description = "Seconds a warm Lambda keeps the Slack configuration, bot token and rules parameter before reading them again. Only a new parameter version rebuilds the routing table or the rules. The Parameters and Secrets extension caches values for its own TTL on top of this. 0 reads them once per Lambda instance"
+  type        = number
+  default     = 300
+}
+
 variable "default_slack_hook_url" {
   description = "The Slack incoming webhook URL to be used if the AWS account ID does not match any account ID in the configuration variable."
   type        = string
@@ -153,6 +159,23 @@ variable "tags" {
   type        = map(string)
 }
 
+variable "rule_engine" {
+  description = "How rules are evaluated. \"ast\" accepts event.get, event[...], ==, !=, in, not in, and, or, not, startswith and endswith and rejects other rules when they are loaded. \"eval\" runs rules as any Python expression"
+  default     = "ast"
+  type        = string
+
+  validation {
+    condition     = contains(["ast", "eval"], var.rule_engine)
+    error_message = "rule_engine must be \"ast\" or \"eval\"."
+  }
+}
+
+variable "rules_ssm_parameter_name" {
+  description = "Name of an existing SSM parameter with more rules, as JSON object {\"rules\": [...], \"ignore_rules\": [...]}. They are added to the other rules and read again after config_cache_ttl_seconds, so rules can be changed without deploying the Lambda"
+  default     = null
+  type        = string
+}
+
 variable "rules_separator" {
   description = "Custom rules separator. Can be used if there are commas in the rules"
   default     = ","
@@ -171,6 +194,66 @@ variable "rule_evaluation_errors_to_slack" {
   type        = bool
 }
 
+variable "rule_metrics" {
+  description = "Write evaluations, matches, errors and evaluation time of every rule as CloudWatch metrics in Embedded Metric Format. Every rule that is evaluated is a custom metric with its own cost"
+  default     = false
+  type        = bool
+}
+
+variable "stage_timings" {
+  description = "Log the time spent decoding, evaluating rules, building Slack messages, in SNS, DynamoDB and Slack calls with p50 and p99 at the end of every invocation"
+  default     = false
+  type        = bool
+}
+
+variable "coalesce_alerts" {
+  description = "Send one Slack message with the number of occurrences, time range and some event ids for matching events of one invocation with the same account, actor and event name. SNS still gets every event"
+  default     = false
+  type        = bool
+}
+
+variable "digest_rules" {
+  description = "Rules, separated like the other rules, for noisy events that are counted per account and rule instead of being sent one by one. One Slack message per channel sums them up after every digest window. Only applies to events no other rule matches. SNS still gets every event"
+  default     = ""
+  type        = string
+}
+
+variable "digest_window_seconds" {
+  description = "Length of the window digest rule matches are counted in before they are summed up in Slack"
+  default     = 3600
+  type        = number
+}
+
+variable "principal_alert_limit" {
+  description = "Slack alerts per principal, the account and ARN of the userIdentity, that refill over principal_alert_window_seconds. Alerts above it are not posted, one message per principal and window tells how many were suppressed. SNS still gets every event. 0 disables the limit"
+  default     = 0
+  type        = number
+}
+
+variable "principal_alert_window_seconds" {
+  description = "Window of principal_alert_limit, also how often the number of suppressed alerts of a principal is posted"
+  default     = 300
+  type        = number
+}
+
+variable "principal_throttle_shared" {
+  description = "Count the alerts per principal in the DynamoDB table, so principal_alert_limit holds across all Lambda containers instead of per container"
+  default     = false
+  type        = bool
+}
+
+variable "pre_parse_filter" {
+  description = "Skip parsing of CloudTrail records that can not match any rule. Only applies if every rule starts with a test on eventName, eventSource, errorCode or userIdentity.type. Ignore rules are not evaluated for skipped records"
+  default     = false
+  type        = bool
+}
+
+variable "delivery_concurrency" {
+  description = "Number of matching records whose SNS, DynamoDB and Slack calls run concurrently. Messages for the same Slack thread are still sent in order. 1 delivers records one after another"
+  default     = 1
+  type        = number
+}
+
 variable "dynamodb_time_to_live" {
   description = "How long to keep cloudtrail events in dynamodb table, for collecting similar events in thread of one message"
   default     = 900